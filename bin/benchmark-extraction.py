@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) 2015 Louis Dijkstra
+
+This file is part of somatic-indel-calling
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function, division
+from optparse import OptionParser
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__))[:-3] + 'python')
+from Indel import *
+from DefaultBAMProcessor import *
+from LaserBAMProcessor import *
+from BWABAMProcessor import *
+
+__author__ = "Louis Dijkstra"
+
+usage = """%prog [options] <aligner> <vcf-file> <bam-file>
+
+	<aligner>	the aligner that was used (laser, bwa or
+			default).
+	<vcf-file> 	sorted VCF file containing the indels.
+	<bam-file>	sorted and indexed BAM file.
+
+Benchmarks the extraction of observations (see 'extract-observations.py')
+for one BAM file. The observations are extracted in four ways: by 
+fetching the alignments for every variant separately, by sweeping over
+the BAM file (option --sweep of 'extract-observations.py'), by 
+streaming through the BAM file once (option --engine stream) and by 
+sweeping while processing the alignments in NumPy arrays (options 
+--sweep and --columnar). For every mode, the number of alignments decoded per variant and the running time 
+are reported. The program checks whether all modes result in exactly the
+same observations.
+"""
+
+MODES = ['fetch', 'sweep', 'stream', 'columnar']
+
+def returnBAMProcessor(aligner, bam_filename, search_range, mode):
+	"""Returns the BAM processor associated with the aligner for the given mode."""
+	sweep, columnar = mode == 'sweep' or mode == 'columnar', mode == 'columnar'
+	if aligner == 'laser':
+		return LaserBAMProcessor(bam_filename, search_range = search_range, sweep = sweep, columnar = columnar)
+	if aligner == 'bwa' or aligner == 'bwamemm':
+		return BWABAMProcessor(bam_filename, search_range = search_range, sweep = sweep, columnar = columnar)
+	if aligner == 'default':
+		return DefaultBAMProcessor(bam_filename, search_range = search_range, sweep = sweep, columnar = columnar)
+	return None
+
+def extractObservations(bam_processor, indels, mode):
+	"""Extracts the observations for every indel. Returns the observations 
+	   formatted as in the .raw-observations file."""
+	if mode == 'stream':
+		data = bam_processor.processIndels(indels)
+	else:
+		data = [bam_processor.processIndel(indel) for indel in indels]
+	return ['\n'.join(['\t'.join(map(str, values)) for values in observations]) for observations in data]
+
+def main():
+
+	parser = OptionParser(usage=usage)
+	parser.add_option("-r", action="store", dest="search_range", default=5000, type=int,
+						help="Range to search for potentially relevant reads (Default = 5000 bp)")
+	(options, args) = parser.parse_args()
+
+	if (len(args)!=3):
+		parser.print_help()
+		return 1
+
+	aligner 	= args[0].lower()
+	vcf_filename 	= os.path.abspath(args[1])
+	bam_filename 	= os.path.abspath(args[2])
+
+	if returnBAMProcessor(aligner, bam_filename, options.search_range, MODES[0]) == None:
+		print('ERROR: aligner %s was not recognized. Options are: laser, bwa or default'%aligner)
+		return 1
+
+	indels 	= list(readIndels(vcf_filename))
+	n 	= len(indels)
+
+	results = dict()
+	print("mode\tvariants\tdecoded\tdecoded/variant\tseconds")
+	for mode in MODES:
+		bam_processor 	= returnBAMProcessor(aligner, bam_filename, options.search_range, mode)
+		start_time 	= time.time()
+		results[mode] 	= extractObservations(bam_processor, indels, mode)
+		elapsed_time 	= time.time() - start_time
+		n_decoded 	= bam_processor.returnNumberOfDecodedAlignments()
+		bam_processor.close()
+		print("%s\t%d\t%d\t%.1f\t%.2f"%(mode, n, n_decoded, n_decoded / max(n, 1), elapsed_time))
+
+	for mode in MODES[1:]:
+		if results[mode] != results[MODES[0]]:
+			print("ERROR: the observations differ between the modes %s and %s."%(MODES[0], mode))
+			return 1
+	print("The observations are identical for all modes.")
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -3,21 +3,37 @@ from __future__ import print_function, division
 from optparse import OptionParser
 import os
 import sys
-import vcf
+import numpy as np
+import pysam
 
 sys.path.insert(0, os.path.abspath(os.path.dirname(__file__))[:-3] + 'python')
 from Indel import *
 
 __author__ = "Louis Dijkstra"
 
+CALLS_CHUNK_SIZE = 100000 # number of calls parsed at once (see readCalls)
+
 usage = """%prog [options] <vcf-file> <calls-file> <new-vcf-file> 
 
-	<vcf-file> 	tabix-indexed VCF file 
+	<vcf-file> 	VCF file (possibly bgzipped) with the indels
 	<calls-file>	output file generated by sm_caller 
 	<new-vcf-file> 	annoted VCF file
 
 Annotates the given VCF file with the results generated by the sm_caller 
 application. Outputs somatic calls only! 
+
+The threshold on the somatic posterior probability maximizes the expected
+F-score. By default, the calls are read once and kept in memory. For calls
+files that do not fit in memory, the option -H reads the calls file twice
+in chunks and determines the threshold from a histogram of the posterior
+probabilities with the given number of bins instead.
+
+The records of the somatic calls are looked up by their chromosome,
+position, type and length in the table of the indels in the VCF file
+(indels with the same key are assigned in order), which is stored next
+to the VCF file (<vcf-file>.npz; see IndelTable in python/Indel.py) and
+shared with 'extract-observations.py'. The table refers to the offset of
+every record, so that only the records of the somatic calls are read.
 """
 
 header = """##INFO=<ID=END,Number=1,Type=Integer,Description="End position of the variant described in this record">
@@ -30,61 +46,153 @@ def printHeader(outputfile, source="POSOM"):
 	print("##source=%s"%source, file=outputfile)
 	print("%s"%header, file=outputfile)
 
-def determinePosteriorProbabilityThreshold(calls_filename, beta, verbose=False): 
+def returnChunk(chromosomes, positions, variant_types, lengths, somatic_posterior_probabilities, invalid_line=None):
+	"""Returns the calls in a chunk as arrays (see readCalls)."""
+	return (np.array(chromosomes, dtype=object), np.array(positions, dtype=np.int64), 
+		np.array(variant_types, dtype='S1'), np.array(lengths, dtype=np.int64), 
+		np.array(somatic_posterior_probabilities, dtype=np.float64), invalid_line)
+
+def readCalls(calls_file, chunk_size=CALLS_CHUNK_SIZE):
+	"""Generator over the calls in an output file of sm_caller in chunks of 
+	   at most chunk_size calls. Returns for every chunk the chromosomes, 
+	   positions, types ('-' or '+'), lengths and somatic posterior 
+	   probabilities (NaN when not computed) as arrays. Several indels can 
+	   share a position, so a call is identified by all four. Reading stops at the first line that does not contain 10 
+	   values; the last chunk also returns its line number and the line 
+	   itself (None when there is no such line)."""
+	chromosomes, positions, variant_types, lengths, somatic_posterior_probabilities = [], [], [], [], []
+	names = {} # every chromosome name is stored once
+	for n, line in enumerate(calls_file, 1):
+		values 	= line.split('\t')
+		if len(values) != 10:
+			yield returnChunk(chromosomes, positions, variant_types, lengths, somatic_posterior_probabilities, (n, line))
+			return
+		chromosomes.append(names.setdefault(values[1], values[1]))
+		positions.append(int(values[2]))
+		variant_types.append(values[0])
+		lengths.append(int(values[3]))
+		somatic_posterior_probabilities.append(float(values[7]) if values[7].strip() != '.' else np.nan)
+		if len(positions) == chunk_size:
+			yield returnChunk(chromosomes, positions, variant_types, lengths, somatic_posterior_probabilities)
+			chromosomes, positions, variant_types, lengths, somatic_posterior_probabilities = [], [], [], [], []
+	yield returnChunk(chromosomes, positions, variant_types, lengths, somatic_posterior_probabilities)
+
+def returnCalls(calls_file):
+	"""Reads all calls at once (see readCalls). Returns one chunk."""
+	chunks = list(readCalls(calls_file))
+	return tuple(np.concatenate([chunk[i] for chunk in chunks]) for i in range(5)) + (chunks[-1][5],)
+
+def returnRecord(vcf_file, indel_table, i):
+	"""Returns the record of the i-th indel in the table (see IndelTable)."""
+	vcf_file.seek(int(indel_table.offset[i]))
+	return next(vcf_file)
+
+def determinePosteriorProbabilityThreshold(somatic_posterior_probabilities, beta, verbose=False): 
 	"""Determines the posterior probability threshold for calling
 	   something somatic by maximizing the posterior expected
-	   F_beta score for classifying items as somatic/not somatic."""
+	   F_beta score for classifying items as somatic/not somatic. 
+	   When the k largest probabilities are called somatic, the score is 
+	   (1 + beta^2) S_k / (beta^2 S_n + k), where S_k is the sum of the k 
+	   largest probabilities."""
 
-	if verbose: print("Reading in all somatic posterior probabilities") 
+	somatic_posterior_probabilities = somatic_posterior_probabilities[~np.isnan(somatic_posterior_probabilities)]
+	if len(somatic_posterior_probabilities) == 0: 
+		return 1.0 # nothing to call
 
-	calls_file = open(calls_filename, 'r')
+	if verbose: print("Sorting all probabilities...")
 
-	n = 0 
-	somatic_posterior_probabilities = [] 
-	for line in calls_file: # get the posterior probabilities 
-		values 	= line.split('\t')
-		if len(values) != 10:
-			break 
-		if values[7].strip() != '.':	
-			somatic_posterior_probabilities.append(float(values[7]))
-			n += 1
-
-	if verbose: 
-		print("DONE Reading in all somatic posterior probabilities") 
-		print("Sorting all probabilities...")
-
-	somatic_posterior_probabilities.sort(reverse=True)
+	somatic_posterior_probabilities = np.sort(somatic_posterior_probabilities)[::-1]
 
 	if verbose: 
 		print("DONE Sorting all probabilities...")
 		print("Maximizing expected posterior F-score (beta is set to %f)"%beta)
 
-	# initialization
-	beta2		= beta**2		
-	S_n 		= beta2*sum(somatic_posterior_probabilities)
-	S_k 		= somatic_posterior_probabilities[0]
-	max_f_score 	= (1.0 + beta2) * S_k / (S_n + 1.0) # F-beta score for k = 1
-	threshold	= S_k
-
-	for k in range(2,n+1):
-		S_k += somatic_posterior_probabilities[k-1] 
-		f_score = (1.0 + beta2) * S_k / (S_n + k)
-		#print("%d\t%f\t%f"%(k, f_score, somatic_posterior_probabilities[k-1]))
-		if f_score > max_f_score:
-			max_f_score = f_score
-			threshold = somatic_posterior_probabilities[k-1] 
+	beta2		= beta**2
+	S_k 		= np.cumsum(somatic_posterior_probabilities)
+	f_scores 	= (1.0 + beta2) * S_k / (beta2 * S_k[-1] + np.arange(1, len(S_k) + 1))
+	threshold 	= somatic_posterior_probabilities[np.argmax(f_scores)] # the first k in case of ties
 
 	if verbose: print("Threshold is set to %f"%threshold) 
-	
-	calls_file.close()
 
 	return threshold 
 
+def newHistogram(n_bins):
+	"""Returns an empty histogram of the probabilities in [0, 1]: the number of 
+	   probabilities, their sum and their minimum per bin."""
+	return np.zeros(n_bins, dtype=np.int64), np.zeros(n_bins), np.ones(n_bins)
+
+def updateHistogram(histogram, somatic_posterior_probabilities):
+	"""Adds the probabilities (except for NaNs) to the histogram."""
+	counts, sums, minima = histogram
+	somatic_posterior_probabilities = somatic_posterior_probabilities[~np.isnan(somatic_posterior_probabilities)]
+	bins = np.clip((somatic_posterior_probabilities * len(counts)).astype(np.intp), 0, len(counts) - 1)
+	counts 	+= np.bincount(bins, minlength=len(counts))
+	sums 	+= np.bincount(bins, weights=somatic_posterior_probabilities, minlength=len(counts))
+	np.minimum.at(minima, bins, somatic_posterior_probabilities)
+
+def determineHistogramThreshold(histogram, beta, verbose=False): 
+	"""Determines the posterior probability threshold like 
+	   determinePosteriorProbabilityThreshold, where the probabilities
+	   in one bin of the histogram are either all called somatic or not.
+	   The F_beta score is exact for these thresholds; the threshold is 
+	   the smallest probability in the lowest bin that is called."""
+	counts, sums, minima = histogram
+	bins = np.nonzero(counts)[0][::-1] # from high to low probabilities 
+	if len(bins) == 0: 
+		return 1.0 # nothing to call
+
+	if verbose: print("Maximizing expected posterior F-score over %d bins (beta is set to %f)"%(len(counts), beta))
+
+	beta2		= beta**2
+	S_k 		= np.cumsum(sums[bins])
+	f_scores 	= (1.0 + beta2) * S_k / (beta2 * S_k[-1] + np.cumsum(counts[bins]))
+	threshold 	= minima[bins[np.argmax(f_scores)]]
+
+	if verbose: print("Threshold is set to %f"%threshold) 
+
+	return threshold 
+
+def writeCalls(chunks, posterior_threshold, vcf_file, indel_table, new_vcf_file, verbose=False):
+	"""Writes the somatic calls to the new VCF file. The calls are looked up 
+	   in the table of indels per chunk by their chromosome, position, type 
+	   and length, and only the records of the somatic calls are read from 
+	   the VCF file (see returnRecord). Returns 1 when the calls file contains 
+	   a line that is not a call or a somatic call that is not in the VCF file, 
+	   0 otherwise."""
+	n, seen = 0, dict() # indels with the same key are assigned in order (see IndelTable.returnIndices)
+	for chromosomes, positions, variant_types, lengths, somatic_posterior_probabilities, invalid_line in chunks: 
+		indices = indel_table.returnIndices(chromosomes, positions, variant_types, lengths, seen = seen)
+		somatic = np.flatnonzero(somatic_posterior_probabilities >= posterior_threshold) # False when not computed (NaN)
+		for k, i in zip(somatic.tolist(), indices[somatic].tolist()): 
+			if i == -1:
+				print("ERROR: the VCF file does not contain the variant on line number %d (%s:%d)."%(n + k + 1, chromosomes[k], positions[k]))
+				return 1
+			vcf_record = returnRecord(vcf_file, indel_table, i)
+			length = int(indel_table.length[i])
+			print("%s\t%s\t.\t%s\t%s\t.\tPASS\tSOMATIC;END=%d;SVLEN=%d"%(
+				vcf_record.chrom,
+				vcf_record.pos,
+				vcf_record.ref,
+				vcf_record.alts[0],
+				indel_table.end[i],
+				-1 * length if indel_table.variant_type[i] == b'-' else length), file=new_vcf_file)
+		n += len(positions)
+
+		if verbose: 
+			print("Processed %d variants"%n)
+
+		if invalid_line != None: 
+			print("ERROR: line number %d does not contain 10 values as required. The line in question is:\n\t%s\n"%invalid_line)
+			return 1 
+	return 0
+
 def main():
 
 	parser = OptionParser(usage=usage)
 	parser.add_option("-b", action="store", dest="beta", type=float, default=1.0,
                       		help="Beta value of the F-score metric. (Default = 1.0)")
+	parser.add_option("-H", action="store", dest="n_bins", type=int, default=None,
+                      		help="Uses bounded memory: the threshold is determined from a histogram with this number of bins (e.g., 100000). (Default = all calls are kept in memory)")
 	parser.add_option("-s", action="store", dest="source", default="POSOM",
                       		help="Source used for the VCF file header. (Default = POSOM)")
 	parser.add_option("-v", action="store_true", dest="verbose", default=False,
@@ -95,75 +203,36 @@ def main():
 		parser.print_help()
 		return 1
 
-	vcf_reader		= vcf.Reader(open(os.path.abspath(args[0])))
+	vcf_filename 		= os.path.abspath(args[0])
+	indel_table 		= returnIndelTable(vcf_filename) # the table is stored next to the VCF file (see Indel.py)
+	vcf_file 		= pysam.VariantFile(vcf_filename)
 	calls_filename 		= os.path.abspath(args[1])
 	new_vcf_file 		= open(os.path.abspath(args[2]), 'w')
 
 	printHeader(new_vcf_file, source=options.source)
 
-	posterior_threshold = determinePosteriorProbabilityThreshold(calls_filename, options.beta, verbose=options.verbose)
-
-	calls_file = open(calls_filename, 'r') 
-	variant_description = '' 
-	n = 0 
-	for line in calls_file: 
-		n += 1 
-		values 	= line.split('\t')
-		
-		if len(values) != 10: 
-			print("ERROR: line number %d does not contain 10 values as required. The line in question is:\n\t%s\n"%(n, line))
-			return 1 
-
-		if options.verbose and n % 1000 == 0: 
-			print("Processed %d variants"%n)
-
-		position 	= int(values[2])
-
-		call = 'UNKNOWN'
-		post_prob_call = 'NONE'
-		h_vaf, c_vaf, max_logl = 'NONE', 'NONE', 'NONE' 
-		p_somatic, p_germline, p_not_present = 'NONE', 'NONE', 'NONE'
-	
-		if values[4].strip() != '.':	h_vaf 		= float(values[4])
-		if values[5].strip() != '.': 	c_vaf 		= float(values[5])
-		if values[6].strip() != '.':	max_logl	= float(values[6])
-		if values[7].strip() != '.':	p_somatic 	= float(values[7])
-		if values[8].strip() != '.':	p_germline 	= float(values[8])
-		if values[9].strip() != '.':	p_not_present 	= float(values[9])
-		
-		if not (p_somatic is 'NONE' and p_germline is 'NONE' and p_not_present is 'NONE'):
-			if p_somatic >= posterior_threshold: 
-				call = 'SOMATIC'
-			else: 
-				call = 'NOT-SOMATIC'  
-
-		vcf_record = vcf_reader.next() 
-		while (vcf_record.POS != position):
-			vcf_record = vcf_reader.next()
-
-		if call == 'SOMATIC': 
-			svlen = returnIndelLength(vcf_record)
-			if isDeletion(vcf_record): 
-				end = vcf_record.POS + svlen 
-				variant_description = "%s\t%s\t.\t%s\t%s\t.\tPASS\tSOMATIC;END=%d;SVLEN=%d"%(
-					vcf_record.CHROM,
-					vcf_record.POS,
-					vcf_record.REF,
-					vcf_record.ALT[0],
-					vcf_record.POS + svlen,
-					-1 * svlen)
-			elif isInsertion(vcf_record):
-				variant_description =  "%s\t%s\t.\t%s\t%s\t.\tPASS\tSOMATIC;END=%d;SVLEN=%d"%(
-					vcf_record.CHROM,
-					vcf_record.POS,
-					vcf_record.REF,
-					vcf_record.ALT[0],
-					vcf_record.POS,
-					svlen)
-			print("%s"%variant_description, file=new_vcf_file)
-
+	if options.n_bins == None: # the calls are read once and kept in memory 
+		if options.verbose: print("Reading in all calls") 
+		calls_file 		= open(calls_filename, 'r')
+		calls 			= returnCalls(calls_file)
+		posterior_threshold 	= determinePosteriorProbabilityThreshold(calls[4], options.beta, verbose=options.verbose)
+		chunks 			= [calls]
+	else: # the calls are read twice in chunks 
+		if options.verbose: print("Computing the histogram of all somatic posterior probabilities") 
+		histogram 		= newHistogram(options.n_bins)
+		calls_file 		= open(calls_filename, 'r')
+		for chromosomes, positions, variant_types, lengths, somatic_posterior_probabilities, invalid_line in readCalls(calls_file):
+			updateHistogram(histogram, somatic_posterior_probabilities)
+		calls_file.close()
+		posterior_threshold 	= determineHistogramThreshold(histogram, options.beta, verbose=options.verbose)
+		calls_file 		= open(calls_filename, 'r')
+		chunks 			= readCalls(calls_file)
+
+	status = writeCalls(chunks, posterior_threshold, vcf_file, indel_table, new_vcf_file, verbose=options.verbose)
 	calls_file.close()
-	new_vcf_file.close()	 
+	vcf_file.close()
+	new_vcf_file.close()
+	return status
 
 if __name__ == '__main__':
 	sys.exit(main())
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) 2015 Louis Dijkstra
+
+This file is part of somatic-indel-calling
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function, division
+from optparse import OptionParser
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__))[:-3] + 'python')
+from Observations import *
+from Likelihood import *
+
+__author__ = "Louis Dijkstra"
+
+usage = """%prog [options] <observations-file> <calls-file>
+
+	<observations-file> 	observations file (text, possibly BGZF-
+				compressed, or binary)
+	<calls-file> 		output of 'sm_caller' for the observations
+				file
+
+Recomputes the calls for the observations file with the NumPy
+implementation of the likelihood model (python/Likelihood.py) and
+compares them with the calls of 'sm_caller'. The model parameters
+need to be the same as the ones passed to 'sm_caller'; the options
+below have the same meaning.
+
+Two calls are considered equal when h_vaf, the loglikelihood and the
+posterior probabilities differ at most by the tolerance (-t; relative
+for the loglikelihood) and c_vaf differs at most by the tolerance of
+the minimizer (-P). Any differences are printed to standard output.
+Returns 1 when the calls differ, 0 otherwise.
+"""
+
+def returnCall (variant, parameters, options):
+	"""Returns the call for the variant (see callVariant) taking the options of sm_caller into account."""
+	variant_type, chromosome, position, length, healthy_observations, cancer_observations = variant
+	if (options.deletions_only and variant_type == '+') or (options.insertions_only and variant_type == '-') or length < options.min_length:
+		return None
+	observations = []
+	for (isize, isize_prob, splits, splits_prob) in (healthy_observations, cancer_observations):
+		if options.split_only: isize, isize_prob = [], []
+		if options.isize_only: splits, splits_prob = [], []
+		if options.align_uncertainty_off: isize_prob, splits_prob = [1.0] * len(isize), [1.0] * len(splits)
+		observations.append((isize, isize_prob, splits, splits_prob))
+	return callVariant(variant_type, length, observations[0], observations[1], parameters)
+
+def readCalls (calls_file):
+	"""Generator over the calls in an output file of sm_caller. Returns the fields of every call."""
+	for line in calls_file:
+		values = line.split()
+		if len(values) == 10: # skips any messages
+			yield values
+
+def equalCalls (values, call, options):
+	"""Returns True when the call of sm_caller (values) and the Python call are considered equal."""
+	if call == None:
+		return values[4:] == ['.'] * 6
+	if values[4] == '.':
+		return False
+	h_vaf, c_vaf, logl, p_somatic, p_germline, p_not_present = map(float, values[4:])
+	if abs(c_vaf - call[1]) > options.epsabs + 1e-6: # the output of sm_caller is rounded to 6 decimals
+		return False
+	if abs(logl - call[2]) > options.tolerance * max(1.0, abs(logl)):
+		return False
+	return max([abs(float(value) - computed) for (value, computed) in zip((h_vaf, p_somatic, p_germline, p_not_present), (call[0],) + call[3:])]) <= options.tolerance
+
+def main():
+
+	parser = OptionParser(usage=usage)
+	parser.add_option("--solver", action="store", dest="solver", default="brent", choices=["brent", "newton"],
+						help="Solver used for the MLE of c_vaf: brent or newton (see sm_caller -S). (Default = brent)")
+	parser.add_option("-a", action="store", dest="alpha", default=0.0, type=float,
+						help="Level of impurity in the cancer sample (alpha). (Default = 0.0)")
+	parser.add_option("-B", action="store_true", dest="split_only", default=False,
+						help="Only split reads are taken into account.")
+	parser.add_option("-d", action="store_true", dest="deletions_only", default=False,
+						help="Only deletions are called.")
+	parser.add_option("-e", action="store", dest="eps_p_del", default=0.0961, type=float,
+						help="Probability of a split presence when a deletion is there. (Default = 0.0961)")
+	parser.add_option("-E", action="store", dest="eps_p_ins", default=0.3457, type=float,
+						help="Probability of a split presence when an insertion is there. (Default = 0.3457)")
+	parser.add_option("-f", action="store", dest="mu_h", default=None, type=float,
+						help="Mean of insert sizes when the indel is absent (healthy sample).")
+	parser.add_option("-F", action="store", dest="mu_c", default=None, type=float,
+						help="Mean of insert sizes when the indel is absent (cancer sample).")
+	parser.add_option("-g", action="store", dest="sigma_h", default=None, type=float,
+						help="STD of insert sizes when the indel is absent (healthy sample).")
+	parser.add_option("-G", action="store", dest="sigma_c", default=None, type=float,
+						help="STD of insert sizes when the indel is absent (cancer sample).")
+	parser.add_option("-i", action="store_true", dest="insertions_only", default=False,
+						help="Only insertions are called.")
+	parser.add_option("-I", action="store_true", dest="isize_only", default=False,
+						help="Only insert sizes are taken into account.")
+	parser.add_option("-l", action="store", dest="min_length", default=0, type=int,
+						help="Minimal length of the indels. (Default = 0)")
+	parser.add_option("-m", action="store", dest="mu", default=112.0, type=float,
+						help="Mean of insert sizes when the indel is absent (both samples). (Default = 112.0)")
+	parser.add_option("-M", action="store", dest="max_iter", default=100, type=int,
+						help="Maximal number of iterations of the minimizer. (Default = 100)")
+	parser.add_option("-o", action="store", dest="output_filename", default=None,
+						help="Writes the calls computed in Python (in the format of sm_caller) to this file.")
+	parser.add_option("-P", action="store", dest="epsabs", default=0.0001, type=float,
+						help="Absolute tolerance of the minimizer. (Default = 0.0001)")
+	parser.add_option("-r", action="store", dest="rate", default=0.0, type=float,
+						help="Error rate for the insert size model (both samples). (Default = 0.0)")
+	parser.add_option("-s", action="store", dest="sigma", default=15.0, type=float,
+						help="STD of insert sizes when the indel is absent (both samples). (Default = 15.0)")
+	parser.add_option("-t", action="store", dest="tolerance", default=1e-5, type=float,
+						help="Tolerance used for comparing the calls (see above). (Default = 1e-5)")
+	parser.add_option("-u", action="store_true", dest="align_uncertainty_off", default=False,
+						help="Alignment uncertainty is ignored.")
+	parser.add_option("-y", action="store", dest="eps_a", default=0.0001, type=float,
+						help="Probability of a split absence when an indel is there. (Default = 0.0001)")
+	(options, args) = parser.parse_args()
+
+	if (len(args)!=2):
+		parser.print_help()
+		return 1
+
+	observations_file 	= os.path.abspath(args[0])
+	calls_file 		= open(os.path.abspath(args[1]), 'r')
+
+	parameters = ModelParameters(alpha = options.alpha, eps_a = options.eps_a, eps_p_del = options.eps_p_del, eps_p_ins = options.eps_p_ins,
+					mu_h = options.mu if options.mu_h == None else options.mu_h, mu_c = options.mu if options.mu_c == None else options.mu_c,
+					sigma_h = options.sigma if options.sigma_h == None else options.sigma_h, sigma_c = options.sigma if options.sigma_c == None else options.sigma_c,
+					rate_h = options.rate, rate_c = options.rate, max_iter = options.max_iter, epsabs = options.epsabs, solver = options.solver)
+
+	if isBinaryObservationsFile(observations_file):
+		variants = iter(ObservationsReader(observations_file))
+	else:
+		variants = readRawObservations(openRawObservations(observations_file))
+
+	output_file = None
+	if options.output_filename != None:
+		output_file = open(options.output_filename, 'w')
+
+	n_variants, n_differences, start = 0, 0, time.time()
+	for values in readCalls(calls_file):
+		variant = next(variants, None)
+		if variant == None:
+			print('ERROR: the calls file contains more variants than the observations file.')
+			return 1
+		if values[1] != str(variant[1]) or int(values[2]) != variant[2]:
+			print('ERROR: the calls file does not match the observations file (%s:%s versus %s:%d).'%(values[1], values[2], variant[1], variant[2]))
+			return 1
+		call = returnCall(variant, parameters, options)
+		if output_file != None:
+			output_file.write(formatCall(variant[0], variant[1], variant[2], variant[3], call))
+		n_variants += 1
+		if not equalCalls(values, call, options):
+			n_differences += 1
+			print('sm_caller:\t' + '\t'.join(values))
+			print('python:\t\t' + formatCall(variant[0], variant[1], variant[2], variant[3], call), end = '')
+
+	print('%d variants compared in %.2f seconds, %d differ.'%(n_variants, time.time() - start, n_differences))
+	if output_file != None:
+		output_file.close()
+	return 1 if n_differences > 0 else 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -23,37 +23,40 @@ from __future__ import print_function, division
 from optparse import OptionParser
 import os
 import sys
-import pysam
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__))[:-3] + 'python')
+from Observations import *
 
 __author__ = "Louis Dijkstra"
 
-usage = """%prog <sorted-bam-file> 
+usage = """%prog [options] <observations-file> <output-file>
 
-	<sorted-bam-file> 	Sorted BAM file
+	<observations-file> 	observations file (text format)
+	<output-file> 		BGZF-compressed observations file
 
-Indexes a sorted BAM file sing PySAM (which employs SAMTools). 
-One can create a sorted BAM file with the script 
-'sort-bam-file.py'
+(See 'extract-observations.py' for generating an observations file.)
+Compresses a .raw-observations file with BGZF and indexes it. The index
+is stored as <output-file>.idx. The compressed file can be read by 
+'filter-observations.py' and 'sm_caller', which use the index to jump 
+straight to a region (options -x and -R respectively). The variants need 
+to be sorted by position within every chromosome.
 """
 
 def main():
 
 	parser = OptionParser(usage=usage)
 	(options, args) = parser.parse_args()
-	
-	if (len(args)!=1):
+
+	if (len(args)!=2):
 		parser.print_help()
 		return 1
-		
-	filename = args[0]
-	
-	if filename[-4:] != '.bam': 
-		print("ERROR: file extension should be '.bam'. File is not indexed.")
-		return 1 
-		
-	print("Indexing BAM file %s."%filename)
-	pysam.index(filename)
+
+	observations_file 	= os.path.abspath(args[0])
+	observations_writer 	= IndexedObservationsWriter(os.path.abspath(args[1]))
+	with open(observations_file, 'r') as obs_file:
+		for variant_observations in readRawObservations(obs_file):
+			observations_writer.write(*variant_observations)
+	observations_writer.close()
 
 if __name__ == '__main__':
 	sys.exit(main())
-
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) 2015 Louis Dijkstra
+
+This file is part of somatic-indel-calling
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function, division
+from optparse import OptionParser
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__))[:-3] + 'python')
+from Observations import *
+
+__author__ = "Louis Dijkstra"
+
+usage = """%prog [options] <observations-file>
+
+	<observations-file> 	observations file (text or binary)
+
+(See 'extract-observations.py' for generating an observations file.)
+Converts an observations file in the text format (.raw-observations)
+into the binary format and vice versa. The format of the input file is
+detected automatically. Output is printed to standard output.
+
+The binary format stores the variants in a table and the insert sizes,
+split read observations and their probabilities in concatenated arrays
+(see python/Observations.py). It can be read by 'sm_caller' directly
+and is considerably faster to read and write than the text format.
+
+With --compress, identical observations are stored once together with
+their count (see 'extract-observations.py'). Compressed files are 
+recognized automatically.
+"""
+
+def main():
+
+	parser = OptionParser(usage=usage)
+	parser.add_option("--compress", action="store_true", dest="compress", default=False,
+						help="Identical observations of a sample are output once together with their count. (Default = every observation is output)")
+	(options, args) = parser.parse_args()
+
+	if (len(args)!=1):
+		parser.print_help()
+		return 1
+
+	observations_file = os.path.abspath(args[0])
+
+	if isBinaryObservationsFile(observations_file): # binary -> text
+		for variant_observations in ObservationsReader(observations_file):
+			sys.stdout.write(formatRawObservations(*variant_observations, compressed = options.compress))
+	else: # text -> binary
+		observations_writer = ObservationsWriter(getattr(sys.stdout, 'buffer', sys.stdout), compressed = options.compress)
+		with open(observations_file, 'r') as obs_file:
+			for variant_observations in readRawObservations(obs_file):
+				observations_writer.write(*variant_observations)
+		observations_writer.close()
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -23,7 +23,7 @@ from __future__ import print_function, division
 from optparse import OptionParser
 import os
 import sys
-import vcf
+import multiprocessing
 import pysam
 import numpy as np
 
@@ -34,6 +34,7 @@ from Alignments import *
 from DefaultBAMProcessor import *
 from LaserBAMProcessor import *
 from BWABAMProcessor import *
+from Observations import *
 
 __author__ = "Louis Dijkstra"
 
@@ -75,11 +76,23 @@ later four are for the cancer sample. The first line represents in
 both cases the observed insert sizes. The second the associated 
 alignment probabilities. The third the split read observations (0/1).
 The fourth contains probabilities again. 
+
+With --compress, identical observations (the same value and alignment
+probability) are written once as <value>:<count> (the probability is
+written once as well), so that sm_caller evaluates one likelihood term 
+per distinct observation. 
 	
 NOTE: 	The current implementation ignores indels in the vcf file 
 	for which more than one alternative (ALT) are provided.	
+	The VCF file (possibly bgzipped) is parsed by htslib (pysam).
+	The indels in it are stored in a table next to the VCF file 
+	(<vcf-file>.npz) that is used instead as long as the VCF file 
+	does not change (see IndelTable in python/Indel.py). 
 """
 
+# indels are streamed (--engine auto) when their search windows overlap on average this many times
+STREAMING_DENSITY = 2.0
+
 def exceedsThreshold (value, threshold): 
 	"""Returns whether value exceeds threshold. When threshold is None, 
 	   it returns False"""
@@ -87,15 +100,134 @@ def exceedsThreshold (value, threshold):
 		return value > threshold 
 	return False
 
+def returnBAMProcessors(aligner, bam_healthy_filename, bam_cancer_filename, options):
+	"""Returns the BAM processors for the healthy and cancer sample. The thresholds 
+	   dictated by the aligner are set in options (when not set already). Returns 
+	   (None, None) when the aligner is not recognized."""
+	if aligner == 'laser': ### LASER ###
+		# set defaults (if not set already)
+		if options.del_split_threshold == None: options.del_split_threshold 	= 900 
+		if options.ins_split_threshold == None: options.ins_split_threshold 	= 60  
+		if options.ins_is_threshold == None: 	options.ins_is_threshold 	= 150 		
+		bam_healthy_processor = LaserBAMProcessor(bam_healthy_filename, search_range = options.search_range, primary_alignments_only = options.primary_only, sweep = options.sweep, columnar = options.columnar, mate_coordinates = options.mate_coordinates)
+		bam_cancer_processor = LaserBAMProcessor(bam_cancer_filename, search_range = options.search_range, primary_alignments_only = options.primary_only, sweep = options.sweep, columnar = options.columnar, mate_coordinates = options.mate_coordinates)
+	elif aligner == 'bwa' or aligner == 'bwamemm': ### BWA or BWAMEMM ###
+		# set defaults (if not set already)
+		if options.del_split_threshold == None: options.del_split_threshold 	= 40
+		if options.ins_split_threshold == None: options.ins_split_threshold 	= 25  
+		if options.ins_is_threshold == None: 	options.ins_is_threshold 	= 150 		
+		bam_healthy_processor = BWABAMProcessor(bam_healthy_filename, search_range = options.search_range, primary_alignments_only = options.primary_only, sweep = options.sweep, columnar = options.columnar, mate_coordinates = options.mate_coordinates)
+		bam_cancer_processor = BWABAMProcessor(bam_cancer_filename, search_range = options.search_range, primary_alignments_only = options.primary_only, sweep = options.sweep, columnar = options.columnar, mate_coordinates = options.mate_coordinates)
+	elif aligner == 'default': ### DEFAULT ###
+		bam_healthy_processor = DefaultBAMProcessor(bam_healthy_filename, search_range = options.search_range, primary_alignments_only = options.primary_only, centerpoints_thres_del = options.centerpoints_distance_thres_del, centerpoints_thres_ins = options.centerpoints_distance_thres_ins, length_thres_del = options.length_thres_del, length_thres_ins = options.length_thres_ins, sweep = options.sweep, columnar = options.columnar, mate_coordinates = options.mate_coordinates)
+		bam_cancer_processor = DefaultBAMProcessor(bam_cancer_filename, search_range = options.search_range, primary_alignments_only = options.primary_only, centerpoints_thres_del = options.centerpoints_distance_thres_del, centerpoints_thres_ins = options.centerpoints_distance_thres_ins, length_thres_del = options.length_thres_del, length_thres_ins = options.length_thres_ins, sweep = options.sweep, columnar = options.columnar, mate_coordinates = options.mate_coordinates) 
+	else: 
+		return None, None
+	return bam_healthy_processor, bam_cancer_processor
+
+def returnSelection(indel_table, options):
+	"""Returns which indels in the table are considered (see the options)."""
+	return indel_table.typeMask(deletions_only = options.deletions_only, insertions_only = options.insertions_only) & indel_table.lengthMask(lower = options.min_length)
+
+def returnVariantObservations(indel, healthy_observations, cancer_observations, options):
+	"""Returns the type, chromosome, position and length of the indel together with the 
+	   observations of both samples. Observations that are ignored for indels of this 
+	   length (see -i, -I, -s and -S) are left out."""
+	if isinstance(indel, Deletion):
+		ignore_insert_size_obs 	= exceedsThreshold(indel.length, options.del_is_threshold)
+		ignore_split_obs 	= exceedsThreshold(indel.length, options.del_split_threshold)
+	else:
+		ignore_insert_size_obs 	= exceedsThreshold(indel.length, options.ins_is_threshold)
+		ignore_split_obs 	= exceedsThreshold(indel.length, options.ins_split_threshold)
+	observations = [] 
+	for (isize, isize_prob, splits, splits_prob) in (healthy_observations, cancer_observations):
+		if ignore_insert_size_obs: isize, isize_prob = [], []
+		if ignore_split_obs: splits, splits_prob = [], []
+		observations.append((isize, isize_prob, splits, splits_prob))
+	return indel.variant_type, indel.chromosome, indel.position, indel.length, observations[0], observations[1]
+
+def useStreamingEngine(indels, bam_processor, options):
+	"""Returns True when the indels should be processed by streaming through the BAM 
+	   files (see --engine). In case of 'auto', this is done when the search windows 
+	   of the indels cover the region they span on average at least STREAMING_DENSITY 
+	   times, i.e., when fetching the alignments per indel would decode every 
+	   alignment multiple times. The fetch engine is used when --sweep or --columnar 
+	   is set, since they are not applicable to the stream engine."""
+	if options.engine == 'auto' and (options.sweep or options.columnar):
+		return False
+	if options.engine != 'auto' or len(indels) == 0:
+		return options.engine == 'stream'
+	windows = [bam_processor.returnSearchWindow(indel) for indel in indels]
+	span 	= max([end for (start, end) in windows]) - min([start for (start, end) in windows])
+	return sum([end - start for (start, end) in windows]) >= STREAMING_DENSITY * span
+
+def returnObservations(indels, bam_healthy_processor, bam_cancer_processor, options):
+	"""Returns the observations for all indels in a shard (see returnVariantObservations)."""
+	# Obtain the evidence (internal segment based and overlapping alignments) 
+	if useStreamingEngine(indels, bam_healthy_processor, options):
+		healthy_observations 	= bam_healthy_processor.processIndels(indels)
+		cancer_observations 	= bam_cancer_processor.processIndels(indels)
+	else:
+		healthy_observations 	= [bam_healthy_processor.processIndel(indel) for indel in indels]
+		cancer_observations 	= [bam_cancer_processor.processIndel(indel) for indel in indels]
+
+	return [returnVariantObservations(indels[i], healthy_observations[i], cancer_observations[i], options) for i in range(len(indels))]
+
+def returnShards(indels, shard_size):
+	"""Splits the selected indels in the VCF file (see returnSelection) in shards, i.e., consecutive 
+	   indels on the same chromosome. A shard contains at most shard_size indels."""
+	shard = [] 
+	for indel in indels: 
+		if len(shard) == shard_size or (len(shard) > 0 and shard[0].chromosome != indel.chromosome): 
+			yield shard 
+			shard = [] 
+		shard.append(indel)
+	if len(shard) > 0: 
+		yield shard 
+
+def outputObservations(observations, observations_writer, compressed = False):
+	"""Outputs the observations of a shard to the given writer (see Observations.py) or, when 
+	   no writer is given, as text (9 lines per indel) to standard output."""
+	for variant_observations in observations:
+		if observations_writer != None:
+			observations_writer.write(*variant_observations)
+		else:
+			sys.stdout.write(formatRawObservations(*variant_observations, compressed = compressed))
+
+# BAM processors of a worker process (see --jobs). Every worker opens its own BAM files.
+worker_bam_processors = None
+
+def initializeWorker(aligner, bam_healthy_filename, bam_cancer_filename, options):
+	"""Opens the BAM files for a worker process."""
+	global worker_bam_processors
+	worker_bam_processors = returnBAMProcessors(aligner, bam_healthy_filename, bam_cancer_filename, options) + (options,)
+
+def processShard(shard):
+	"""Returns the observations for all records in the shard (in a worker process)."""
+	bam_healthy_processor, bam_cancer_processor, options = worker_bam_processors
+	return returnObservations(shard, bam_healthy_processor, bam_cancer_processor, options)
+
 def main():
 
 	parser = OptionParser(usage=usage)
+	parser.add_option("--binary", action="store_true", dest="binary", default=False,
+						help="Outputs the observations in the binary format (see 'convert-observations.py') instead of the text format. (Default = text)")
+	parser.add_option("--compress", action="store_true", dest="compress", default=False,
+						help="Identical observations of a sample are output once together with their count (see above). (Default = every observation is output)")
+	parser.add_option("--columnar", action="store_true", dest="columnar", default=False,
+						help="Summarizes the alignments around a variant in NumPy arrays and processes them at once. Only applicable to the fetch engine. (Default = the alignments are processed one by one)")
 	parser.add_option("--deletions-only", action="store_true", dest="deletions_only", default=False, 
 				  		help="Only deletions are stored and insertions are discarded.")
+	parser.add_option("--engine", action="store", dest="engine", default="auto", choices=["auto", "fetch", "stream"],
+						help="Engine used for collecting the alignments: 'fetch' fetches the alignments for every indel separately (see also --sweep), 'stream' reads the BAM files once from start to end and hands every alignment to all indels it is relevant for, 'auto' chooses on the basis of the density of the indels (the fetch engine when --sweep or --columnar is set). (Default = auto)")
 	parser.add_option("--insertions-only", action="store_true", dest="insertions_only", default=False, 
 				  		help="Only insertions are stored and deletions are discarded.")
+	parser.add_option("--mate-coordinates", action="store_true", dest="mate_coordinates", default=False,
+						help="Derives the internal segment of a read pair from the mate fields (position, MC and MQ tags) of its left mate, so that every pair is counted once and the right mate does not need to be fetched. When the MQ tag is absent (BWA only sets it after 'samtools fixmate -m'), the mapping quality of the left mate is used for its mate as well and a warning is printed. The search window then only extends to the left of the indel (see -r). (Default = the mates are paired by read name)")
 	parser.add_option("--primary-only", action="store_true", dest="primary_only", default=False,
 						help="Only primary alignments are taken into account. (Default = False; also secondary etc. alignments are considered.)")
+	parser.add_option("--sweep", action="store_true", dest="sweep", default=False,
+						help="Sweeps once over every BAM file and reuses the alignments across neighbouring variants. Requires the VCF file to be sorted. Only applicable to the fetch engine. (Default = every variant is fetched separately)")
 	parser.add_option("-c", action="store", dest="centerpoints_distance_thres_del", default=50, type=int,
 				  		help="Maximal difference in centerpoints between split and deletion for the read to be considered evidence for the deletion. Only applicable when the default aligner is used. (Default = 50bp)")
 	parser.add_option("-C", action="store", dest="centerpoints_distance_thres_ins", default=50, type=int,
@@ -104,12 +236,18 @@ def main():
 						help="Discards any insert size observations for any deletion that exceeds the given length. (Overwrites default dictated by the aligner used)")
 	parser.add_option("-I", action="store", dest="ins_is_threshold", default=None, type=int,
 						help="Discards any insert size observations for any insertion that exceeds the given length. (Overwrites default dictated by the aligner used)")
+	parser.add_option("-j", "--jobs", action="store", dest="jobs", default=1, type=int,
+						help="Number of worker processes. The VCF records are split in shards per chromosome (see -n) that are processed in parallel. The output remains in the order of the VCF file. (Default = 1)")
 	parser.add_option("-l", action="store", dest="length_thres_del", default=20, type=int,
 				  		help="Maximal difference in length between split and deletion for the read to be considered evidence for the deletion. Only applicable when the default aligner is used. (Default = 20bp)")
 	parser.add_option("-L", action="store", dest="length_thres_ins", default=20, type=int,
 				  		help="Maximal difference in length between split and insertion for the read to be considered evidence for the insertion. Only applicable when the default aligner is used. (Default = 20bp)")
 	parser.add_option("-m", action="store", dest="min_length", default=0, type=int,
 				  		help="Minimal length of an indel to be considered. (Default = 0 bp, i.e., all)")
+	parser.add_option("-n", action="store", dest="shard_size", default=1000, type=int,
+						help="Maximal number of indels in a shard, i.e., the indels that are processed at once (see --engine and --jobs). (Default = 1000)")
+	parser.add_option("-o", action="store", dest="output_filename", default=None,
+						help="Writes the observations to this file. Unless --binary is set, the file is BGZF-compressed and comes with an index (<file>.idx) that allows to jump to a region (see 'filter-observations.py' and 'sm_caller'). (Default = standard output)")
 	parser.add_option("-r", action="store", dest="search_range", default=5000, type=int, 
 						help="Range to search for potentially relevant reads (Default = 5000 bp)")
 	parser.add_option("-s", action="store", dest="del_split_threshold", default=None, type=int,
@@ -121,122 +259,50 @@ def main():
 	if (len(args)!=4):
 		parser.print_help()
 		return 1
+
+	if options.engine == 'stream' and (options.sweep or options.columnar):
+		print('ERROR: --sweep and --columnar are only applicable to the fetch engine (see --engine)')
+		return 1
 	
 	aligner 		= args[0].lower() 
 	vcf_filename 		= os.path.abspath(args[1])
 	bam_healthy_filename 	= os.path.abspath(args[2])
 	bam_cancer_filename 	= os.path.abspath(args[3])
 
-	vcf_reader 		= vcf.Reader(open(vcf_filename))
+	indel_table 		= returnIndelTable(vcf_filename) # the records are classified once and the table is stored next to the VCF file (see Indel.py)
+	indels 			= indel_table.returnIndels(returnSelection(indel_table, options))
 
 	# allocate memory
-	bam_healthy_processor, bam_cancer_processor = None, None
-	if aligner == 'laser': ### LASER ###
-		# set defaults (if not set already)
-		if options.del_split_threshold == None: options.del_split_threshold 	= 900 
-		if options.ins_split_threshold == None: options.ins_split_threshold 	= 60  
-		if options.ins_is_threshold == None: 	options.ins_is_threshold 	= 150 		
+	bam_healthy_processor, bam_cancer_processor = returnBAMProcessors(aligner, bam_healthy_filename, bam_cancer_filename, options)
+	if bam_healthy_processor == None: 
+		print('ERROR: aligner %s was not recognized. Options are: laser, bwa or default'%aligner)
+		exit() 
 
-		bam_healthy_processor = LaserBAMProcessor(bam_healthy_filename, search_range = options.search_range, primary_alignments_only = options.primary_only)
-		bam_cancer_processor = LaserBAMProcessor(bam_cancer_filename, search_range = options.search_range, primary_alignments_only = options.primary_only)
-	elif aligner == 'bwa' or aligner == 'bwamemm': ### BWA or BWAMEMM ###
-		# set defaults (if not set already)
-		if options.del_split_threshold == None: options.del_split_threshold 	= 40
-		if options.ins_split_threshold == None: options.ins_split_threshold 	= 25  
-		if options.ins_is_threshold == None: 	options.ins_is_threshold 	= 150 		
+	observations_writer = None
+	if options.binary and options.output_filename != None: 
+		observations_writer = ObservationsWriter(open(os.path.abspath(options.output_filename), 'wb'), compressed = options.compress)
+	elif options.binary: 
+		observations_writer = ObservationsWriter(getattr(sys.stdout, 'buffer', sys.stdout), compressed = options.compress)
+	elif options.output_filename != None: 
+		observations_writer = IndexedObservationsWriter(os.path.abspath(options.output_filename), compressed = options.compress)
 
-		bam_healthy_processor = BWABAMProcessor(bam_healthy_filename, search_range = options.search_range, primary_alignments_only = options.primary_only)
-		bam_cancer_processor = BWABAMProcessor(bam_cancer_filename, search_range = options.search_range, primary_alignments_only = options.primary_only)
-	elif aligner == 'default': ### DEFAULT ###
-		bam_healthy_processor = DefaultBAMProcessor(bam_healthy_filename, search_range = options.search_range, primary_alignments_only = options.primary_only, centerpoints_thres_del = options.centerpoints_distance_thres_del, centerpoints_thres_ins = options.centerpoints_distance_thres_ins, length_thres_del = options.length_thres_del, length_thres_ins = options.length_thres_ins)
-		bam_cancer_processor = DefaultBAMProcessor(bam_cancer_filename, search_range = options.search_range, primary_alignments_only = options.primary_only, centerpoints_thres_del = options.centerpoints_distance_thres_del, centerpoints_thres_ins = options.centerpoints_distance_thres_ins, length_thres_del = options.length_thres_del, length_thres_ins = options.length_thres_ins) 
+	if options.jobs > 1: # process the shards in parallel; every worker opens its own BAM files
+		bam_healthy_processor.close()
+		bam_cancer_processor.close()
+		pool = multiprocessing.Pool(options.jobs, initializer = initializeWorker, initargs = (aligner, bam_healthy_filename, bam_cancer_filename, options))
+		for observations in pool.imap(processShard, returnShards(indels, options.shard_size)): # imap preserves the order of the shards
+			outputObservations(observations, observations_writer, options.compress)
+		pool.close()
+		pool.join()
 	else: 
-		print('ERROR: aligner %s was not recognized. Options are: laser, bwa or default'%aligner)
-		exit() 
-		
-	# Walk through all records in the VCF file
-	for vcf_record in vcf_reader:  
-		if len(vcf_record.ALT) != 1: # records with several alternatives are ignored.
-			continue 
-		is_deletion 	= isDeletion(vcf_record) 
-		is_insertion 	= isInsertion(vcf_record)
-		if not (is_deletion or is_insertion): # not an indel
-			continue
-		if options.deletions_only and is_insertion: # it's a deletion and we consider only insertions
-			continue
-		if options.insertions_only and is_deletion: # it's an insertion and we consider only deletions
-			continue
-		if returnIndelLength(vcf_record) < options.min_length: # below the minimal length of an indel.
-			continue 
-
-		# Obtain the evidence (internal segment based and overlapping alignments) 
-		if is_deletion:
-			deletion = Deletion(vcf_record)
-			ignore_insert_size_obs 	= exceedsThreshold(deletion.length, options.del_is_threshold)
-			ignore_split_obs 	= exceedsThreshold(deletion.length, options.del_split_threshold)
-			
-			print('-', '\t', vcf_record.CHROM, '\t', vcf_record.POS, '\t', deletion.length)
-
-			# extract observations from the healthy sample 			
-			isize, isize_prob, splits, splits_prob = bam_healthy_processor.processDeletion(deletion)
-			
-			if ignore_insert_size_obs: print('\n') # 2 empty lines   	
-			else:				
-				print('\t'.join(map(str,isize)))
-				print('\t'.join(map(str,isize_prob)))  
-
-			if ignore_split_obs: print('\n') # 2 empty lines
-			else: 
-				print('\t'.join(map(str,splits)))
-				print('\t'.join(map(str,splits_prob)))
-	
-			# extract observations from the cancer sample 	
-			isize, isize_prob, splits, splits_prob = bam_cancer_processor.processDeletion(deletion)
-			
-			if ignore_insert_size_obs: print('\n') # 2 empty lines   	
-			else:				
-				print('\t'.join(map(str,isize)))
-				print('\t'.join(map(str,isize_prob)))  
-
-			if ignore_split_obs: print('\n') # 2 empty lines
-			else: 
-				print('\t'.join(map(str,splits)))
-				print('\t'.join(map(str,splits_prob)))
-		else:
-			insertion = Insertion(vcf_record)
-			ignore_insert_size_obs 	= exceedsThreshold(insertion.length, options.ins_is_threshold)
-			ignore_split_obs 	= exceedsThreshold(insertion.length, options.ins_split_threshold)
-
-			print('+', '\t', vcf_record.CHROM, '\t', vcf_record.POS, '\t', insertion.length)
-			
-			# extract observations from the healthy sample 			
-			isize, isize_prob, splits, splits_prob = bam_healthy_processor.processInsertion(insertion)
-			
-			if ignore_insert_size_obs: print('\n') # 2 empty lines   	
-			else:				
-				print('\t'.join(map(str,isize)))
-				print('\t'.join(map(str,isize_prob)))  
-
-			if ignore_split_obs: print('\n') # 2 empty lines
-			else: 
-				print('\t'.join(map(str,splits)))
-				print('\t'.join(map(str,splits_prob)))
-
-			# extract observations from the cancer sample 
-			isize, isize_prob, splits, splits_prob = bam_cancer_processor.processInsertion(insertion)
-			
-			if ignore_insert_size_obs: print('\n') # 2 empty lines   	
-			else:				
-				print('\t'.join(map(str,isize)))
-				print('\t'.join(map(str,isize_prob)))  
-
-			if ignore_split_obs: print('\n') # 2 empty lines
-			else: 
-				print('\t'.join(map(str,splits)))
-				print('\t'.join(map(str,splits_prob)))
-			 
-	bam_healthy_processor.close()
-	bam_cancer_processor.close()
+		# Walk through all indels in the VCF file
+		for shard in returnShards(indels, options.shard_size):  
+			outputObservations(returnObservations(shard, bam_healthy_processor, bam_cancer_processor, options), observations_writer, options.compress)
+		bam_healthy_processor.close()
+		bam_cancer_processor.close()
+
+	if observations_writer != None: 
+		observations_writer.close()
 
 if __name__ == '__main__':
 	sys.exit(main())
@@ -24,17 +24,24 @@ from optparse import OptionParser
 import os
 import sys
 import operator
-from itertools import islice
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__))[:-3] + 'python')
+from Observations import *
 
 __author__ = "Louis Dijkstra"
 
 usage = """%prog [options] <observations-file> 
 
-	<observations-file> 	original observations file 
+	<observations-file> 	original observations file (possibly
+				BGZF-compressed)
 
 (See 'extract-observations.py' for generating an observations file.)
 Filters an observation file. Output is printed to standard output. 
 See the options for the filter possibilities.
+
+When the observations file is BGZF-compressed and indexed (see
+'compress-observations.py'), the option -x jumps straight to the
+chromosome/region instead of reading the entire file.
 """
 
 def liesInInterval(value, min_value, max_value): 
@@ -74,7 +81,7 @@ def main():
 	parser.add_option("-S", action="store", dest="ins_split_threshold", default=None, type=int,
 						help="Discards any split read observations for any insertion that exceeds the given length. (Default = not applied)")
 	parser.add_option("-x", action="store", dest="chromosome", default=None, 
-						help="Outputs only variants on this chromosome.")
+						help="Outputs only variants on this chromosome or in this region (chr:start-end).")
 	(options, args) = parser.parse_args()
 	
 	if (len(args)!=1):
@@ -84,58 +91,56 @@ def main():
 	observations_file = os.path.abspath(args[0])
 
 	# walk through the variants: 
-	with open(observations_file, 'r') as obs_file:
-   		while True:
-        		variant_data = list(islice(obs_file, 9)) # get 9 lines associated with one variant
-        		if not variant_data:
-           			break
-			# process the first line: 
-			values 		= variant_data[0].split() 
-			variant_type 	= values[0].strip()
-			chromosome 	= values[1].strip()
-			position 	= int(values[2])
-			length		= int(values[3])
+	if options.chromosome != None: 
+		variants = readRegionLines(observations_file, *parseRegion(options.chromosome))
+	else: 
+		variants = readVariantLines(openRawObservations(observations_file))
+	for variant_data in variants:
+		# process the first line: 
+		values 		= variant_data[0].split() 
+		variant_type 	= values[0].strip()
+		chromosome 	= values[1].strip()
+		position 	= int(values[2])
+		length		= int(values[3])
+		
+		# check whether variant should be outputed or not	
+		valid = liesInInterval(length, options.min_length, options.max_length) 	# length	
+		if options.deletions:
+			if variant_type != '-': valid = False	
+		if options.insertions:
+			if variant_type != '+': valid = False	
+
+		if valid: # variant is valid and should be outputed:
+			print(variant_data[0], end = '') # print data on variant 
+
+			# check whether insert size observations or split observations should be neglected
+			ignore_insert_size_obs, ignore_split_obs = False, False
+			if variant_type == '-': # deletion
+				ignore_insert_size_obs 	= exceedsThreshold(length, options.del_is_threshold)
+				ignore_split_obs 	= exceedsThreshold(length, options.del_split_threshold)
+			if variant_type == '+': # insertion
+				ignore_insert_size_obs 	= exceedsThreshold(length, options.ins_is_threshold)
+				ignore_split_obs 	= exceedsThreshold(length, options.ins_split_threshold)
+
+			if ignore_insert_size_obs: print('\n') # 2 empty lines
+			else: 
+				print(variant_data[1], end = '')
+				print(variant_data[2], end = '')
+			
+			if ignore_split_obs: print('\n') # 2 empty lines
+			else: 
+				print(variant_data[3], end = '')
+				print(variant_data[4], end = '')
+
+			if ignore_insert_size_obs: print('\n') # 2 empty lines
+			else: 
+				print(variant_data[5], end = '')
+				print(variant_data[6], end = '')
 			
-			# check whether variant should be outputed or not	
-			valid = liesInInterval(length, options.min_length, options.max_length) 	# length	
-			if options.deletions:
-				if variant_type != '-': valid = False	
-			if options.insertions:
-				if variant_type != '+': valid = False	
-			if options.chromosome != None: 
-				valid = valid and (chromosome == options.chromosome)
-
-			if valid: # variant is valid and should be outputed:
-				print(variant_data[0], end = '') # print data on variant 
-
-				# check whether insert size observations or split observations should be neglected
-				ignore_insert_size_obs, ignore_split_obs = False, False
-				if variant_type == '-': # deletion
-					ignore_insert_size_obs 	= exceedsThreshold(length, options.del_is_threshold)
-					ignore_split_obs 	= exceedsThreshold(length, options.del_split_threshold)
-				if variant_type == '+': # insertion
-					ignore_insert_size_obs 	= exceedsThreshold(length, options.ins_is_threshold)
-					ignore_split_obs 	= exceedsThreshold(length, options.ins_split_threshold)
-
-				if ignore_insert_size_obs: print('\n') # 2 empty lines
-				else: 
-					print(variant_data[1], end = '')
-					print(variant_data[2], end = '')
-				
-				if ignore_split_obs: print('\n') # 2 empty lines
-				else: 
-					print(variant_data[3], end = '')
-					print(variant_data[4], end = '')
-
-				if ignore_insert_size_obs: print('\n') # 2 empty lines
-				else: 
-					print(variant_data[5], end = '')
-					print(variant_data[6], end = '')
-				
-				if ignore_split_obs: print('\n') # 2 empty lines
-				else: 
-					print(variant_data[7], end = '')
-					print(variant_data[8], end = '')
+			if ignore_split_obs: print('\n') # 2 empty lines
+			else: 
+				print(variant_data[7], end = '')
+				print(variant_data[8], end = '')
 
 if __name__ == '__main__':
 	sys.exit(main())
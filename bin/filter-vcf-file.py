@@ -22,9 +22,12 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 from __future__ import print_function, division
 from optparse import OptionParser
 import os
-import vcf
 import sys
-import operator
+import shutil
+import tempfile
+import itertools
+import multiprocessing
+import pysam
 
 sys.path.insert(0, os.path.abspath(os.path.dirname(__file__))[:-3] + 'python')
 from Indel import *
@@ -33,10 +36,18 @@ __author__ = "Louis Dijkstra"
 
 usage = """%prog [options] <vcf-file> <output-vcf-file>
  
-	<vcf-file> 			original VCF file
+	<vcf-file> 			original VCF file (possibly bgzipped)
 	<output-vcf-file>	filtered VCF records will be stored here
 	
 Filters a given VCF file. Type '%prog -h' for the filter options. 	
+
+The records are read as text lines and only REF, ALT (the first alternative) 
+and the SVTYPE and SVLEN keys of INFO are looked at; the header and the 
+records that pass the filter are written as they are. When the VCF file is 
+bgzipped and indexed (tabix), the chromosomes are filtered in parallel by 
+several processes (see -j); the output is the same as with one process. 
+With -x, only the records on the given chromosome are considered (and 
+output); the index is then used to read only those records. 
 """
 
 def fallsInInterval(value, min_value, max_value): 
@@ -46,6 +57,88 @@ def fallsInInterval(value, min_value, max_value):
 		return False
 	return True
 
+def returnInfoValue(info, key):
+	"""Returns the (first) value of the key in the INFO column of a record, or None when the key is absent."""
+	if not key in info: # most records do not contain the key at all
+		return None
+	for entry in info.split(';'):
+		if entry.startswith(key + '='):
+			return entry[len(key) + 1:].split(',', 1)[0]
+	return None
+
+def satisfiesFilter(line, values, options):
+	"""Returns True when a record (the line and the values in its first five columns) satisfies 
+	   the filter. The types and lengths follow isDeletion, isInsertion, isSNP and returnIndelLength. 
+	   INFO is only split when the record contains SVTYPE or SVLEN."""
+	ref, alt = values[3], values[4]
+	if ',' in alt: # only the first alternative is considered
+		alt = alt[:alt.index(',')]
+	if options.snps and len(ref) == 1 and len(alt) == 1 and alt != '.': 
+		return True
+	if not (options.deletions or options.insertions): 
+		return False
+	svtype, svlen = None, None
+	if 'SVTYPE=' in line or 'SVLEN=' in line: 
+		info 	= line.split('\t', 8)[7]
+		svtype 	= returnInfoValue(info, 'SVTYPE')
+		svlen 	= returnInfoValue(info, 'SVLEN')
+	elif len(ref) == len(alt): # neither a deletion nor an insertion (see classifyIndel)
+		return False
+	variant_type, length = classifyIndel(svtype, None, ref, alt)
+	if (options.deletions and variant_type == '-') or (options.insertions and variant_type == '+'):
+		if svlen != None: 
+			length = abs(int(svlen))
+		return fallsInInterval(length, options.min_length, options.max_length)
+	return False
+
+def filterLines(lines, output_file, options, verbose = False):
+	"""Writes the records (lines) that pass the filter (see satisfiesFilter and --NOT) to the 
+	   output file. Records on other chromosomes than the one given (-x) are skipped. Returns 
+	   the number of records processed and the number that passed the filter."""
+	n, n_passed_filter = 0, 0
+	chromosome, negation = options.chromosome, options.negation
+	for line in lines:
+		if line[:1] in ('#', '\n', ''): # header or empty line
+			continue
+		n += 1
+		if verbose and n % 10000 == 0: 
+			print('Processed %d variants'%n)
+
+		values = line.split('\t', 5)
+		if chromosome != None and chromosome != values[0]: 
+			continue
+		if satisfiesFilter(line, values, options) != negation: 
+			n_passed_filter += 1
+			output_file.write(line if line.endswith('\n') else line + '\n')
+	return n, n_passed_filter
+
+# input and options of a worker process (see -j)
+worker_arguments = None
+
+def initializeWorker(vcf_filename, output_directory, options):
+	"""Stores the input and options for a worker process."""
+	global worker_arguments
+	worker_arguments = (vcf_filename, output_directory, options)
+
+def filterChromosome(chromosome):
+	"""Filters the records on one chromosome (in a worker process). The records that pass 
+	   the filter are stored in a temporary file. Returns its name together with the 
+	   counts (see filterLines)."""
+	vcf_filename, output_directory, options = worker_arguments
+	vcf_file 	= pysam.TabixFile(vcf_filename)
+	output_file 	= tempfile.NamedTemporaryFile(mode = 'w', dir = output_directory, delete = False)
+	n, n_passed_filter = filterLines(vcf_file.fetch(chromosome), output_file, options)
+	output_file.close()
+	vcf_file.close()
+	return output_file.name, n, n_passed_filter
+
+def isIndexed(vcf_filename):
+	"""Returns True when the VCF file is bgzipped and comes with an index (.tbi or .csi)."""
+	with open(vcf_filename, 'rb') as vcf_file:
+		if vcf_file.read(2) != b'\x1f\x8b':
+			return False
+	return os.path.exists(vcf_filename + '.tbi') or os.path.exists(vcf_filename + '.csi')
+
 def main():
 
 	parser = OptionParser(usage=usage)
@@ -59,6 +152,8 @@ def main():
 				help = "Outputs those records that do NOT satisfy the given constraints. E.g., '--deletions --NOT' returns all records that are not deletions.") 
 	parser.add_option("--snps", action="store_true", dest="snps", default=False, 
 				help = "Filter for SNPs")
+	parser.add_option("-j", "--jobs", action="store", dest="jobs", default=1, type=int,
+				help="Number of worker processes. Only applicable when the VCF file is bgzipped and indexed; the chromosomes are then filtered in parallel. (Default = 1)")
 	parser.add_option("-k", action="store", dest="min_length", default=None, type=int, 
 				help="Minimal length of the indels (Default = all indels are outputed)")
 	parser.add_option("-l", action="store", dest="max_length", default=None, type=int, 
@@ -80,43 +175,40 @@ def main():
 	vcf_filename 		= os.path.abspath(args[0])
 	vcf_output_filename	= os.path.abspath(args[1])
 
-	vcf_reader 		= vcf.Reader(open(vcf_filename))
-	vcf_writer 		= vcf.Writer(open(vcf_output_filename, 'w'), vcf_reader)
-
-	n, n_passed_filter = 0, 0 
-	satisfies_filter = True
-	for vcf_record in vcf_reader:
-		
-		n += 1
-		if options.verbose and n % 10000 == 0: 
-			print('Processed %d variants'%n)
-		
-		if options.chromosome == None or options.chromosome == vcf_record.CHROM: 
-			satisfies_filter = False
-			is_deletion 	= isDeletion(vcf_record) 
-			is_insertion 	= isInsertion(vcf_record) 
-			is_snp 		= isSNP(vcf_record) 
-
-			if options.snps and is_snp: 
-				satisfies_filter = True
-			if options.deletions and is_deletion: 
-				if fallsInInterval(returnIndelLength(vcf_record), options.min_length, options.max_length):
-					satisfies_filter = True
-			if options.insertions and is_insertion: 
-				if fallsInInterval(returnIndelLength(vcf_record), options.min_length, options.max_length):
-					satisfies_filter = True
-
-		if (not options.negation) and satisfies_filter:
-			n_passed_filter += 1
-			vcf_writer.write_record(vcf_record)
-		if options.negation and (not satisfies_filter):
-			n_passed_filter += 1
-			vcf_writer.write_record(vcf_record)	
-		
-	vcf_writer.close()
+	# the header is copied as is
+	vcf_file 		= openVCFFile(vcf_filename)
+	vcf_output_file 	= open(vcf_output_filename, 'w')
+	line = vcf_file.readline()
+	while line.startswith('#'):
+		vcf_output_file.write(line)
+		line = vcf_file.readline()
+
+	if isIndexed(vcf_filename) and (options.jobs > 1 or options.chromosome != None): 
+		vcf_file.close()
+		chromosomes = pysam.TabixFile(vcf_filename).contigs # in the order of the VCF file
+		if options.chromosome != None: 
+			chromosomes = [chromosome for chromosome in chromosomes if chromosome == options.chromosome]
+		vcf_output_file.flush()
+		n, n_passed_filter = 0, 0
+		pool = multiprocessing.Pool(max(1, min(options.jobs, len(chromosomes))), initializer = initializeWorker, initargs = (vcf_filename, os.path.dirname(vcf_output_filename), options))
+		for (filename, n_chromosome, n_passed_chromosome) in pool.imap(filterChromosome, chromosomes): # imap preserves the order of the chromosomes
+			with open(filename, 'r') as chromosome_file:
+				shutil.copyfileobj(chromosome_file, vcf_output_file)
+			os.remove(filename)
+			n += n_chromosome
+			n_passed_filter += n_passed_chromosome
+			if options.verbose: 
+				print('Processed %d variants'%n)
+		pool.close()
+		pool.join()
+	else: 
+		if options.jobs > 1: 
+			print('WARNING: the VCF file is not bgzipped and indexed; it is filtered by one process.')
+		n, n_passed_filter = filterLines(itertools.chain([line], vcf_file), vcf_output_file, options, verbose = options.verbose)
+		vcf_file.close()
+	vcf_output_file.close()
 
 	print("Processed %d variants in total. %d variants passed the filter."%(n, n_passed_filter))
 
 if __name__ == '__main__':
 	sys.exit(main())
-
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) 2015 Louis Dijkstra
+
+This file is part of somatic-indel-calling
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function, division
+from optparse import OptionParser
+import os
+import sys
+import time
+import multiprocessing
+import pysam
+
+__author__ = "Louis Dijkstra"
+
+usage = """%prog [options] <bam-file> [<bam-file> ...]
+
+	<bam-file> 		original BAM file(s)
+
+Sorts and indexes the BAM files using PySAM (which employs SAMTools).
+If a given file is '<name>.bam', the sorted file is stored under
+'<name>.sorted.bam' (see also -o) and its index under
+'<name>.sorted.bam.bai'. BAM files that are already sorted by
+coordinate (see the @HD line of the header) are only indexed.
+
+Every file is sorted with the given number of threads (-t) and memory
+per thread (-m). Several files are processed at the same time, as many
+as the total number of CPUs (-c) and the total memory (-M) allow. When
+the total memory does not suffice for the threads of one file, fewer
+threads are used.
+
+The index is a BAI index, unless one of the references is longer than
+a BAI index supports (2^29 - 1 bp) or --csi is set; then, a CSI index
+('<name>.sorted.bam.csi') is created instead.
+
+Files whose sorted file and index are newer than the original BAM file
+are skipped (unless -f is set), so that an interrupted run can simply
+be started again. Returns 1 when a file could not be processed.
+"""
+
+MAX_BAI_LENGTH = 2**29 - 1 # references that are longer require a CSI index
+
+def parseMemory(memory):
+	"""Returns the number of bytes given in the format of SAMTools, e.g., 768M or 2G."""
+	memory = memory.strip().upper()
+	for (suffix, factor) in (('K', 1024), ('M', 1024**2), ('G', 1024**3)):
+		if memory.endswith(suffix):
+			return int(float(memory[:-1]) * factor)
+	return int(memory)
+
+def returnNumberOfJobs(options):
+	"""Returns how many files are processed at the same time given the total number
+	   of CPUs and memory and the threads and memory used per file. The threads per
+	   file need to fit in the total memory (see main)."""
+	n_jobs = options.cpus // options.threads
+	if options.memory != None:
+		n_jobs = min(n_jobs, parseMemory(options.memory) // (options.threads * parseMemory(options.memory_per_thread)))
+	return max(1, n_jobs)
+
+def returnOutputFilenames(filename, options):
+	"""Returns the names of the sorted BAM file and its index, and whether the BAM file
+	   needs to be sorted (False when it is sorted by coordinate already)."""
+	bam_file 	= pysam.AlignmentFile(filename, 'rb')
+	is_sorted 	= bam_file.header.to_dict().get('HD', {}).get('SO') == 'coordinate'
+	use_csi 	= options.csi or any(length > MAX_BAI_LENGTH for length in bam_file.lengths)
+	bam_file.close()
+	if is_sorted:
+		sorted_filename = filename
+	else:
+		sorted_filename = filename[:-4] + '.sorted.bam'
+		if options.output_directory != None:
+			sorted_filename = os.path.join(options.output_directory, os.path.basename(sorted_filename))
+	return sorted_filename, sorted_filename + ('.csi' if use_csi else '.bai'), not is_sorted
+
+def isUpToDate(filename, source_filename):
+	"""Returns True when the file exists and is not older than the file it is made from."""
+	return os.path.exists(filename) and os.path.getmtime(filename) >= os.path.getmtime(source_filename)
+
+def prepareBAMFile(arguments):
+	"""Sorts (when needed) and indexes one BAM file (in a worker process). The outputs are
+	   written under a temporary name first, so that an interrupted run does not leave
+	   outputs that seem up to date. Returns a message on what was done and whether it
+	   succeeded."""
+	filename, options = arguments
+	start = time.time()
+	try:
+		sorted_filename, index_filename, needs_sorting = returnOutputFilenames(filename, options)
+		threads = ['-@', str(options.threads - 1)] # additional threads
+		done 	= []
+		if needs_sorting and (options.force or not isUpToDate(sorted_filename, filename)):
+			pysam.sort(*(threads + ['-m', options.memory_per_thread, '-O', 'bam', '-T', sorted_filename + '.tmp', '-o', sorted_filename + '.part', filename]))
+			os.rename(sorted_filename + '.part', sorted_filename)
+			done.append('sorted')
+		if options.force or len(done) > 0 or not isUpToDate(index_filename, sorted_filename):
+			pysam.index(*(threads + ['-c' if index_filename.endswith('.csi') else '-b', sorted_filename, index_filename + '.part']))
+			os.rename(index_filename + '.part', index_filename)
+			done.append('indexed')
+	except (pysam.SamtoolsError, IOError, OSError, ValueError) as error:
+		return False, "ERROR: BAM file %s could not be processed: %s"%(filename, str(error).strip())
+	if len(done) == 0:
+		return True, "BAM file %s is up to date (%s)."%(filename, index_filename)
+	return True, "BAM file %s is %s in %.1f seconds. Output is stored at %s"%(filename, ' and '.join(done), time.time() - start, index_filename)
+
+def main():
+
+	parser = OptionParser(usage=usage)
+	parser.add_option("--csi", action="store_true", dest="csi", default=False,
+						help="Creates CSI indices instead of BAI indices. (Default = only for references that are too long for a BAI index)")
+	parser.add_option("-c", action="store", dest="cpus", default=multiprocessing.cpu_count(), type=int,
+						help="Total number of CPUs used for processing the files. (Default = all CPUs)")
+	parser.add_option("-f", action="store_true", dest="force", default=False,
+						help="Sorts and indexes every file, even when its outputs are up to date.")
+	parser.add_option("-m", action="store", dest="memory_per_thread", default="768M",
+						help="Maximal memory per thread for sorting; suffixes K, M and G are recognized. (Default = 768M)")
+	parser.add_option("-M", action="store", dest="memory", default=None,
+						help="Total memory used for sorting the files at the same time, e.g., 16G. (Default = no limit, only -c applies)")
+	parser.add_option("-o", action="store", dest="output_directory", default=None,
+						help="Directory where the sorted BAM files are stored. (Default = the directory of the original BAM file)")
+	parser.add_option("-t", action="store", dest="threads", default=1, type=int,
+						help="Number of threads used for sorting and indexing one file. (Default = 1)")
+	(options, args) = parser.parse_args()
+
+	if (len(args) == 0):
+		parser.print_help()
+		return 1
+
+	for filename in args:
+		if filename[-4:] != '.bam':
+			print("ERROR: file extension of %s should be '.bam'. No file is sorted."%filename)
+			return 1
+		if not os.path.exists(filename):
+			print("ERROR: the BAM file %s cannot be found"%filename)
+			return 1
+	try:
+		parseMemory(options.memory_per_thread)
+		if options.memory != None:
+			parseMemory(options.memory)
+	except ValueError:
+		print("ERROR: memory should be given as a number with suffix K, M or G (see -m and -M)")
+		return 1
+	options.threads = max(1, min(options.threads, options.cpus))
+	if options.memory != None: # one file needs threads x memory per thread
+		n_threads = parseMemory(options.memory) // parseMemory(options.memory_per_thread)
+		if n_threads == 0:
+			print("ERROR: the total memory (-M %s) is too small for sorting one file with one thread of %s (see -m)"%(options.memory, options.memory_per_thread))
+			return 1
+		if n_threads < options.threads:
+			print("WARNING: the number of threads per file is lowered from %d to %d to fit the total memory (-M %s)."%(options.threads, n_threads, options.memory))
+			options.threads = n_threads
+
+	n_jobs = min(returnNumberOfJobs(options), len(args))
+	print("Processing %d BAM file(s), %d at a time with %d thread(s) each."%(len(args), n_jobs, options.threads))
+
+	status = 0
+	pool = multiprocessing.Pool(n_jobs)
+	for success, message in pool.imap_unordered(prepareBAMFile, [(os.path.abspath(filename), options) for filename in args]):
+		print(message)
+		if not success:
+			status = 1
+	pool.close()
+	pool.join()
+	return status
+
+if __name__ == '__main__':
+	sys.exit(main())
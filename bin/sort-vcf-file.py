@@ -21,10 +21,16 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from __future__ import print_function, division
 from optparse import OptionParser
+import heapq
+import operator
 import os
-import vcf
+import re
 import sys
-import operator
+import tempfile
+import pysam
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__))[:-3] + 'python')
+from Indel import *
 
 __author__ = "Louis Dijkstra"
 
@@ -32,15 +38,79 @@ usage = """%prog [options] <vcf-file> <output-vcf-file>
 
 Sorts all records in a VCF file by chromosome and then by position. 
  
-	<vcf-file> 		original VCF file
+	<vcf-file> 		original VCF file (possibly gzipped)
 	<output-vcf-file>	name where the sorted VCF records will be stored	
+
+The order of the chromosomes is taken from the contigs in the header of 
+the VCF file, from the header of a BAM file (-b) or from a .chromosome-lengths 
+file (-r). When none of them is available, the autosomes and the two sex 
+chromosomes are sorted as 1,2,...,22,X,Y. Records on other chromosomes are 
+ignored. Records with the same chromosome and position remain in the order 
+of the VCF file. 
+
+The records are sorted as text lines by their chromosome and position; they 
+are not parsed otherwise. At most the memory budget (-M) is used for keeping 
+records in memory. When the VCF file is larger, the records are sorted in 
+runs that are stored in temporary files (see -T) and merged afterwards. 
 """
 
+DEFAULT_CHROMOSOMES 	= [str(chromosome) for chromosome in range(1, 23)] + ['X', 'Y']
+RECORD_OVERHEAD 	= 120 # approximate # of bytes used in memory per record besides the line itself
+CONTIG_PATTERN 		= re.compile(r'^##contig=<.*?ID=([^,>]+)')
+
+def readChromosomeOrder(filename):
+	"""Returns the chromosomes in the order of a .chromosome-lengths file (first column)."""
+	return [line.split()[0].strip() for line in open(filename, 'r') if line.strip() != '']
+
+def returnContigOrder(header):
+	"""Returns the contigs (##contig lines) in the order of the header of a VCF file."""
+	contigs = []
+	for line in header: 
+		match = CONTIG_PATTERN.match(line)
+		if match != None:
+			contigs.append(match.group(1))
+	return contigs
+
+def returnKey(line, ranks):
+	"""Returns the rank of the chromosome and the position of a record (a line of the VCF 
+	   file), or None when the chromosome is not considered (see ranks)."""
+	values = line.split('\t', 2)
+	rank = ranks.get(values[0])
+	if rank == None:
+		return None
+	return rank, int(values[1])
+
+def writeRun(records, temporary_directory):
+	"""Sorts the records (key, line) and stores the lines in a temporary file. Returns the 
+	   file, rewound to the start."""
+	records.sort(key = operator.itemgetter(0)) # stable: records with the same key remain in order
+	run_file = tempfile.TemporaryFile(mode = 'w+', dir = temporary_directory)
+	run_file.writelines(line for (key, line) in records)
+	run_file.seek(0)
+	return run_file
+
+def readRun(records, run_index):
+	"""Generator over a sorted run of records (key, line) as (key, run_index, i, line), so 
+	   that merging the runs keeps records with the same key in the order of the VCF file."""
+	for i, (key, line) in enumerate(records):
+		yield key, run_index, i, line
+
+def readRunFile(run_file, ranks):
+	"""Generator over the records (key, line) stored in a run file (see writeRun)."""
+	for line in run_file: 
+		yield returnKey(line, ranks), line
+
 def main():
 
 	parser = OptionParser(usage=usage)
+	parser.add_option("-b", action="store", dest="bam_filename", default=None,  
+						help="Sorts the VCF records by chromosome as sorted in the header of this BAM file. (Default = as sorted in the header of the VCF file, see above)")
+	parser.add_option("-M", action="store", dest="memory", default=1024, type=int,  
+						help="Memory budget in MB for the records kept in memory; larger VCF files are sorted in runs (see above). (Default = 1024)")
 	parser.add_option("-r", action="store", dest="reference", default=None,  
-						help="Sorts the VCF records by chromosome as sorted in the .chromosome-lengths file (Default = only autosomes and the two sex chromosomes: 1,2,...,22,X,Y)")
+						help="Sorts the VCF records by chromosome as sorted in the .chromosome-lengths file. (Default = as sorted in the header of the VCF file, see above)")
+	parser.add_option("-T", action="store", dest="temporary_directory", default=None,  
+						help="Directory for the temporary files with the sorted runs. (Default = the system's temporary directory)")
 	parser.add_option("-x", action="store", dest="chromosome", default=None, 
 						help="Processes only this chromosome.")
 	(options, args) = parser.parse_args()
@@ -49,55 +119,75 @@ def main():
 		parser.print_help()
 		return 1
 
-	list_of_chromosome_labels = [] # list of the labels (contains the order information)
-	list_of_records = dict() # list of VCF records per chromosome label
-	if options.reference != None: 
-		for line in open(options.reference, 'r'):
-			chromosome_label = line.split()[0].strip() 
-			list_of_chromosome_labels.append(chromosome_label)
-			list_of_records[chromosome_label] = [] # initialize dictionary with empty list
-		if options.chromosome != None:
-			if not options.chromosome in list_of_chromosome_labels:
-				print("ERROR: chromosome %s is not in the reference (see option -x)"%options.chromosome)
-				return 1 
-			else:
-				list_of_chromosome_labels = [options.chromosome]
-				list_of_records[options.chromosome] = [] 
-	else: # default 
-		if options.chromosome != None: # only process this chromosome
-			list_of_chromosome_labels = [options.chromosome]
-			list_of_records[options.chromosome] = [] 
-		else: 
-			list_of_chromosome_labels = map(str, range(1,23)) + ['X', 'Y']	
-			for chromosome_label in list_of_chromosome_labels: 
-				list_of_records[chromosome_label] = [] 
-
 	vcf_filename 		= os.path.abspath(args[0])
 	vcf_output_filename	= os.path.abspath(args[1])
 
-	vcf_reader 		= vcf.Reader(open(vcf_filename))
-	vcf_writer 		= vcf.Writer(open(vcf_output_filename, 'w'), vcf_reader)
+	vcf_file 		= openVCFFile(vcf_filename)
+	vcf_output_file 	= open(vcf_output_filename, 'w')
+
+	# the header is copied as is 
+	header = []
+	line = vcf_file.readline()
+	while line.startswith('#'):
+		header.append(line)
+		line = vcf_file.readline()
+	vcf_output_file.writelines(header)
+
+	if options.reference != None: 
+		list_of_chromosome_labels = readChromosomeOrder(options.reference)
+	elif options.bam_filename != None: 
+		bam_file = pysam.AlignmentFile(options.bam_filename, 'rb')
+		list_of_chromosome_labels = list(bam_file.references)
+		bam_file.close()
+	else: 
+		list_of_chromosome_labels = returnContigOrder(header)
+		if len(list_of_chromosome_labels) == 0: # default 
+			list_of_chromosome_labels = DEFAULT_CHROMOSOMES
+	if options.chromosome != None: # only process this chromosome
+		if (options.reference != None or options.bam_filename != None) and not options.chromosome in list_of_chromosome_labels:
+			print("ERROR: chromosome %s is not in the reference (see option -x)"%options.chromosome)
+			return 1 
+		list_of_chromosome_labels = [options.chromosome]
+	ranks = dict((chromosome_label, rank) for (rank, chromosome_label) in enumerate(list_of_chromosome_labels))
 
 	list_of_neglected_chromosomes = set()
+	budget 		= options.memory * 1024 * 1024
+	runs 		= [] # files with the sorted runs
+	records 	= [] # records of the current run
+	size 		= 0
 
 	# Walk through all records in the VCF file
-	for vcf_record in vcf_reader: 
-		if not vcf_record.CHROM in list_of_chromosome_labels: # not the chromosome we are currently interested in.		
-			list_of_neglected_chromosomes.add(vcf_record.CHROM)
-			continue
-		list_of_records[vcf_record.CHROM].append(vcf_record)
-		
-	# sort the chromosomes by position
-	for chromosome_label in list_of_chromosome_labels: 
-		list_of_records[chromosome_label].sort(key=operator.attrgetter('POS')) 
-
-	# write them to the new vcf file:
-	for chromosome_label in list_of_chromosome_labels: 
-		for vcf_record in list_of_records[chromosome_label]:
-			vcf_writer.write_record(vcf_record)
+	while line != '':
+		if line.strip() != '':
+			if not line.endswith('\n'):
+				line += '\n'
+			key = returnKey(line, ranks)
+			if key == None: # not the chromosome we are currently interested in.
+				list_of_neglected_chromosomes.add(line.split('\t', 1)[0])
+			else:
+				records.append((key, line))
+				size += len(line) + RECORD_OVERHEAD
+				if size >= budget: 
+					runs.append(writeRun(records, options.temporary_directory))
+					records, size = [], 0
+		line = vcf_file.readline()
+	vcf_file.close()
+
+	# sort the records in memory and merge them with the runs (if any)
+	records.sort(key = operator.itemgetter(0))
+	if len(runs) == 0:
+		vcf_output_file.writelines(line for (key, line) in records)
+	else:
+		sources = [readRun(readRunFile(run_file, ranks), i) for (i, run_file) in enumerate(runs)] + [readRun(records, len(runs))]
+		vcf_output_file.writelines(record[3] for record in heapq.merge(*sources))
+		for run_file in runs: 
+			run_file.close()
+	vcf_output_file.close()
 		
 	# print chromosomes ignored to output
 	print("VCF file %s is sorted and stored @ %s"%(args[0], args[1]))
+	if len(runs) > 0: 
+		print("%d sorted runs were merged."%(len(runs) + 1))
 	
 	if len(list_of_neglected_chromosomes) == 0: 
 		print("No chromosomes were ignored.")
@@ -106,8 +196,5 @@ def main():
 		for label in list_of_neglected_chromosomes:
 			print("\t%s"%label)
 
-	vcf_writer.close()
-
 if __name__ == '__main__':
 	sys.exit(main())
-
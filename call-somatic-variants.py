@@ -23,6 +23,7 @@ from __future__ import print_function, division
 from optparse import OptionParser
 import os
 import sys
+import subprocess
 
 __author__ = "Louis Dijkstra"
 
@@ -34,14 +35,20 @@ usage = """%prog <vcf-file> <healthy-bam> <tumour-bam>
 	<tumour-bam>	Sorted and indexed BAM file of the tumour/
 					case sample. 
 
-(See 'sort-vcf-file.py', 'sort-bam-file.py' and 'index-bam-file.py' 
-for sorting and indexing the VCF and BAM files.)
+(See 'sort-vcf-file.py' and 'prepare-bam-files.py' for sorting and 
+indexing the VCF and BAM files.)
 
 This program runs the entire pipeline to determine for all indels 
 in the given VCF, whether or not they are somatic or not somatic 
 (i.e., germline/not present) on the basis of the provided BAM files 
 of the healthy/control and tumour/case sample. 
 
+With the option --stream, the observations are piped from the 
+extraction straight into the caller, so that calling overlaps with 
+reading the BAM files and no intermediate .raw-observations file is 
+needed. Use --tee to store the observations nevertheless; a later run 
+then resumes from this file, as it does without --stream. 
+
 NOTE: this program assumes that it is placed in the main directory
 of the repository.
 """
@@ -53,6 +60,23 @@ def execute(command, description = None):
 	print("EXECUTING ---> \t%s\n"%command)
 	os.system(command)
 
+def executePipeline(commands, description = None):
+	"""Executes the commands while piping the output of every command into the next one. 
+	   Returns True when all commands succeeded, False otherwise."""
+	if description != None: 
+		barrier = '*' * 50 
+		print("\n%s\n%s\n%s"%(barrier, description, barrier))
+	print("EXECUTING ---> \t%s\n"%' | '.join(commands))
+	sys.stdout.flush()
+	processes = [] 
+	for i, command in enumerate(commands): 
+		stdin 	= processes[-1].stdout if len(processes) > 0 else None
+		stdout 	= subprocess.PIPE if i < len(commands) - 1 else None
+		processes.append(subprocess.Popen(command, shell = True, stdin = stdin, stdout = stdout))
+		if stdin != None: 
+			stdin.close() # the previous command receives SIGPIPE when this one exits early
+	return all([process.wait() == 0 for process in processes])
+
 def readParameters():
 		"""Reads in the parameters from parameters.txt"""
 		parameters_dict = dict() ; # allocate memory 
@@ -98,6 +122,14 @@ def correctInputAndRepository(input_vcf_filename, bam_healthy_filename, bam_tumo
 def main():
 
 	parser = OptionParser(usage=usage)
+	parser.add_option("--solver", action="store", dest="solver", default="brent", choices=["brent", "newton"],
+				  		help="Solver used for the MLE of c_vaf: brent or newton (see sm_caller -S). (Default = brent)")
+	parser.add_option("--stream", action="store_true", dest="stream", default=False, 
+				  		help="Pipes the observations straight from the extraction into the caller; no .raw-observations file is written (see --tee).")
+	parser.add_option("--tee", action="store_true", dest="tee", default=False, 
+				  		help="Stores the observations in intermediate-results/ while streaming, so that a later run can resume from them. Requires --stream.")
+	parser.add_option("-t", action="store", dest="n_threads", default=1, type=int, 
+				  		help="Number of threads used for calling the variants (see sm_caller -t). (Default = 1)")
 	parser.add_option("-v", action="store_true", dest="verbose", default=False, 
 				  		help="Verbose.")
 	(options, args) = parser.parse_args()
@@ -105,6 +137,10 @@ def main():
 	if (len(args)!=3):
 		parser.print_help()
 		return 1	
+
+	if options.tee and not options.stream: 
+		print("ERROR: --tee is only applicable when streaming (see --stream)") 
+		return 1
 	
 	input_vcf_filename 	= os.path.abspath(args[0])
 	bam_healthy_filename 	= os.path.abspath(args[1])
@@ -132,33 +168,47 @@ def main():
 		print("-----\t-----\n") 
 	
 	### EXTRACTING OBSERVATIONS FROM VCF AND BAMs ###
-	command = "python bin/extract-observations.py %s %s %s %s > %s"%(
+	extract_command = "python bin/extract-observations.py %s %s %s %s"%(
 				parameters['ALIGNER'],
 				input_vcf_filename,
 				bam_healthy_filename, 
-				bam_tumour_filename,
-				observations_filename,
+				bam_tumour_filename
 			)
 	
-	if not os.path.exists(observations_filename): 		
-		execute(command, description = "Extracting raw observations")
-	else: 
-		print("\nThe raw observations file %s already exists.\n"%observations_filename) 
-	
 	### CALLING THE VARIANTS ###
-	command = "bin/sm_caller -B -a %s -e %s -E %s -y %s %s > %s"%(
+	call_command = "bin/sm_caller -B -a %s -e %s -E %s -y %s -t %d -S %s"%(
 				parameters['ALPHA'],
 				parameters['EPS_P_DEL'],
 				parameters['EPS_P_INS'],
-				parameters['EPS_A'], 
-				observations_filename,
-				calls_filename
+				parameters['EPS_A'],
+				options.n_threads,
+				options.solver
 			)
-	
-	if not os.path.exists(calls_filename): 
-		execute(command, description = "Calling")
+
+	if options.stream and not os.path.exists(observations_filename) and not os.path.exists(calls_filename): 
+		# the observations are only stored when the extraction finished (see --tee)
+		partial_observations_filename = observations_filename + '.part'
+		commands = [extract_command]
+		if options.tee: 
+			commands.append("tee %s"%partial_observations_filename)
+		commands.append("%s - > %s"%(call_command, calls_filename))
+		if not executePipeline(commands, description = "Extracting raw observations and calling"): 
+			print("ERROR: extracting the observations or calling failed.")
+			if os.path.exists(calls_filename): 
+				os.remove(calls_filename)
+			return 1 
+		if options.tee: 
+			os.rename(partial_observations_filename, observations_filename)
 	else: 
-		print("\nThe calls file %s already exists.\n"%calls_filename) 
+		if not os.path.exists(observations_filename): 		
+			execute("%s > %s"%(extract_command, observations_filename), description = "Extracting raw observations")
+		else: 
+			print("\nThe raw observations file %s already exists.\n"%observations_filename) 
+	
+		if not os.path.exists(calls_filename): 
+			execute("%s %s > %s"%(call_command, observations_filename, calls_filename), description = "Calling")
+		else: 
+			print("\nThe calls file %s already exists.\n"%calls_filename) 
 	
 	### CREATING A VCF FILE WITH THE SOMATIC CALLS ###
 	command = "python bin/calls-to-vcf.py -b %s -s DreamChallenge5.0 %s %s %s"%(
@@ -20,6 +20,7 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 from __future__ import print_function, division
+import sys
 import vcf
 import pysam 
 
@@ -46,6 +47,69 @@ def returnMinimumDifference (list1, list2):
 				min_diff = abs(e1 - e2)
 	return min_diff
 
+CIGAR_OPERATIONS = 'MIDNSHP=X' # CIGAR operations in the order of their codes (M = 0, I = 1, ...)
+
+def parseCigarString (cigar_string):
+	"""Converts a CIGAR string (e.g., '50M2D50M') into a list of (type, length) tuples."""
+	cigar, length = [], ''
+	for character in cigar_string:
+		if character.isdigit():
+			length += character
+		else:
+			cigar.append((CIGAR_OPERATIONS.index(character), int(length)))
+			length = ''
+	return cigar
+
+def returnAlignedSpan (pos, cigar):
+	"""Returns the first and last aligned reference position (as alignment.positions[0] and 
+	   alignment.positions[-1]) of an alignment starting at pos with the given CIGAR. When 
+	   there are no aligned bases, (pos, pos) is returned."""
+	start, end = None, None
+	for (cigar_type, cigar_length) in cigar:
+		if cigar_type == 0 or cigar_type == 7 or cigar_type == 8: # aligned bases
+			if start == None:
+				start = pos
+			end = pos + cigar_length - 1
+		if cigar_type == 0 or cigar_type == 2 or cigar_type == 3 or cigar_type == 7 or cigar_type == 8: # consumes the reference
+			pos += cigar_length
+	if start == None:
+		return pos, pos
+	return start, end
+
+warned_missing_mq = False # the warning on missing MQ tags is printed once (see returnMateMappingQuality)
+
+def returnMateMappingQuality (alignment, tags):
+	"""Returns the mapping quality of the mate of the alignment as given by its MQ tag. When the 
+	   tag is absent (e.g., BWA does not set it; run 'samtools fixmate -m' to add it), the mapping 
+	   quality of the alignment itself is used and a warning is printed on stderr once."""
+	global warned_missing_mq
+	if 'MQ' in tags:
+		return tags['MQ']
+	if not warned_missing_mq:
+		print("WARNING: alignments without MQ tag; the mapping quality of the mate is taken to be that of the alignment itself (run 'samtools fixmate -m' to add the MQ tags).", file = sys.stderr)
+		warned_missing_mq = True
+	return alignment.mapq
+
+def returnMateInternalSegment (alignment):
+	"""Returns the internal segment [start, end] between the alignment and its mate together with the 
+	   alignment probability of the pair. Only the mate fields of the alignment are used: the start of 
+	   the mate is taken from its CIGAR string (MC tag) when present and its mapping quality from the 
+	   MQ tag (when absent, see returnMateMappingQuality). Returns None when the 
+	   alignment is not the left, primary alignment of a pair with both mates on the same chromosome, 
+	   so that every pair is counted exactly once."""
+	if alignment.is_secondary or alignment.flag & 0x800 or alignment.mate_is_unmapped or alignment.isize == 0:
+		return None
+	if alignment.mrnm != alignment.tid: # mate lies on another chromosome
+		return None
+	if alignment.mpos < alignment.pos or (alignment.mpos == alignment.pos and not alignment.is_read1): # right mate
+		return None
+	tags = dict(alignment.tags)
+	mate_start, mate_mapq = alignment.mpos, returnMateMappingQuality(alignment, tags)
+	if 'MC' in tags:
+		mate_start = returnAlignedSpan(alignment.mpos, parseCigarString(tags['MC']))[0]
+	end = returnAlignedSpan(alignment.pos, alignment.cigar)[1]
+	return end + 1, mate_start - 1, (1.0 - convertPhredScore(alignment.mapq)) * (1.0 - convertPhredScore(mate_mapq))
+
 class DummyAlignment: 
 	"""Class that only contains the observation (value) and alignment probability."""
 	def __init__(self, value, probability):
@@ -27,6 +27,8 @@ import numpy as np
 
 from Indel import *
 from Alignments import *
+from ReadBuffer import *
+from ReadSummary import *
 
 __author__ = "Louis Dijkstra"
 
@@ -37,13 +39,28 @@ __author__ = "Louis Dijkstra"
 	BAMProcessor class is derived from this one. 
 """
 
+class Evidence:
+	"""Evidence collected for one indel while walking through the alignments in its vicinity."""
+	def __init__(self):
+		self.splits 		= [] 	# split read observations
+		self.splits_prob 	= [] 	# associated alignment probabilities
+		self.alignment_dict 	= defaultdict(list) # non-overlapping alignments by read name (to be paired)
+		self.isize 		= [] 	# internal segment lengths derived from the mate fields (see mate_coordinates)
+		self.isize_prob 	= [] 	# associated alignment probabilities
+
 class BAMProcessor: 
 	"""Superclass for processing BAM files."""
 
-	def __init__(self, bam_filename, search_range = 5000, primary_alignments_only = False):
+	def __init__(self, bam_filename, search_range = 5000, primary_alignments_only = False, sweep = False, columnar = False, mate_coordinates = False):
 		self.bam_reader 		= pysam.Samfile(bam_filename, "rb")
 		self.search_range 		= search_range # range in which one searches for alignments
 		self.primary_alignments_only 	= primary_alignments_only # when True, only primary alignments are considered
+		self.read_buffer 		= None # when sweeping, alignments are reused across neighbouring variants
+		if sweep:
+			self.read_buffer = ReadBuffer(self.bam_reader)
+		self.n_decoded 			= 0 # number of alignments decoded from the BAM file (not counting the read buffer)
+		self.columnar 			= columnar # when True, the alignments in a window are processed at once (see ReadSummary)
+		self.mate_coordinates 		= mate_coordinates # when True, internal segments are derived from the mate fields of the left mate (see returnMateInternalSegment)
 		
 	def determineSupportDeletionSingleAlignment(self, deletion, alignment): 
 		"Needs to be implemented in the subclass"
@@ -53,39 +70,86 @@ class BAMProcessor:
 		"Needs to be implemented in the subclass"
 		pass 
 
+	def determineSupportDeletionSummary(self, deletion, summary): 
+		"Needs to be implemented in the subclass. Returns for every alignment in the ReadSummary whether it supports the deletion (0/1)"
+		pass 
+
+	def determineSupportInsertionSummary(self, insertion, summary): 
+		"Needs to be implemented in the subclass. Returns for every alignment in the ReadSummary whether it supports the insertion (0/1)"
+		pass 
+
 
 	def close(self): 
 		"""Closes the BAM file."""
 		self.bam_reader.close()
 
+	def fetch(self, chromosome, start, end):
+		"""Returns the alignments that overlap the interval [start, end) on the given chromosome."""
+		if self.read_buffer != None:
+			return self.read_buffer.fetch(chromosome, start, end)
+		alignments = list(self.bam_reader.fetch(chromosome, start, end))
+		self.n_decoded += len(alignments)
+		return alignments
+
+	def returnNumberOfDecodedAlignments(self):
+		"""Returns the number of alignments decoded from the BAM file so far."""
+		if self.read_buffer != None:
+			return self.n_decoded + self.read_buffer.n_decoded
+		return self.n_decoded
+
 	def process(self, vcf_record):
 		"""Collects the evidence (both overlapping and internal segment based) for a given indel (vcf record)."""
-		if isDeletion(vcf_record):
-			return processDeletion (self, Deletion(vcf_record))
-		elif isInsertion(vcf_record):
-			return processInsertion (self, Insertion(vcf_record))
-		else:
-			assert False 
+		indel = returnIndel(vcf_record)
+		assert indel != None
+		return self.processIndel(indel)
+
+	def returnSearchWindow(self, indel):
+		"""Returns the interval [start, end) in which one searches for alignments relevant for the given indel.
+		   When the internal segments are derived from the mate fields, only the left mates are needed 
+		   and the window does not have to extend to the right of the indel."""
+		if self.mate_coordinates:
+			if isinstance(indel, Deletion):
+				return max(0, int(min(indel.centerpoints)) - self.search_range), int(max(indel.centerpoints)) + 1
+			return max(0, indel.position - self.search_range), indel.position + 1
+		if isinstance(indel, Deletion):
+			return max(0, indel.start - 1 - self.search_range), indel.end + 1 + self.search_range
+		return max(0, indel.position - self.search_range), indel.position + 1 + self.search_range
 
 	def processDeletion(self, deletion):
 		"""Collects the evidence (both overlapping and internal segment based) for a given deletion."""
-		isize, isize_prob, splits, splits_prob = [], [], [], []
-		
-		alignment_dict = defaultdict(list)
+		evidence = Evidence()
 
 		# fetch the alignments in the vicinity of the deletion
-		for alignment in self.bam_reader.fetch(deletion.chromosome, max(0, deletion.start - 1 - self.search_range), deletion.end + 1 + self.search_range):
-			if alignment.isize == 0: # alignment is unmapped
-				continue
-			# determine whether this individual read is relevant 			
-			if alignment.positions[0] < min(deletion.centerpoints) and alignment.positions[-1] > max(deletion.centerpoints): # read overlaps the centerpoints of the deletion 
-				splits.append(self.determineSupportDeletionSingleAlignment(deletion, alignment))
-				splits_prob.append(1.0 - convertPhredScore(alignment.mapq))
-			else:
-				alignment_dict[alignment.qname].append(alignment)
+		start, end = self.returnSearchWindow(deletion)
+		if self.columnar:
+			return self.processDeletionSummary(deletion, ReadSummary(self.fetch(deletion.chromosome, start, end), self.mate_coordinates))
+		for alignment in self.fetch(deletion.chromosome, start, end):
+			self.addAlignmentDeletion(deletion, alignment, evidence)
+
+		return self.returnObservationsDeletion(deletion, evidence)
+
+	def addAlignmentDeletion(self, deletion, alignment, evidence):
+		"""Adds the evidence of one alignment for the given deletion."""
+		if alignment.isize == 0: # alignment is unmapped
+			return
+		# determine whether this individual read is relevant 			
+		if alignment.positions[0] < min(deletion.centerpoints) and alignment.positions[-1] > max(deletion.centerpoints): # read overlaps the centerpoints of the deletion 
+			evidence.splits.append(self.determineSupportDeletionSingleAlignment(deletion, alignment))
+			evidence.splits_prob.append(1.0 - convertPhredScore(alignment.mapq))
+		elif self.mate_coordinates:
+			segment = returnMateInternalSegment(alignment)
+			if segment != None and segment[0] <= min(deletion.centerpoints) and segment[1] >= max(deletion.centerpoints):
+				evidence.isize.append(segment[1] - segment[0] + 1)
+				evidence.isize_prob.append(segment[2])
+		else:
+			evidence.alignment_dict[alignment.qname].append(alignment)
+
+	def returnObservationsDeletion(self, deletion, evidence):
+		"""Returns the observations for the given deletion once all alignments have been added."""
+		isize, isize_prob = evidence.isize, evidence.isize_prob # empty unless derived from the mate fields
 
 		# walk through the paired-end reads
-		for qname, alignments in alignment_dict.iteritems():
+		for qname, alignments in evidence.alignment_dict.iteritems():
 			if len(alignments) == 2: # paired-end read 
 				align_l, align_r = alignments[0], alignments[1]
 				if align_r.positions[-1] < align_l.positions[0]:
@@ -98,27 +162,43 @@ class BAMProcessor:
 					isize.append(interval_segm_end - interval_segm_start + 1)
 					isize_prob.append((1.0 - convertPhredScore(align_l.mapq)) * (1.0 - convertPhredScore(align_r.mapq)))
 
-		return np.array(isize), np.array(isize_prob), np.array(splits), np.array(splits_prob)
+		return np.array(isize), np.array(isize_prob), np.array(evidence.splits), np.array(evidence.splits_prob)
 
 	def processInsertion(self, insertion):
 		"""Collects the evidence (both overlapping and internal segment based) for a given deletion."""
-		isize, isize_prob, splits, splits_prob = [], [], [], []
-		
-		alignment_dict = defaultdict(list)
+		evidence = Evidence()
 
 		# fetch the alignments in the vicinity of the deletion
-		for alignment in self.bam_reader.fetch(insertion.chromosome, max(0, insertion.position - self.search_range), insertion.position + 1 + self.search_range):
-			if alignment.isize == 0: # alignment is unmapped
-				continue
-			# determine whether this individual read is relevant 			
-			if alignment.positions[0] < insertion.position and alignment.positions[-1] > insertion.position:
-				splits.append(self.determineSupportInsertionSingleAlignment(insertion, alignment))
-				splits_prob.append(1.0 - convertPhredScore(alignment.mapq))
-			else:
-				alignment_dict[alignment.qname].append(alignment)
+		start, end = self.returnSearchWindow(insertion)
+		if self.columnar:
+			return self.processInsertionSummary(insertion, ReadSummary(self.fetch(insertion.chromosome, start, end), self.mate_coordinates))
+		for alignment in self.fetch(insertion.chromosome, start, end):
+			self.addAlignmentInsertion(insertion, alignment, evidence)
+
+		return self.returnObservationsInsertion(insertion, evidence)
+
+	def addAlignmentInsertion(self, insertion, alignment, evidence):
+		"""Adds the evidence of one alignment for the given insertion."""
+		if alignment.isize == 0: # alignment is unmapped
+			return
+		# determine whether this individual read is relevant 			
+		if alignment.positions[0] < insertion.position and alignment.positions[-1] > insertion.position:
+			evidence.splits.append(self.determineSupportInsertionSingleAlignment(insertion, alignment))
+			evidence.splits_prob.append(1.0 - convertPhredScore(alignment.mapq))
+		elif self.mate_coordinates:
+			segment = returnMateInternalSegment(alignment)
+			if segment != None and segment[0] <= insertion.position and segment[1] >= insertion.position + 1:
+				evidence.isize.append(segment[1] - segment[0] + 1)
+				evidence.isize_prob.append(segment[2])
+		else:
+			evidence.alignment_dict[alignment.qname].append(alignment)
+
+	def returnObservationsInsertion(self, insertion, evidence):
+		"""Returns the observations for the given insertion once all alignments have been added."""
+		isize, isize_prob = evidence.isize, evidence.isize_prob # empty unless derived from the mate fields
 
 		# walk through the paired-end reads
-		for qname, alignments in alignment_dict.iteritems():
+		for qname, alignments in evidence.alignment_dict.iteritems():
 			if len(alignments) == 2: # paired-end read 
 				align_l, align_r = alignments[0], alignments[1]
 				if align_r.positions[-1] < align_l.positions[0]:
@@ -131,5 +211,99 @@ class BAMProcessor:
 					isize.append(interval_segm_end - interval_segm_start + 1)
 					isize_prob.append((1.0 - convertPhredScore(align_l.mapq)) * (1.0 - convertPhredScore(align_r.mapq)))
 
-		return np.array(isize), np.array(isize_prob), np.array(splits), np.array(splits_prob)
+		return np.array(isize), np.array(isize_prob), np.array(evidence.splits), np.array(evidence.splits_prob)
+
+	def processDeletionSummary(self, deletion, summary):
+		"""Collects the evidence for a given deletion from the ReadSummary of the alignments in its vicinity."""
+		reads 		= summary.reads
+		overlapping 	= (reads['start'] < min(deletion.centerpoints)) & (reads['end'] > max(deletion.centerpoints)) # reads overlap the centerpoints of the deletion
+		splits 		= self.determineSupportDeletionSummary(deletion, summary)[overlapping]
+		splits_prob 	= summary.returnAlignmentProbabilities()[overlapping]
+
+		# walk through the paired-end reads
+		if self.mate_coordinates:
+			segment_start, segment_end, probability = summary.returnMateInternalSegments(~overlapping)
+		else:
+			segment_start, segment_end, probability = summary.returnInternalSegments(~overlapping)
+		relevant = (segment_start <= min(deletion.centerpoints)) & (segment_end >= max(deletion.centerpoints))
+
+		return segment_end[relevant] - segment_start[relevant] + 1, probability[relevant], splits, splits_prob
+
+	def processInsertionSummary(self, insertion, summary):
+		"""Collects the evidence for a given insertion from the ReadSummary of the alignments in its vicinity."""
+		reads 		= summary.reads
+		overlapping 	= (reads['start'] < insertion.position) & (reads['end'] > insertion.position)
+		splits 		= self.determineSupportInsertionSummary(insertion, summary)[overlapping]
+		splits_prob 	= summary.returnAlignmentProbabilities()[overlapping]
+
+		# walk through the paired-end reads
+		if self.mate_coordinates:
+			segment_start, segment_end, probability = summary.returnMateInternalSegments(~overlapping)
+		else:
+			segment_start, segment_end, probability = summary.returnInternalSegments(~overlapping)
+		relevant = (segment_start <= insertion.position) & (segment_end >= insertion.position + 1)
+
+		return segment_end[relevant] - segment_start[relevant] + 1, probability[relevant], splits, splits_prob
+
+	def processIndel(self, indel):
+		"""Collects the evidence for a given deletion/insertion."""
+		if isinstance(indel, Deletion):
+			return self.processDeletion(indel)
+		return self.processInsertion(indel)
+
+	def processIndels(self, indels):
+		"""Collects the evidence for a list of deletions/insertions while walking only once through
+		   the BAM file: every alignment is handed to all indels whose search window it overlaps. 
+		   Returns the observations in the same order as the given indels."""
+		observations 	= [None] * len(indels)
+		evidence 	= [None] * len(indels)
+		windows 	= [self.returnSearchWindow(indel) for indel in indels]
+		
+		# the functions for adding an alignment and returning the observations (per indel)
+		add_alignment, return_observations = [], [] 
+		for indel in indels: 
+			if isinstance(indel, Deletion):
+				add_alignment.append(self.addAlignmentDeletion)
+				return_observations.append(self.returnObservationsDeletion)
+			else:
+				add_alignment.append(self.addAlignmentInsertion)
+				return_observations.append(self.returnObservationsInsertion)
+
+		chromosomes = []
+		for indel in indels:
+			if not indel.chromosome in chromosomes: 
+				chromosomes.append(indel.chromosome)
+
+		for chromosome in chromosomes:
+			# indels on this chromosome sorted by the start of their search window
+			pending = sorted([i for i in range(len(indels)) if indels[i].chromosome == chromosome], key = lambda i: windows[i][0])
+			start 	= windows[pending[0]][0]
+			end 	= max([windows[i][1] for i in pending])
+			
+			active, k = [], 0 # indels whose search window might overlap the current alignment, next pending indel
+			for alignment in self.bam_reader.fetch(chromosome, start, end):
+				self.n_decoded += 1
+				alignment_end = returnAlignmentEnd(alignment)
+				while k < len(pending) and windows[pending[k]][0] < alignment_end:
+					evidence[pending[k]] = Evidence()
+					active.append(pending[k])
+					k += 1
+				still_active = []
+				for i in active: 
+					if alignment.pos >= windows[i][1]: # the search window lies entirely left of the alignment
+						observations[i] = return_observations[i](indels[i], evidence[i]) 
+						evidence[i] = None
+					else: 
+						if alignment_end > windows[i][0]: 
+							add_alignment[i](indels[i], alignment, evidence[i])
+						still_active.append(i)
+				active = still_active
+
+			# the indels for which not all observations have been returned yet 	
+			for i in active + pending[k:]:
+				if evidence[i] == None: 
+					evidence[i] = Evidence()
+				observations[i] = return_observations[i](indels[i], evidence[i])
+				evidence[i] = None
 
+		return observations
@@ -30,8 +30,8 @@ __author__ = "Louis Dijkstra"
 
 class BWABAMProcessor(BAMProcessor): 
 	"""Class for processing BWA BAM files. Contains all functionality needed for retrieving alignments."""
-	def __init__(self, bam_filename, search_range = 5000, primary_alignments_only = False):
-		BAMProcessor.__init__(self, bam_filename, search_range = search_range, primary_alignments_only = primary_alignments_only)	
+	def __init__(self, bam_filename, search_range = 5000, primary_alignments_only = False, sweep = False, columnar = False, mate_coordinates = False):
+		BAMProcessor.__init__(self, bam_filename, search_range = search_range, primary_alignments_only = primary_alignments_only, sweep = sweep, columnar = columnar, mate_coordinates = mate_coordinates)	
 
 	def determineSupportDeletionSingleAlignment(self, deletion, alignment): 
 		for (cigar_type, cigar_length) in alignment.cigar: # walk through the cigar string
@@ -45,6 +45,12 @@ class BWABAMProcessor(BAMProcessor):
 			if cigar_type == 1: # insertion
 				if abs(cigar_length - insertion.length) <= 1: 
 					return 1 
-		return 0 
-	
+		return 0
+
+	def determineSupportDeletionSummary(self, deletion, summary):
+		ops = summary.ops
+		return summary.returnReadsWithOperation(ops['read'][(ops['type'] == 2) & (np.abs(ops['length'] - deletion.length) <= 1)])
 
+	def determineSupportInsertionSummary(self, insertion, summary):
+		ops = summary.ops
+		return summary.returnReadsWithOperation(ops['read'][(ops['type'] == 1) & (np.abs(ops['length'] - insertion.length) <= 1)])
@@ -29,10 +29,27 @@ __author__ = "Louis Dijkstra"
 	(This used to be the way we processed a BAM file)
 """
 
+def returnMinimumDifferenceCenterpoints(ops, length, length_thres, centerpoints):
+	"""Returns for every CIGAR operation in ops (see ReadSummary) the minimal difference between
+	   its centerpoints and the given centerpoints. Like determineSupport*SingleAlignment, the
+	   operations that differ too much in length do not count towards the offset of later ones."""
+	skipped 	= np.abs(ops['length'] - length) > length_thres
+	penalty 	= np.where(skipped, ops['length'], 0)
+	cumulative 	= np.cumsum(penalty) - penalty
+	first 		= np.searchsorted(ops['read'], ops['read']) # first operation of the same alignment
+	offset 		= ops['offset'] - (cumulative - cumulative[first])
+
+	centerpoint_right = offset + ops['length'] / 2
+	centerpoint_left = np.where(ops['length'] % 2 == 0, centerpoint_right - 1, centerpoint_right)
+	min_diff = np.full(len(ops), np.inf)
+	for centerpoint in centerpoints:
+		min_diff = np.minimum(min_diff, np.minimum(np.abs(centerpoint_left - centerpoint), np.abs(centerpoint_right - centerpoint)))
+	return min_diff
+
 class DefaultBAMProcessor(BAMProcessor): 
 	"""Class for processing BAM files. Contains all functionality needed for retrieving alignments."""
-	def __init__(self, bam_filename, search_range = 5000, primary_alignments_only = False, centerpoints_thres_del = 50, centerpoints_thres_ins = 50, length_thres_del = 20, length_thres_ins = 20):
-		BAMProcessor.__init__(self, bam_filename, search_range = search_range, primary_alignments_only = primary_alignments_only)
+	def __init__(self, bam_filename, search_range = 5000, primary_alignments_only = False, centerpoints_thres_del = 50, centerpoints_thres_ins = 50, length_thres_del = 20, length_thres_ins = 20, sweep = False, columnar = False, mate_coordinates = False):
+		BAMProcessor.__init__(self, bam_filename, search_range = search_range, primary_alignments_only = primary_alignments_only, sweep = sweep, columnar = columnar, mate_coordinates = mate_coordinates)
 		self.centerpoints_thres_del 	= centerpoints_thres_del	
 		self.centerpoints_thres_ins 	= centerpoints_thres_ins
 		self.length_thres_del		= length_thres_del 
@@ -69,5 +86,15 @@ class DefaultBAMProcessor(BAMProcessor):
 					return 1 
 			i += cigar_length
 		return 0
-	
 
+	def determineSupportDeletionSummary(self, deletion, summary): 
+		ops = summary.ops[summary.ops['type'] == 2] # deletions only
+		selection = np.abs(ops['length'] - deletion.length) <= self.length_thres_del
+		selection &= returnMinimumDifferenceCenterpoints(ops, deletion.length, self.length_thres_del, deletion.centerpoints) <= self.centerpoints_thres_del
+		return summary.returnReadsWithOperation(ops['read'][selection])
+
+	def determineSupportInsertionSummary(self, insertion, summary):
+		ops = summary.ops[summary.ops['type'] == 1] # insertions only
+		selection = np.abs(ops['length'] - insertion.length) <= self.length_thres_ins
+		selection &= returnMinimumDifferenceCenterpoints(ops, insertion.length, self.length_thres_ins, [insertion.position, insertion.position + 1]) <= self.centerpoints_thres_ins
+		return summary.returnReadsWithOperation(ops['read'][selection])
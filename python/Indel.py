@@ -20,6 +20,13 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 from __future__ import print_function, division
+import gzip
+import io
+import os
+import struct
+import zipfile
+import numpy as np
+import pysam
 import vcf
 
 __author__ = "Louis Dijkstra"
@@ -29,6 +36,8 @@ __author__ = "Louis Dijkstra"
 	Used by the VAF Estimator and the Somatic Mutation Caller. 
 """
 
+SVTYPES = {'DEL': '-', 'INS': '+'} # types of the indels given the value of SVTYPE (see classifyIndel)
+
 def returnMinimumDifference (list1, list2):
 	"""Returns minimal difference between all possible pairs of elements contained in list1 and list2."""
 	min_diff = float("inf")
@@ -92,23 +101,122 @@ def getDelta (vcf_record):
 		return returnIndelLength(vcf_record)
 	return -1.0 * returnIndelLength(vcf_record)
 
-class Indel: 
-	"""Class for representing an indel (deletion/insertion)."""
-	def __init__(self, vcf_record):
-		self.vcf_record = vcf_record 
-		self.chromosome = str(vcf_record.CHROM)
-		self.length 	= returnIndelLength(vcf_record)
-
-	def getTrueVAF (self):
-		"""Returns true variant allele frequency as given in VCF file."""
-		if self.vcf_record.heterozygosity == 0.5:
-			return 0.5 
-		else:
-			return 1.0	
+def firstValue (value):
+	"""Returns the first value of an INFO field with several values (a list or tuple); other values are returned as is."""
+	if isinstance(value, (list, tuple)):
+		return value[0]
+	return value
+
+def classifyIndel (svtype, svlen, ref, alt):
+	"""Returns the type ('-' for a deletion, '+' for an insertion, None otherwise) and the length of a variant 
+	   given the (first) values of SVTYPE and SVLEN (None when absent), REF and ALT. Follows isDeletion, 
+	   isInsertion and returnIndelLength, but does not need a PyVCF record."""
+	if svtype != None: 
+		variant_type = SVTYPES.get(svtype)
+	elif len(ref) > 1 and len(alt) == 1: 
+		variant_type = '-'
+	elif len(ref) == 1 and len(alt) > 1: 
+		variant_type = '+'
+	else:
+		variant_type = None
+	if svlen != None: 
+		return variant_type, abs(int(svlen))
+	return variant_type, abs(len(ref) + 1 - len(alt))
+
+def newIndel (variant_type, chromosome, position, length):
+	"""Returns a Deletion ('-') or Insertion ('+'), or None for any other type."""
+	if variant_type == '-':
+		return Deletion(chromosome, position, length)
+	if variant_type == '+':
+		return Insertion(chromosome, position, length)
+	return None
+
+def returnIndel (vcf_record):
+	"""Returns the deletion/insertion represented by a PyVCF record (None when it is not an indel). 
+	   NOTE: only considers the first alternative (ALT[0]); others are neglected."""
+	if vcf_record.ALT[0] == None:
+		return None
+	variant_type, length = classifyIndel(firstValue(vcf_record.INFO.get('SVTYPE')), firstValue(vcf_record.INFO.get('SVLEN')), vcf_record.REF, str(vcf_record.ALT[0]))
+	return newIndel(variant_type, str(vcf_record.CHROM), vcf_record.POS, length)
+
+def returnInfoValue (record, key):
+	"""Returns the first value of the INFO key of a pysam record (None when absent). pysam raises 
+	   an error for keys that are not defined in the header; htslib adds keys to the header 
+	   when it encounters them in a record, so the key is absent when it is not defined."""
+	if not key in record.header.info:
+		return None
+	return firstValue(record.info.get(key))
+
+def openVCFFile (vcf_filename):
+	"""Opens a (possibly gzipped/bgzipped) VCF file as text."""
+	with open(vcf_filename, 'rb') as vcf_file:
+		compressed = vcf_file.read(2) == b'\x1f\x8b'
+	if compressed:
+		return io.TextIOWrapper(gzip.open(vcf_filename, 'rb'))
+	return open(vcf_filename, 'r')
+
+def readRecordIndels (vcf_filename):
+	"""Generator over the indels in a VCF file (possibly bgzipped) together with the offset of their 
+	   record in the file (see pysam's VariantFile.tell and seek; a virtual offset when the file is 
+	   bgzipped). The records are parsed by htslib and classified once; only the indels themselves 
+	   are kept (see Indel). Records that are not an indel or that have several alternatives are skipped."""
+	vcf_file = pysam.VariantFile(vcf_filename)
+	while True:
+		offset = vcf_file.tell()
+		record = next(vcf_file, None)
+		if record is None: 
+			break
+		if record.alts == None or len(record.alts) != 1: 
+			continue
+		variant_type, length = classifyIndel(returnInfoValue(record, 'SVTYPE'), returnInfoValue(record, 'SVLEN'), record.ref, record.alts[0])
+		indel = newIndel(variant_type, record.chrom, record.pos, length)
+		if indel != None: 
+			yield offset, indel
+	vcf_file.close()
+
+def readIndels (vcf_filename):
+	"""Generator over the indels in a VCF file (possibly bgzipped). See readRecordIndels."""
+	for offset, indel in readRecordIndels(vcf_filename):
+		yield indel
+
+def memoryMapArchive (filename):
+	"""Returns the arrays in an uncompressed .npz file (see np.savez) as a dictionary. The file 
+	   is memory-mapped and the arrays are views on it (np.load reads the arrays in an archive 
+	   into memory). Their location in the file follows from the zip and .npy headers."""
+	data 	= np.memmap(filename, dtype = np.uint8, mode = 'r')
+	arrays 	= dict()
+	with zipfile.ZipFile(filename) as archive, open(filename, 'rb') as archive_file:
+		for info in archive.infolist():
+			if info.compress_type != zipfile.ZIP_STORED:
+				raise ValueError('%s is compressed and cannot be memory-mapped'%filename)
+			# the local file header (30 bytes) ends with the lengths of the name and the extra field
+			archive_file.seek(info.header_offset + 26)
+			name_length, extra_length = struct.unpack('<HH', archive_file.read(4))
+			archive_file.seek(info.header_offset + 30 + name_length + extra_length)
+			version = np.lib.format.read_magic(archive_file)
+			if version == (1, 0):
+				shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(archive_file)
+			else:
+				shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(archive_file)
+			start 	= archive_file.tell()
+			n 	= int(np.prod(shape))
+			array 	= data[start : start + dtype.itemsize * n].view(dtype)
+			arrays[os.path.splitext(info.filename)[0]] = array.reshape(shape, order = 'F' if fortran_order else 'C')
+	return arrays
+
+class Indel(object): 
+	"""Class for representing an indel (deletion/insertion). Only the chromosome, position (POS) 
+	   and length are stored, so that many indels can be kept in memory (see readIndels)."""
+	__slots__ = ('chromosome', 'position', 'length')
+
+	def __init__(self, chromosome, position, length):
+		self.chromosome = chromosome
+		self.position 	= position 
+		self.length 	= length
 
 	def isDeletion(self):
 		"""Returns True when indel is a deletion, False otherwise"""
-		return isDeletion(self.vcf_record)
+		return isinstance(self, Deletion)
 
 	def fallsInLengthRange (self, lower = None, upper = None):
 		"""Checks whether an indel is in a length range. In case of 'None', that side of the interval is considered unbounded, e.g., [250, None] are all indels of length larger than 250"""
@@ -119,13 +227,20 @@ class Indel:
 			if self.length > upper:
 				return False
 		return True
+
+	def print(self):
+		"""Prints most relevant data on the indel to standard output"""
+		print(self.chromosome, '\t', self.position, '\t', self.length, '\t', end = "")
 	
 class Deletion(Indel):
 	"""Class for representing a deletion. """
-	def __init__(self, vcf_record):
-		Indel.__init__(self, vcf_record)
+	__slots__ = ('start', 'end', 'centerpoints')
+	variant_type = '-'
+
+	def __init__(self, chromosome, position, length):
+		Indel.__init__(self, chromosome, position, length)
 		# Interval which is deleted [start, end]:
-		self.start = self.vcf_record.POS + 1
+		self.start = position + 1
 		self.end   = self.start + self.length - 1
 		# centerpoints are the points in the middle of the deletion; when length is even, there are two, otherwise one
 		if self.length % 2 == 0: 
@@ -133,10 +248,6 @@ class Deletion(Indel):
 		else: 
 			self.centerpoints = [self.start + self.length / 2]
 
-	def print(self):
-		"""Prints most relevant data on the deletion to standard output"""
-		print(self.chromosome, '\t', self.vcf_record.POS, '\t', self.length, '\t', end = "")
-
 	def similarTo(self, other_deletion, difference_length_threshold = 100, difference_centerpoint_threshold = 100):
 		"""Returns True when the other_deletion is considered similar. Otherwise False."""
 		if returnMinimumDifference(self.centerpoints, other_deletion.centerpoints) > difference_centerpoint_threshold:
@@ -151,13 +262,8 @@ class Deletion(Indel):
 
 class Insertion(Indel):
 	"""Class for represenitng an insertion."""
-	def __init__(self, vcf_record):
-		Indel.__init__(self, vcf_record)
-		self.position = vcf_record.POS 
-
-	def print(self):
-		"""Prints most relevant data on the deletion to standard output"""
-		print(self.chromosome, '\t', self.vcf_record.POS, '\t', self.length, '\t', end = "")
+	__slots__ = ()
+	variant_type = '+'
 
 	def similarTo(self, other_insertion, difference_length_threshold = 100, difference_centerpoint_threshold = 100):
 		"""Returns True when the other_insertion is considered similar. Otherwise False."""
@@ -170,4 +276,181 @@ class Insertion(Indel):
 	def returnDifferenceInCenterpoints(self, other_insertion):
 		return returnMinimumDifference([self.position, self.position + 1], [other_insertion.position, other_insertion.position + 1])
 
-	
+
+
+class IndelTable(object):
+	"""Table of the indels in a VCF file (see readRecordIndels) stored as NumPy arrays, one per 
+	   column, with a row per indel in the order of the VCF file: 
+
+		chromosome 	code of the chromosome (index in chromosome_names)
+		position 	POS
+		end 		end of the indel (POS + length for a deletion, POS for an insertion)
+		length 		length of the indel
+		variant_type 	'-' for a deletion, '+' for an insertion
+		centerpoints 	centerpoints of the indel (see Deletion; two equal values when there is one)
+		offset 		offset of the record in the VCF file (see readRecordIndels)
+
+	   The table is built once and stored next to the VCF file (<vcf-file>.npz, see returnIndelTable). 
+	   Later, the stored table is memory-mapped instead."""
+	COLUMNS = ('chromosome_names', 'chromosome', 'position', 'end', 'length', 'variant_type', 'centerpoints', 'offset')
+
+	def __init__(self, arrays):
+		for column in IndelTable.COLUMNS:
+			setattr(self, column, arrays[column])
+		self.chromosome_codes 	= dict((str(name), code) for (code, name) in enumerate(self.chromosome_names))
+		self.chromosome_list 	= [str(name) for name in self.chromosome_names]
+		self.sorted_keys 	= None # see returnIndices
+
+	@staticmethod
+	def fromVCF(vcf_filename):
+		"""Builds the table of the indels in the VCF file."""
+		chromosome_codes = dict()
+		chromosome, position, length, variant_type, offset = [], [], [], [], []
+		for record_offset, indel in readRecordIndels(vcf_filename):
+			chromosome.append(chromosome_codes.setdefault(indel.chromosome, len(chromosome_codes)))
+			position.append(indel.position)
+			length.append(indel.length)
+			variant_type.append(indel.variant_type)
+			offset.append(record_offset)
+		arrays = {
+			'chromosome_names': 	np.array(sorted(chromosome_codes, key = chromosome_codes.get), dtype = np.str_), 
+			'chromosome': 		np.array(chromosome, dtype = np.int32), 
+			'position': 		np.array(position, dtype = np.int64), 
+			'length': 		np.array(length, dtype = np.int64), 
+			'variant_type': 	np.array(variant_type, dtype = 'S1'), 
+			'offset': 		np.array(offset, dtype = np.int64)
+		}
+		is_deletion 		= arrays['variant_type'] == b'-'
+		arrays['end'] 		= arrays['position'] + np.where(is_deletion, arrays['length'], 0)
+		# see Deletion and Insertion 
+		start 			= arrays['position'] + 1.0
+		centerpoints 		= np.empty((len(start), 2))
+		centerpoints[:, 0] 	= np.where(arrays['length'] % 2 == 0, start + arrays['length'] / 2 - 1, start + arrays['length'] / 2)
+		centerpoints[:, 1] 	= start + arrays['length'] / 2
+		arrays['centerpoints'] 	= np.where(is_deletion[:, np.newaxis], centerpoints, arrays['position'][:, np.newaxis] + np.array([0.0, 1.0]))
+		return IndelTable(arrays)
+
+	@staticmethod
+	def load(filename):
+		"""Returns the table stored in the given file (see save). The file is memory-mapped."""
+		return IndelTable(memoryMapArchive(filename))
+
+	def save(self, filename, source = None):
+		"""Stores the table in an uncompressed .npz file, so that it can be memory-mapped (see load). 
+		   The size and modification time of the VCF file (source) are stored along with the table."""
+		arrays = dict((column, getattr(self, column)) for column in IndelTable.COLUMNS)
+		if source != None: 
+			arrays['source'] = returnSourceSignature(source)
+		with open(filename, 'wb') as table_file:
+			np.savez(table_file, **arrays)
+
+	def __len__(self):
+		return len(self.position)
+
+	def returnIndel(self, i):
+		"""Returns the i-th indel as a Deletion or Insertion."""
+		return newIndel(self.variant_type[i].decode(), self.chromosome_list[self.chromosome[i]], int(self.position[i]), int(self.length[i]))
+
+	def returnIndels(self, mask = None):
+		"""Generator over the indels (see returnIndel) in the order of the VCF file. When a mask 
+		   is given, only the indels for which it is True are returned."""
+		indices = range(len(self)) if mask is None else np.flatnonzero(mask).tolist()
+		for i in indices:
+			yield self.returnIndel(i)
+
+	def lengthMask(self, lower = None, upper = None):
+		"""Returns which indels are in the length range (see Indel.fallsInLengthRange)."""
+		mask = np.ones(len(self), dtype = bool)
+		if lower != None:
+			mask &= self.length >= lower
+		if upper != None:
+			mask &= self.length <= upper
+		return mask
+
+	def typeMask(self, deletions_only = False, insertions_only = False):
+		"""Returns which indels are of the requested type (all when neither option is set)."""
+		mask = np.ones(len(self), dtype = bool)
+		if deletions_only: 
+			mask &= self.variant_type == b'-'
+		if insertions_only: 
+			mask &= self.variant_type == b'+'
+		return mask
+
+	def chromosomeMask(self, chromosome):
+		"""Returns which indels are on the given chromosome."""
+		return self.chromosome == self.chromosome_codes.get(str(chromosome), -1)
+
+	def returnKeys(self, chromosome_codes, positions, variant_types, lengths):
+		"""Returns a key per indel (chromosome, position, type and length) that is ordered like 
+		   the tuples themselves (-1 when the chromosome and position are not in the table). The 
+		   pairs of chromosome and position are numbered in sorted order, so that the key fits 
+		   in 64 bits."""
+		locations 	= np.asarray(chromosome_codes, dtype = np.int64) * (1 << 32) + np.asarray(positions, dtype = np.int64)
+		variant_types 	= np.asarray(variant_types)
+		if len(self.sorted_locations) == 0: 
+			return np.full(len(locations), -1, dtype = np.int64)
+		rank 		= np.minimum(np.searchsorted(self.sorted_locations, locations), len(self.sorted_locations) - 1)
+		keys 		= (rank * (1 << 32)) + np.asarray(lengths, dtype = np.int64) * 2 + (variant_types == b'+')
+		return np.where((self.sorted_locations[rank] == locations) & ((variant_types == b'-') | (variant_types == b'+')), keys, -1)
+
+	def returnIndices(self, chromosomes, positions, variant_types, lengths, seen = None):
+		"""Returns for every indel given by its chromosome, position, type and length the index 
+		   of that indel in the table, or -1 when there is none. The keys are looked up in the 
+		   keys of the table in sorted order, which are computed once. When the table contains 
+		   several indels with the same key (e.g., insertions of different sequences), they are 
+		   assigned in the order of the VCF file to the indels given with that key; the dictionary 
+		   seen keeps track of the ones assigned in earlier calls (when given). Otherwise, the 
+		   first indel with the key is returned."""
+		if self.sorted_keys is None: 
+			locations 		= np.sort(np.asarray(self.chromosome, dtype = np.int64) * (1 << 32) + self.position)
+			self.sorted_locations 	= locations[np.concatenate(([True], locations[1:] != locations[:-1]))] if len(self) > 0 else locations
+			keys 			= self.returnKeys(self.chromosome, self.position, self.variant_type, self.length)
+			self.sorted_order 	= np.argsort(keys, kind = 'stable') # indels with the same key stay in the order of the VCF file
+			self.sorted_keys 	= keys[self.sorted_order]
+			# number of indels with the same key at the first one of them in sorted order
+			starts 			= np.flatnonzero(np.concatenate(([True], self.sorted_keys[1:] != self.sorted_keys[:-1])))
+			self.n_same 		= np.zeros(len(self), dtype = np.intp)
+			self.n_same[starts] 	= np.diff(np.append(starts, len(self)))
+		codes 	= [self.chromosome_codes.get(str(chromosome), -1) for chromosome in chromosomes]
+		keys 	= self.returnKeys(codes, positions, variant_types, lengths)
+		if len(self) == 0: 
+			return np.full(len(keys), -1, dtype = np.intp)
+		found 	= np.minimum(np.searchsorted(self.sorted_keys, keys), len(self) - 1)
+		match 	= (self.sorted_keys[found] == keys) & (keys != -1)
+		if seen != None: 
+			for i in np.flatnonzero(match & (self.n_same[found] > 1)).tolist(): 
+				first 		= int(found[i])
+				occurrence 	= seen.get(first, 0)
+				seen[first] 	= occurrence + 1
+				if occurrence < self.n_same[first]: 
+					found[i] = first + occurrence
+				else: # more indels given with this key than there are in the table
+					match[i] = False
+		return np.where(match, self.sorted_order[found], -1)
+
+def returnSourceSignature(vcf_filename):
+	"""Returns the size and modification time of the VCF file (see returnIndelTable)."""
+	status = os.stat(vcf_filename)
+	return np.array([status.st_size, status.st_mtime], dtype = np.float64)
+
+def returnIndelTable(vcf_filename):
+	"""Returns the table of the indels in the VCF file (see IndelTable). The table stored next to 
+	   the VCF file (<vcf-file>.npz) is memory-mapped, unless it is missing or the VCF file changed 
+	   since; in that case, the table is built and stored for the next time (when possible)."""
+	table_filename = vcf_filename + '.npz'
+	if os.path.exists(table_filename):
+		try:
+			arrays = memoryMapArchive(table_filename)
+			if 'source' in arrays and np.array_equal(arrays['source'], returnSourceSignature(vcf_filename)):
+				return IndelTable(arrays)
+		except (ValueError, KeyError, IOError, zipfile.BadZipfile):
+			pass # the table is built again
+	table = IndelTable.fromVCF(vcf_filename)
+	temporary_filename = '%s.%d.tmp'%(table_filename, os.getpid())
+	try:
+		table.save(temporary_filename, source = vcf_filename)
+		os.rename(temporary_filename, table_filename) # other processes never see a partial table
+	except (IOError, OSError):
+		if os.path.exists(temporary_filename): 
+			os.remove(temporary_filename)
+	return table
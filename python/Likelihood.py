@@ -0,0 +1,373 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) 2015 Louis Dijkstra
+
+This file is part of somatic-indel-calling
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function, division
+import math
+import numpy as np
+
+from Observations import compressObservations
+
+try:
+	from scipy.special import erfc
+except ImportError: # scipy is optional
+	erfc = np.vectorize(math.erfc, otypes = [np.float64])
+
+__author__ = "Louis Dijkstra"
+
+"""
+	Likelihood.py contains a NumPy implementation of the likelihood model of
+	sm_caller (see src/smc_likelihood.c). It computes the same maximum
+	likelihood estimates of the healthy and cancer variant allele frequencies
+	(h_vaf and c_vaf) and the same posterior probabilities of the hypotheses
+	'somatic', 'germline' and 'not present'.
+
+	The observations of a variant are turned into arrays once. Every
+	observation contributes a factor that is linear in h_vaf and, in case of
+	the cancer sample, in c_vaf. The loglikelihood is therefore evaluated for
+	all observations and any number of (h_vaf, c_vaf) pairs at once. For a
+	fixed h_vaf, the likelihood is a polynomial in c_vaf, which is integrated
+	exactly. As in sm_caller, the likelihoods are combined in log space.
+
+	The observations are the ones returned by the BAM processors (see
+	BAMProcessor.py) or read from an observations file (see Observations.py),
+	so extraction and calling can be done in one process (see callVariants).
+	'compare-calls.py' compares the results with those of sm_caller.
+"""
+
+CONTINUE_MINIMIZATION 	= 0
+DONE_MINIMIZATION 	= 1
+IMPOSSIBLE_HEALTHY_VAF 	= 2
+
+GOLDEN 		= 0.3819660 		# (3 - sqrt(5)) / 2 as used by GSL's Brent minimizer
+SQRT_DBL_EPSILON = 1.4901161193847656e-08
+NEGLIGIBLE_COEFFICIENT 	= 1e-300 	# relative to the largest coefficient (see logIntegral)
+MLE_GRID_PANELS 	= 8 		# the loglikelihood is evaluated on MLE_GRID_PANELS + 1 points (see prepareMinimization)
+
+class ModelParameters:
+	"""Parameters of the model and the numerical settings. The defaults are those of sm_caller."""
+
+	def __init__(self, alpha = 0.0, eps_a = 0.0001, eps_p_del = 0.0961, eps_p_ins = 0.3457, mu_h = 112.0, sigma_h = 15.0, rate_h = 0.0, mu_c = 112.0, sigma_c = 15.0, rate_c = 0.0, max_iter = 100, epsabs = 0.0001, solver = 'brent'):
+		self.alpha 	= alpha 	# level of impurity
+		self.eps_a 	= eps_a 	# epsilon_a (same for deletions and insertions)
+		self.eps_p_del 	= eps_p_del 	# epsilon_p for deletions
+		self.eps_p_ins 	= eps_p_ins 	# epsilon_p for insertions
+		self.mu_h 	= mu_h 		# null mean insert sizes healthy sample
+		self.sigma_h 	= sigma_h 	# null STD insert sizes healthy sample
+		self.rate_h 	= rate_h 	# error rate for the insert size model healthy sample
+		self.mu_c 	= mu_c 		# null mean insert sizes cancer sample
+		self.sigma_c 	= sigma_c 	# null STD insert sizes cancer sample
+		self.rate_c 	= rate_c 	# error rate for the insert size model cancer sample
+		self.max_iter 	= max_iter 	# maximal number of iterations of the minimizer
+		self.epsabs 	= epsabs 	# absolute tolerance of the MLE of c_vaf
+		self.solver 	= solver 	# 'brent' or 'newton' (see maximizeNewton)
+
+def f (x, mu, std, delta, rate):
+	"""The PMF of the insert size distribution (x can be an array)."""
+	prob = 0.5 / (rate*(1.0 - 0.5*erfc((mu + 0.5)/std*np.sqrt(0.5))) + (1.0 - rate)*(1.0 - 0.5*erfc((mu + delta + 0.5)/std*np.sqrt(0.5)))) # normalization factor
+	return prob * (rate*(erfc((-x - 0.5 + mu)/std*np.sqrt(0.5)) - erfc((-x + 0.5 + mu)/std*np.sqrt(0.5))) + (1.0 - rate)*(erfc((-x - 0.5 + mu + delta)/std*np.sqrt(0.5)) - erfc((-x + 0.5 + mu + delta)/std*np.sqrt(0.5))))
+
+def f0 (x, mu, std):
+	"""The PMF of the insert size distribution when there is no indel (null distribution)."""
+	prob = 0.5 / (1.0 - 0.5*erfc((mu + 0.5)/std*np.sqrt(0.5))) # normalization factor
+	return prob * (erfc((-x - 0.5 + mu)/std*np.sqrt(0.5)) - erfc((-x + 0.5 + mu)/std*np.sqrt(0.5)))
+
+def logSumExp (values, axis = None):
+	"""Returns log(sum(exp(values))) without underflow. Returns -inf when all values are -inf."""
+	values 	= np.asarray(values, dtype = np.float64)
+	maximum = np.max(values, axis = axis, keepdims = True)
+	maximum = np.where(np.isfinite(maximum), maximum, 0.0)
+	with np.errstate(divide = 'ignore'):
+		return np.squeeze(maximum, axis = axis) + np.log(np.sum(np.exp(values - maximum), axis = axis))
+
+def minimizeBrent (function, x, a, b, epsabs, max_iter):
+	"""Minimizes the function on [a, b] starting at x (a < x < b and function(x) lower than
+	   at both ends) in the same way as GSL's Brent minimizer does in sm_caller. The iterations
+	   stop when the interval is smaller than epsabs or after max_iter iterations. Returns the
+	   minimum and the function value there."""
+	f_x 	= function(x)
+	v = w 	= a + GOLDEN * (b - a)
+	f_v = f_w = function(v)
+	d = e 	= 0.0
+	for i in range(max_iter):
+		tolerance 	= SQRT_DBL_EPSILON * abs(x)
+		midpoint 	= 0.5 * (a + b)
+		d, e 		= e, d
+		p = q = r 	= 0.0
+		if abs(e) > tolerance: # fit parabola
+			r = (x - w) * (f_x - f_v)
+			q = (x - v) * (f_x - f_w)
+			p = (x - v) * q - (x - w) * r
+			q = 2 * (q - r)
+			if q > 0:
+				p = -p
+			else:
+				q = -q
+			r, e = e, d
+		if abs(p) < abs(0.5 * q * r) and p < q * (x - a) and p < q * (b - x):
+			d = p / q
+			u = x + d
+			if u - a < 2 * tolerance or b - u < 2 * tolerance:
+				d = tolerance if x < midpoint else -tolerance
+		else: # golden section step
+			e = b - x if x < midpoint else -(x - a)
+			d = GOLDEN * e
+		if abs(d) >= tolerance:
+			u = x + d
+		else:
+			u = x + (tolerance if d > 0 else -tolerance)
+		f_u = function(u)
+		if f_u <= f_x:
+			if u < x:
+				b = x
+			else:
+				a = x
+			v, f_v, w, f_w = w, f_w, x, f_x
+			x, f_x = u, f_u
+		else:
+			if u < x:
+				a = u
+			else:
+				b = u
+			if f_u <= f_w or w == x:
+				v, f_v, w, f_w = w, f_w, u, f_u
+			elif f_u <= f_v or v == x or v == w:
+				v, f_v = u, f_u
+		if abs(b - a) < epsabs:
+			break
+	return x, f_x
+
+class VariantLikelihood:
+	"""The likelihood of h_vaf and c_vaf given the observations of a variant. The observations
+	   of both samples are tuples (isize, isize_prob, splits, splits_prob) as returned by the
+	   BAM processors. Unlikely insert sizes (see sm_caller) are left out. Identical observations 
+	   are stored once together with their count (see compressObservations in Observations.py)."""
+
+	def __init__(self, variant_type, length, healthy_observations, cancer_observations, parameters):
+		self.parameters = parameters
+		if variant_type == '+':
+			self.delta, eps_p = -1.0 * length, parameters.eps_p_ins
+		else:
+			self.delta, eps_p = 1.0 * length, parameters.eps_p_del
+		self.eps_p, self.eps_a = eps_p, parameters.eps_a
+
+		# Every observation contributes prob * (value under the alternative (1) / null (0) model) + (1 - prob).
+		# For the healthy sample these are the values for h_vaf = 1/0 (h1/h0), for the cancer sample
+		# also for c_vaf = 1/0 (c1/c0).
+		# Identical observations contribute the same factor and are therefore stored once (with their count).
+		h_isize, h_isize_prob, h_isize_count = [np.asarray(obs, dtype = np.float64) for obs in compressObservations(*healthy_observations[:2])]
+		h_split, h_split_prob, h_split_count = [np.asarray(obs, dtype = np.float64) for obs in compressObservations(*healthy_observations[2:])]
+		c_isize, c_isize_prob, c_isize_count = [np.asarray(obs, dtype = np.float64) for obs in compressObservations(*cancer_observations[:2])]
+		c_split, c_split_prob, c_split_count = [np.asarray(obs, dtype = np.float64) for obs in compressObservations(*cancer_observations[2:])]
+
+		p = parameters
+		h_isize_h1, h_isize_h0 = f(h_isize, p.mu_h, p.sigma_h, self.delta, p.rate_h), f0(h_isize, p.mu_h, p.sigma_h)
+		c_isize_c1, c_isize_c0 = f(c_isize, p.mu_c, p.sigma_c, self.delta, p.rate_c), f0(c_isize, p.mu_c, p.sigma_c)
+
+		# remove unlikely insert sizes, i.e., insert sizes that have probability 0 under both models
+		likely = (h_isize_h1 != 0.0) | (h_isize_h0 != 0.0)
+		h_isize, h_isize_prob, h_isize_count, h_isize_h1, h_isize_h0 = h_isize[likely], h_isize_prob[likely], h_isize_count[likely], h_isize_h1[likely], h_isize_h0[likely]
+		likely = (c_isize_c1 != 0.0) | (c_isize_c0 != 0.0)
+		c_isize, c_isize_prob, c_isize_count, c_isize_c1, c_isize_c0 = c_isize[likely], c_isize_prob[likely], c_isize_count[likely], c_isize_c1[likely], c_isize_c0[likely]
+
+		# the healthy cells in the cancer sample follow the model of the healthy sample
+		c_isize_h1, c_isize_h0 = f(c_isize, p.mu_h, p.sigma_h, self.delta, p.rate_h), f0(c_isize, p.mu_h, p.sigma_h)
+
+		self.h_prob 	= np.concatenate((h_isize_prob, h_split_prob))
+		self.h_count 	= np.concatenate((h_isize_count, h_split_count))
+		self.h_h1 	= np.concatenate((h_isize_h1, h_split * (1.0 - eps_p) + (1.0 - h_split) * eps_p))
+		self.h_h0 	= np.concatenate((h_isize_h0, h_split * self.eps_a + (1.0 - h_split) * (1.0 - self.eps_a)))
+		self.c_prob 	= np.concatenate((c_isize_prob, c_split_prob))
+		self.c_count 	= np.concatenate((c_isize_count, c_split_count))
+		self.c_h1 	= np.concatenate((c_isize_h1, c_split * (1.0 - eps_p) + (1.0 - c_split) * eps_p))
+		self.c_h0 	= np.concatenate((c_isize_h0, c_split * self.eps_a + (1.0 - c_split) * (1.0 - self.eps_a)))
+		self.c_c1 	= np.concatenate((c_isize_c1, self.c_h1[len(c_isize):]))
+		self.c_c0 	= np.concatenate((c_isize_c0, self.c_h0[len(c_isize):]))
+		self.n_isize 	= (len(h_isize), len(c_isize))
+
+	def loglikelihood(self, h_vaf, c_vaf):
+		"""Returns the loglikelihood of h_vaf and c_vaf. Both can be arrays (of any broadcastable
+		   shape); the loglikelihood is then returned for every pair."""
+		h_vaf, c_vaf 	= np.broadcast_arrays(np.asarray(h_vaf, dtype = np.float64), np.asarray(c_vaf, dtype = np.float64))
+		h, c 		= h_vaf[..., np.newaxis], c_vaf[..., np.newaxis] # last axis walks over the observations
+		alpha 		= self.parameters.alpha
+		with np.errstate(divide = 'ignore'):
+			logl  = np.sum(self.h_count * np.log(self.h_prob * (h*self.h_h1 + (1.0 - h)*self.h_h0) + (1.0 - self.h_prob)), axis = -1)
+			logl += np.sum(self.c_count * np.log(self.c_prob * (alpha * (h*self.c_h1 + (1.0 - h)*self.c_h0) + (1.0 - alpha) * (c*self.c_c1 + (1.0 - c)*self.c_c0)) + (1.0 - self.c_prob)), axis = -1)
+		return logl
+
+	def uniqueGlobalMaximumExists(self):
+		"""Returns True when a unique global maximum exists."""
+		alpha = self.parameters.alpha
+		if alpha == 1.0: # no cancer cells present in the sample
+			return False
+		h_n_isize, c_n_isize = self.n_isize
+		split_informative = self.eps_a != (1.0 - self.eps_p)
+		c_vaf_max_exists = (split_informative and np.any(self.c_prob[c_n_isize:] != 0.0)) or np.any((self.c_prob[:c_n_isize] != 0.0) & (self.c_c0[:c_n_isize] != self.c_c1[:c_n_isize]))
+		if alpha != 0.0 or not c_vaf_max_exists:
+			return bool(c_vaf_max_exists)
+		return bool((split_informative and np.any(self.h_prob[h_n_isize:] != 0.0)) or np.any((self.h_prob[:h_n_isize] != 0.0) & (self.h_h0[:h_n_isize] != self.h_h1[:h_n_isize])))
+
+	def returnCoefficients(self, h_vaf):
+		"""Returns the constant, the coefficients A and B and the counts such that the loglikelihood of c_vaf 
+		   (for the given h_vaf) equals constant + sum(count*log(A + B*c_vaf)) (see computeCoefficients in sm_caller)."""
+		alpha 	= self.parameters.alpha
+		A 	= self.c_prob * (alpha * (h_vaf*self.c_h1 + (1.0 - h_vaf)*self.c_h0) + (1.0 - alpha) * self.c_c0) + (1.0 - self.c_prob)
+		B 	= self.c_prob * (1.0 - alpha) * (self.c_c1 - self.c_c0)
+		constant = B == 0.0 # factors that do not depend on c_vaf
+		with np.errstate(divide = 'ignore'):
+			log_constant = np.sum(self.h_count * np.log(self.h_prob * (h_vaf*self.h_h1 + (1.0 - h_vaf)*self.h_h0) + (1.0 - self.h_prob))) + np.sum(self.c_count[constant] * np.log(A[constant]))
+		return log_constant, A[~constant], B[~constant], self.c_count[~constant]
+
+	def logIntegral(self, h_vaf):
+		"""Returns the log of the integral of the likelihood over c_vaf. The integral is exact: the product
+		   of the factors A + B*c_vaf is built up in the Bernstein basis, in which the integral over the unit
+		   interval is the mean of the coefficients (see log_integrate_likelihood in sm_caller)."""
+		log_constant, A, B, count = self.returnCoefficients(h_vaf)
+		A, B = np.repeat(A, count.astype(np.int64)), np.repeat(B, count.astype(np.int64)) # a factor that occurs count times is multiplied count times
+		if log_constant == -np.inf or len(A) == 0:
+			return log_constant
+		beta 		= np.zeros(len(A) + 1)
+		beta[0] 	= 1.0
+		lo, hi, log_scale = 0, 0, log_constant # beta[lo:hi+1] are the coefficients that are not negligible
+		for m in range(len(A)): # multiply with the factor a*(1 - c) + b*c
+			a, b 	= A[m] / (m + 1), (A[m] + B[m]) / (m + 1)
+			k 	= np.arange(lo, hi + 2)
+			beta[hi + 1] = 0.0
+			previous = np.concatenate(([0.0], beta[lo:hi + 1]))
+			beta[lo:hi + 2] = k * b * previous + (m + 1 - k) * a * beta[lo:hi + 2]
+			hi 	+= 1
+			maximum = beta[lo:hi + 1].max()
+			if maximum == 0.0: # underflow; the likelihood is 0
+				return -np.inf
+			beta[lo:hi + 1] /= maximum
+			log_scale += np.log(maximum)
+			relevant = np.nonzero(beta[lo:hi + 1] >= NEGLIGIBLE_COEFFICIENT)[0]
+			lo, hi 	= lo + relevant[0], lo + relevant[-1]
+		return log_scale + np.log(np.sum(beta[lo:hi + 1]) / (len(A) + 1))
+
+	def determinePosteriorProbabilities(self):
+		"""Returns the posterior probabilities of the hypotheses 'somatic', 'germline' and 'not present'."""
+		log_integrals 	= [self.logIntegral(h_vaf) for h_vaf in (0.0, 0.5, 1.0)]
+		log_ps 		= log_integrals[0] - np.log(9.0)
+		log_pg 		= np.logaddexp(log_integrals[1], log_integrals[2]) - np.log(9.0)
+		log_pnp 	= self.loglikelihood(0.0, 0.0) - np.log(3.0)
+		log_normalization = logSumExp([log_ps, log_pg, log_pnp])
+		return tuple(float(np.exp(log_p - log_normalization)) for log_p in (log_ps, log_pg, log_pnp))
+
+	def prepareMinimization(self, h_vaf):
+		"""Determines whether the h_vaf value is likely at all. In addition, it locates the
+		   unimodal part of the loglikelihood function: the loglikelihood is concave in c_vaf,
+		   so that its maximum lies between the neighbours of the best point of an equally 
+		   spaced grid. Returns the status (see above), an initial guess x and the interval [a, b]."""
+		p 		= self.parameters
+		logl_grid 	= self.loglikelihood(h_vaf, np.linspace(0.0, 1.0, MLE_GRID_PANELS + 1))
+		best 		= int(np.argmax(logl_grid))
+		if logl_grid[best] == -np.inf:
+			return IMPOSSIBLE_HEALTHY_VAF, 0.5, None, None
+		a = p.epsabs / 2 if best <= 1 and logl_grid[0] == -np.inf else max(best - 1, 0) / MLE_GRID_PANELS
+		b = 1.0 - p.epsabs / 2 if best >= MLE_GRID_PANELS - 1 and logl_grid[-1] == -np.inf else min(best + 1, MLE_GRID_PANELS) / MLE_GRID_PANELS
+		x = (a + b) / 2 if best == 0 or best == MLE_GRID_PANELS else best / MLE_GRID_PANELS
+
+		# find appropriate initial guess x
+		logl_a, logl_x, logl_b = self.loglikelihood(h_vaf, [a, x, b])
+		iteration = 0
+		while logl_x <= logl_a or logl_x <= logl_b:
+			if iteration == p.max_iter or x - a < p.epsabs or b - x < p.epsabs: # the maximum lies at (or within epsabs of) a or b
+				return DONE_MINIMIZATION, a if logl_a > logl_b else b, a, b
+			iteration += 1
+			if logl_x <= logl_a:
+				x = (x + a) / 2
+			else:
+				x = (x + b) / 2
+			logl_x = self.loglikelihood(h_vaf, x)
+		return CONTINUE_MINIMIZATION, x, a, b
+
+	def maximizeNewton(self, h_vaf, x, a, b):
+		"""Maximizes the loglikelihood on [a, b] with a safeguarded Newton method starting at x (see 
+		   maximizeNewton in sm_caller). Returns the maximum, or None when there was no convergence."""
+		p 	= self.parameters
+		log_constant, A, B, count = self.returnCoefficients(h_vaf)
+		for iteration in range(p.max_iter):
+			ratio 	= B / (A + B * x)
+			d1, d2 	= np.sum(count * ratio), -np.sum(count * ratio * ratio)
+			if d1 > 0.0: # the maximum lies to the right of x
+				a = x
+			elif d1 < 0.0:
+				b = x
+			else:
+				return x
+			following = x - d1 / d2 if d2 < 0.0 else np.nan
+			if not (a < following < b): # safeguard
+				following = (a + b) / 2
+			if abs(following - x) < p.epsabs or b - a < p.epsabs:
+				return following
+			x = following
+		return None
+
+	def computeMLE(self):
+		"""Returns the maximum likelihood estimates of h_vaf and c_vaf and the maximal loglikelihood."""
+		p 		= self.parameters
+		estimates 	= [] # (max. loglikelihood, MLE of c_vaf) per h_vaf
+		for h_vaf in (0.0, 0.5, 1.0):
+			status, x, a, b = self.prepareMinimization(h_vaf)
+			if status == IMPOSSIBLE_HEALTHY_VAF:
+				estimates.append((-np.inf, x))
+			elif status == DONE_MINIMIZATION:
+				estimates.append((float(self.loglikelihood(h_vaf, x)), x))
+			else:
+				x_newton = self.maximizeNewton(h_vaf, x, a, b) if p.solver == 'newton' else None
+				if x_newton != None:
+					estimates.append((float(self.loglikelihood(h_vaf, x_newton)), x_newton))
+				else: # also when Newton's method did not converge
+					x, f_x = minimizeBrent(lambda c_vaf: -1.0 * float(self.loglikelihood(h_vaf, c_vaf)), x, a, b, p.epsabs, p.max_iter)
+					estimates.append((-1.0 * f_x, x))
+
+		(max_logl0, mle_c_vaf0), (max_logl1, mle_c_vaf1), (max_logl2, mle_c_vaf2) = estimates
+		if max_logl0 >= max_logl1 and max_logl0 >= max_logl2:
+			return 0.0, mle_c_vaf0, max_logl0
+		if max_logl1 > max_logl0 and max_logl1 > max_logl2:
+			return 0.5, mle_c_vaf1, max_logl1
+		return 1.0, mle_c_vaf2, max_logl2
+
+def callVariant (variant_type, length, healthy_observations, cancer_observations, parameters):
+	"""Returns the MLEs of h_vaf and c_vaf, the maximal loglikelihood and the posterior probabilities
+	   of 'somatic', 'germline' and 'not present' for the variant. Returns None when the variant
+	   is not an indel or when there is no unique global maximum (see sm_caller)."""
+	if variant_type != '+' and variant_type != '-':
+		return None
+	variant_likelihood = VariantLikelihood(variant_type, length, healthy_observations, cancer_observations, parameters)
+	if not variant_likelihood.uniqueGlobalMaximumExists():
+		return None
+	return variant_likelihood.computeMLE() + variant_likelihood.determinePosteriorProbabilities()
+
+def callVariants (variants, parameters):
+	"""Generator over the calls for a list/iterator of variants as returned by returnVariantObservations
+	   in 'extract-observations.py' or by the readers in Observations.py. Returns for every variant its
+	   type, chromosome, position and length together with the call (see callVariant)."""
+	for (variant_type, chromosome, position, length, healthy_observations, cancer_observations) in variants:
+		yield variant_type, chromosome, position, length, callVariant(variant_type, length, healthy_observations, cancer_observations, parameters)
+
+def formatCall (variant_type, chromosome, position, length, call):
+	"""Returns the line sm_caller outputs for the variant."""
+	line = '%s\t%s\t%d\t%d'%(variant_type, chromosome, position, length)
+	if call == None:
+		return line + '\t.\t.\t.\t.\t.\t.\n'
+	return line + '\t%f\t%f\t%f\t%f\t%f\t%f\n'%call
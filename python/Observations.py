@@ -0,0 +1,452 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) 2015 Louis Dijkstra
+
+This file is part of somatic-indel-calling
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function, division
+from itertools import islice
+import gzip
+import io
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+import numpy as np
+
+__author__ = "Louis Dijkstra"
+
+"""
+	Observations.py contains the functions/classes for reading and writing
+	observation files (see bin/extract-observations.py), both in the text
+	format (.raw-observations), possibly BGZF-compressed, and in the binary
+	format.
+
+	A BGZF-compressed observations file is a series of gzip blocks (as 
+	written by bgzip), so that it can be decompressed with gunzip/zcat. It
+	comes with an index (<file>.idx) that lists for every block the first
+	variant that starts in it, as well as the first variant of every 
+	chromosome: 
+
+		<chr>	<pos>	<virtual offset>
+
+	where the virtual offset is the offset of the block in the compressed
+	file times 2^16 plus the offset of the variant within the uncompressed
+	block. The index allows to jump straight to a region (see 
+	readRegionLines and sm_caller's option -R). The variants need to be 
+	sorted by position within every chromosome.
+
+	The binary format is columnar. All numbers are little-endian and every
+	section starts at a multiple of 8 bytes. The file consists of:
+
+		1) a header (HEADER_DTYPE) with the number of variants, chromosomes
+		   and observations and the offsets of the sections below;
+		2) the chromosome names (CHROMOSOME_WIDTH bytes each, NUL-padded);
+		3) the variant table (VARIANT_DTYPE), one row per variant. For
+		   both samples (0 - healthy, 1 - cancer), a row contains the first
+		   index and the number of its insert size and split read
+		   observations in the arrays below;
+		4) the concatenated insert sizes (uint64),
+		5) their alignment probabilities (float64),
+		6) the concatenated split read observations (uint64) and
+		7) their alignment probabilities (float64).
+
+	The layout matches the structs in src/smc_binary.h, so that sm_caller
+	can memory-map the file and use the arrays without parsing/copying.
+
+	Identical observations (the same value and alignment probability) can 
+	be stored once together with their count (see compressObservations). 
+	In the text format, such an observation is written as <value>:<count>
+	(the alignment probability is written once); observations without a
+	count are counted once. A compressed binary file starts with MAGIC2 and
+	has two more sections with the counts (uint64) of the insert sizes and
+	split read observations (see COMPRESSED_HEADER_DTYPE). The readers 
+	below return the observations expanded, i.e., every observation once 
+	per count.
+"""
+
+MAGIC 			= b'SMC-OBS1' 	# first 8 bytes of a binary observations file
+MAGIC2 			= b'SMC-OBS2' 	# idem, with counts of identical observations
+CHROMOSOME_WIDTH 	= 64 		# number of bytes reserved for a chromosome name
+
+HEADER_DTYPE = np.dtype([	('magic', 'S8'),
+				('n_variants', '<u8'),
+				('n_chromosomes', '<u8'),
+				('n_isize', '<u8'), 		# total number of insert size observations
+				('n_split', '<u8'), 		# total number of split read observations
+				('chromosomes_offset', '<u8'), 	# offsets (in bytes) of the sections
+				('variants_offset', '<u8'),
+				('isize_offset', '<u8'),
+				('isize_prob_offset', '<u8'),
+				('split_offset', '<u8'),
+				('split_prob_offset', '<u8')])
+
+COMPRESSED_HEADER_DTYPE = np.dtype(HEADER_DTYPE.descr + [('isize_count_offset', '<u8'), ('split_count_offset', '<u8')])
+
+BGZF_BLOCK_SIZE 	= 0xff00 	# maximal number of uncompressed bytes per BGZF block (as in htslib)
+BGZF_EOF 		= b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00' # empty block at the end of the file
+
+VARIANT_DTYPE = np.dtype([	('position', '<u8'),
+				('length', '<u8'),
+				('chromosome', '<u4'), 		# index in the chromosome names
+				('type', 'S1'), 		# '+' for an insertion, '-' for a deletion
+				('padding', 'S3'),
+				('isize_start', '<u8', (2,)), 	# per sample (0 - healthy, 1 - cancer)
+				('isize_n', '<u8', (2,)),
+				('split_start', '<u8', (2,)),
+				('split_n', '<u8', (2,))])
+
+def isBinaryObservationsFile (filename):
+	"""Returns True when the file is a binary observations file."""
+	with open(filename, 'rb') as obs_file:
+		return obs_file.read(len(MAGIC)) in (MAGIC, MAGIC2)
+
+def isCompressedObservationsFile (filename):
+	"""Returns True when the file is gzip/BGZF-compressed."""
+	with open(filename, 'rb') as obs_file:
+		return obs_file.read(2) == b'\x1f\x8b'
+
+def openRawObservations (filename, virtual_offset = 0):
+	"""Opens a (possibly BGZF-compressed) .raw-observations file for reading. In case of 
+	   a BGZF-compressed file, reading starts at the given virtual offset."""
+	if not isCompressedObservationsFile(filename):
+		return open(filename, 'r')
+	raw_file = open(filename, 'rb')
+	raw_file.seek(virtual_offset >> 16) # start of the block
+	obs_file = io.TextIOWrapper(gzip.GzipFile(fileobj = raw_file))
+	obs_file.read(virtual_offset & 0xffff) # skip to the variant within the block
+	return obs_file
+
+def readIndex (index_filename):
+	"""Returns the entries (chromosome, position, virtual offset) of the index of a BGZF-compressed 
+	   observations file. Returns None when an entry is malformed (e.g., truncated); the file then
+	   has to be read from the start (as sm_caller does)."""
+	index = []
+	with open(index_filename, 'r') as index_file:
+		for line in index_file:
+			values = line.rstrip('\n').split('\t')
+			if values == ['']: # empty line at the end of the file
+				continue
+			if len(values) != 3 or not values[1].isdigit() or not values[2].isdigit():
+				return None
+			index.append((values[0], int(values[1]), int(values[2])))
+	return index
+
+def parseRegion (region):
+	"""Converts a region 'chr' or 'chr:start-end' into (chromosome, start, end). The start
+	   and end are None when not given. Chromosome names that contain a colon are allowed."""
+	if ':' in region:
+		chromosome, interval = region.rsplit(':', 1)
+		values = interval.replace(',', '').split('-')
+		if len(values) == 2 and values[0].isdigit() and values[1].isdigit():
+			return chromosome, int(values[0]), int(values[1])
+	return region, None, None
+
+def readVariantLines (obs_file):
+	"""Generator over the variants in a .raw-observations file; returns the 9 lines of every variant."""
+	while True:
+		variant_data = list(islice(obs_file, 9)) # get 9 lines associated with one variant
+		if not variant_data:
+			break
+		yield variant_data
+
+def readRegionLines (filename, chromosome, start = None, end = None):
+	"""Generator over the variants in a .raw-observations file that lie on the given chromosome 
+	   between start and end (both inclusive; None means unbounded). Returns the 9 lines of every 
+	   variant. When the file is BGZF-compressed and indexed, reading starts at the first block 
+	   that is relevant and stops after the region; otherwise (or when the index is malformed, 
+	   see readIndex) the entire file is read."""
+	virtual_offset, index = 0, None
+	if isCompressedObservationsFile(filename) and os.path.exists(filename + '.idx'):
+		index = readIndex(filename + '.idx')
+	indexed = index != None
+	if indexed: 
+		entries = [entry for entry in index if entry[0] == chromosome]
+		if len(entries) == 0: 
+			return
+		virtual_offset = entries[0][2]
+		for entry in entries: 
+			if start != None and entry[1] < start: # a variant at position start might lie in the previous block
+				virtual_offset = entry[2]
+	obs_file = openRawObservations(filename, virtual_offset)
+	region_reached = False
+	for variant_data in readVariantLines(obs_file):
+		values = variant_data[0].split()
+		if values[1] != chromosome:
+			if region_reached and indexed: 
+				break
+			continue
+		region_reached = True
+		position = int(values[2])
+		if start != None and position < start: 
+			continue
+		if end != None and position > end:
+			if indexed: 
+				break
+			continue
+		yield variant_data
+	obs_file.close()
+
+def compressObservations (values, probabilities):
+	"""Returns the distinct observations (value and probability), ordered by value and 
+	   probability, together with the number of times they occur."""
+	values, probabilities = np.asarray(values, dtype = np.uint64), np.asarray(probabilities, dtype = np.float64)
+	if len(values) == 0:
+		return values, probabilities, np.zeros(0, dtype = np.uint64)
+	order 		= np.lexsort((probabilities, values))
+	values, probabilities = values[order], probabilities[order]
+	first 		= np.ones(len(values), dtype = bool) # first occurrence of every distinct observation
+	first[1:] 	= (values[1:] != values[:-1]) | (probabilities[1:] != probabilities[:-1])
+	starts 		= np.flatnonzero(first)
+	counts 		= np.diff(np.append(starts, len(values))).astype(np.uint64)
+	return values[starts], probabilities[starts], counts
+
+def formatValues (values, counts = None):
+	"""Returns the values separated by tabs; values that occur more than once are written as <value>:<count>."""
+	if counts is None:
+		return '\t'.join(map(str,values))
+	return '\t'.join([str(value) if count == 1 else '%s:%d'%(value, count) for (value, count) in zip(values, counts)])
+
+def formatObservations (isize, isize_prob, splits, splits_prob, compressed = False):
+	"""Returns the four lines representing the observations of one sample. When compressed, 
+	   identical observations are written once together with their count."""
+	isize_count, splits_count = None, None
+	if compressed:
+		isize, isize_prob, isize_count 		= compressObservations(isize, isize_prob)
+		splits, splits_prob, splits_count 	= compressObservations(splits, splits_prob)
+	lines  = formatValues(isize, isize_count) + '\n'
+	lines += '\t'.join(map(str,isize_prob)) + '\n'
+	lines += formatValues(splits, splits_count) + '\n'
+	lines += '\t'.join(map(str,splits_prob)) + '\n'
+	return lines
+
+def formatRawObservations (variant_type, chromosome, position, length, healthy_observations, cancer_observations, compressed = False):
+	"""Returns the 9 lines representing the variant and the observations of both samples."""
+	lines  = '%s \t %s \t %s \t %s\n'%(variant_type, chromosome, position, length)
+	lines += formatObservations(*healthy_observations, compressed = compressed)
+	lines += formatObservations(*cancer_observations, compressed = compressed)
+	return lines
+
+def parseValues (line, probabilities):
+	"""Returns the values and probabilities on the given lines, where values written as 
+	   <value>:<count> are repeated count times."""
+	if not ':' in line:
+		return np.array(line.split(), dtype = np.uint64), np.array(probabilities.split(), dtype = np.float64)
+	tokens 	= [token.split(':') for token in line.split()]
+	counts 	= [int(token[1]) if len(token) == 2 else 1 for token in tokens]
+	return (np.repeat(np.array([token[0] for token in tokens], dtype = np.uint64), counts), 
+		np.repeat(np.array(probabilities.split(), dtype = np.float64), counts))
+
+def parseObservations (lines):
+	"""Returns the insert sizes, split read observations and associated probabilities
+	   represented by the four lines of one sample."""
+	return parseValues(lines[0], lines[1]) + parseValues(lines[2], lines[3])
+
+def readRawObservations (obs_file):
+	"""Generator over the variants in a .raw-observations file. Returns for every variant
+	   its type, chromosome, position, length and the observations of both samples."""
+	for variant_data in readVariantLines(obs_file):
+		values = variant_data[0].split()
+		yield values[0], values[1], int(values[2]), int(values[3]), parseObservations(variant_data[1:5]), parseObservations(variant_data[5:9])
+
+class ObservationsWriter:
+	"""Writes observations in the binary format to a (binary) file object. Since the
+	   sections are written one after another, the observations are kept in temporary
+	   files until the writer is closed. When compressed, identical observations are 
+	   stored once together with their count."""
+
+	def __init__(self, output_file, compressed = False):
+		self.output_file 	= output_file
+		self.compressed 	= compressed
+		self.chromosomes 	= [] 	# chromosome names in order of appearance
+		self.chromosome_index 	= dict()
+		self.variants 		= [] 	# rows of the variant table
+		self.columns 		= [tempfile.TemporaryFile() for i in range(6 if compressed else 4)] # isize, isize_prob, split, split_prob(, isize_count, split_count)
+		self.n_isize 		= 0
+		self.n_split 		= 0
+
+	def write(self, variant_type, chromosome, position, length, healthy_observations, cancer_observations):
+		"""Adds one variant together with the observations of both samples."""
+		if not chromosome in self.chromosome_index:
+			if len(chromosome) >= CHROMOSOME_WIDTH:
+				raise ValueError('chromosome name %s is too long for the binary format'%chromosome)
+			self.chromosome_index[chromosome] = len(self.chromosomes)
+			self.chromosomes.append(chromosome)
+		isize_start, isize_n, split_start, split_n = [], [], [], []
+		for (isize, isize_prob, splits, splits_prob) in (healthy_observations, cancer_observations):
+			if self.compressed:
+				isize, isize_prob, isize_count 		= compressObservations(isize, isize_prob)
+				splits, splits_prob, splits_count 	= compressObservations(splits, splits_prob)
+				self.columns[4].write(np.asarray(isize_count, dtype = '<u8').tobytes())
+				self.columns[5].write(np.asarray(splits_count, dtype = '<u8').tobytes())
+			isize_start.append(self.n_isize)
+			isize_n.append(len(isize))
+			split_start.append(self.n_split)
+			split_n.append(len(splits))
+			self.columns[0].write(np.asarray(isize, dtype = '<u8').tobytes())
+			self.columns[1].write(np.asarray(isize_prob, dtype = '<f8').tobytes())
+			self.columns[2].write(np.asarray(splits, dtype = '<u8').tobytes())
+			self.columns[3].write(np.asarray(splits_prob, dtype = '<f8').tobytes())
+			self.n_isize += len(isize)
+			self.n_split += len(splits)
+		self.variants.append((position, length, self.chromosome_index[chromosome], variant_type, '', isize_start, isize_n, split_start, split_n))
+
+	def close(self):
+		"""Writes the file and removes the temporary files."""
+		header_dtype = COMPRESSED_HEADER_DTYPE if self.compressed else HEADER_DTYPE
+		header 	= np.zeros(1, dtype = header_dtype)
+		header['magic'] 		= MAGIC2 if self.compressed else MAGIC
+		header['n_variants'] 		= len(self.variants)
+		header['n_chromosomes'] 	= len(self.chromosomes)
+		header['n_isize'] 		= self.n_isize
+		header['n_split'] 		= self.n_split
+		header['chromosomes_offset'] 	= header_dtype.itemsize
+		header['variants_offset'] 	= header['chromosomes_offset'] + CHROMOSOME_WIDTH * len(self.chromosomes)
+		header['isize_offset'] 		= header['variants_offset'] + VARIANT_DTYPE.itemsize * len(self.variants)
+		header['isize_prob_offset'] 	= header['isize_offset'] + 8 * self.n_isize
+		header['split_offset'] 		= header['isize_prob_offset'] + 8 * self.n_isize
+		header['split_prob_offset'] 	= header['split_offset'] + 8 * self.n_split
+		if self.compressed:
+			header['isize_count_offset'] 	= header['split_prob_offset'] + 8 * self.n_split
+			header['split_count_offset'] 	= header['isize_count_offset'] + 8 * self.n_isize
+
+		self.output_file.write(header.tobytes())
+		self.output_file.write(np.array(self.chromosomes, dtype = 'S%d'%CHROMOSOME_WIDTH).tobytes())
+		self.output_file.write(np.array(self.variants, dtype = VARIANT_DTYPE).tobytes())
+		for column in self.columns:
+			column.seek(0)
+			shutil.copyfileobj(column, self.output_file)
+			column.close()
+		self.output_file.flush()
+
+class ObservationsReader:
+	"""Reads a binary observations file. The file is memory-mapped; the observations
+	   returned are views on the file (no copies are made), except for compressed files, 
+	   of which the observations are expanded."""
+
+	def __init__(self, filename):
+		self.data 	= np.memmap(filename, dtype = np.uint8, mode = 'r')
+		self.compressed = self.data[:len(MAGIC2)].tobytes() == MAGIC2
+		header_dtype 	= COMPRESSED_HEADER_DTYPE if self.compressed else HEADER_DTYPE
+		self.header 	= self.data[:header_dtype.itemsize].view(header_dtype)[0]
+		if self.header['magic'] not in (MAGIC, MAGIC2):
+			raise ValueError('%s is not a binary observations file'%filename)
+		self.chromosomes 	= [name.decode() for name in self.section('chromosomes_offset', 'S%d'%CHROMOSOME_WIDTH, self.header['n_chromosomes'])]
+		self.variants 		= self.section('variants_offset', VARIANT_DTYPE, self.header['n_variants'])
+		self.isize 		= self.section('isize_offset', '<u8', self.header['n_isize'])
+		self.isize_prob 	= self.section('isize_prob_offset', '<f8', self.header['n_isize'])
+		self.split 		= self.section('split_offset', '<u8', self.header['n_split'])
+		self.split_prob 	= self.section('split_prob_offset', '<f8', self.header['n_split'])
+		if self.compressed:
+			self.isize_count 	= self.section('isize_count_offset', '<u8', self.header['n_isize'])
+			self.split_count 	= self.section('split_count_offset', '<u8', self.header['n_split'])
+
+	def section(self, offset_field, dtype, n):
+		"""Returns the n elements of the given type that start at the offset stored in the header."""
+		start = int(self.header[offset_field])
+		return self.data[start : start + np.dtype(dtype).itemsize * int(n)].view(dtype)
+
+	def __len__(self):
+		return len(self.variants)
+
+	def returnObservations(self, i, sample):
+		"""Returns the observations of the i-th variant for the given sample (0 - healthy, 1 - cancer)."""
+		variant 	= self.variants[i]
+		isize_start, isize_end = variant['isize_start'][sample], variant['isize_start'][sample] + variant['isize_n'][sample]
+		split_start, split_end = variant['split_start'][sample], variant['split_start'][sample] + variant['split_n'][sample]
+		if self.compressed:
+			isize_count, split_count = self.isize_count[isize_start:isize_end].astype(np.intp), self.split_count[split_start:split_end].astype(np.intp)
+			return (np.repeat(self.isize[isize_start:isize_end], isize_count), np.repeat(self.isize_prob[isize_start:isize_end], isize_count),
+				np.repeat(self.split[split_start:split_end], split_count), np.repeat(self.split_prob[split_start:split_end], split_count))
+		return self.isize[isize_start:isize_end], self.isize_prob[isize_start:isize_end], self.split[split_start:split_end], self.split_prob[split_start:split_end]
+
+	def returnVariant(self, i):
+		"""Returns the type, chromosome, position, length and the observations of both samples of the i-th variant."""
+		variant = self.variants[i]
+		return variant['type'].decode(), self.chromosomes[variant['chromosome']], int(variant['position']), int(variant['length']), self.returnObservations(i, 0), self.returnObservations(i, 1)
+
+	def __iter__(self):
+		for i in range(len(self)):
+			yield self.returnVariant(i)
+
+class BGZFWriter:
+	"""Writes BGZF-compressed data, i.e., a series of gzip blocks of at most BGZF_BLOCK_SIZE
+	   uncompressed bytes that each carry their compressed size in the 'BC' extra field."""
+
+	def __init__(self, filename, level = 6):
+		self.output_file 	= open(filename, 'wb')
+		self.level 		= level
+		self.buffer 		= b'' 	# uncompressed data of the current block
+		self.block_offset 	= 0 	# offset of the current block in the compressed file
+
+	def tell(self):
+		"""Returns the virtual offset at which the next data will be written."""
+		return (self.block_offset << 16) | len(self.buffer)
+
+	def write(self, data):
+		self.buffer += data
+		while len(self.buffer) >= BGZF_BLOCK_SIZE:
+			self.flush(BGZF_BLOCK_SIZE)
+
+	def flush(self, n = None):
+		"""Writes (at most n bytes of) the buffer as one block."""
+		if n == None: 
+			n = len(self.buffer)
+		if n == 0: 
+			return
+		data, self.buffer = self.buffer[:n], self.buffer[n:]
+		compressor 	= zlib.compressobj(self.level, zlib.DEFLATED, -15) # raw deflate
+		cdata 		= compressor.compress(data) + compressor.flush()
+		block 		= struct.pack('<BBBBIBBHBBHH', 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(cdata) + 25) 
+		block 		+= cdata + struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data))
+		self.output_file.write(block)
+		self.block_offset += len(block)
+
+	def close(self):
+		self.flush()
+		self.output_file.write(BGZF_EOF)
+		self.output_file.close()
+
+class IndexedObservationsWriter:
+	"""Writes observations in the text format to a BGZF-compressed file together with its index 
+	   (<filename>.idx). Has the same interface as the ObservationsWriter. A variant is moved to 
+	   the next block when it does not fit in the current one, so that most variants lie within 
+	   one block."""
+
+	def __init__(self, filename, compressed = False):
+		self.bgzf_writer 	= BGZFWriter(filename)
+		self.compressed 	= compressed
+		self.index_file 	= open(filename + '.idx', 'w')
+		self.indexed_block 	= None # offset of the last block that has an entry in the index
+		self.chromosome 	= None # chromosome of the last variant
+
+	def write(self, variant_type, chromosome, position, length, healthy_observations, cancer_observations):
+		"""Adds one variant together with the observations of both samples."""
+		lines = formatRawObservations(variant_type, chromosome, position, length, healthy_observations, cancer_observations, compressed = self.compressed).encode()
+		if len(self.bgzf_writer.buffer) + len(lines) > BGZF_BLOCK_SIZE: 
+			self.bgzf_writer.flush()
+		if self.indexed_block != self.bgzf_writer.block_offset or self.chromosome != chromosome: # first variant in this block/on this chromosome
+			self.index_file.write('%s\t%d\t%d\n'%(chromosome, position, self.bgzf_writer.tell()))
+			self.indexed_block 	= self.bgzf_writer.block_offset
+			self.chromosome 	= chromosome
+		self.bgzf_writer.write(lines)
+
+	def close(self):
+		self.bgzf_writer.close()
+		self.index_file.close()
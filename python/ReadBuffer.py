@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) 2015 Louis Dijkstra
+
+This file is part of somatic-indel-calling
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function, division
+
+__author__ = "Louis Dijkstra"
+
+"""
+	ReadBuffer.py contains the ReadBuffer class. It is used by the BAMProcessor
+	when sweeping over a sorted list of variants: every alignment is decoded
+	from the BAM file only once and reused for all neighbouring variants.
+"""
+
+def returnAlignmentEnd (alignment):
+	"""Returns the position one past the last aligned base of the alignment. Mirrors
+	   samtools: alignments without any aligned bases are considered to span one base."""
+	if alignment.aend == None or alignment.aend <= alignment.pos:
+		return alignment.pos + 1
+	return alignment.aend
+
+class ReadBuffer:
+	"""Sliding window of alignments on one chromosome. The window can only move to the right;
+	   when it moves to the left (or to another chromosome), the buffer is reset."""
+
+	def __init__(self, bam_reader):
+		self.bam_reader 	= bam_reader
+		self.chromosome 	= None 	# chromosome currently buffered
+		self.left 		= 0	# left edge of the last requested window
+		self.alignments 	= [] 	# buffered alignments in the order in which they are stored in the BAM file
+		self.iterator 		= None 	# iterator over the alignments right of the buffer
+		self.next_alignment 	= None 	# next alignment from the iterator (not yet in the buffer)
+		self.n_decoded 		= 0 	# number of alignments decoded from the BAM file
+
+	def reset(self, chromosome, start):
+		"""Empties the buffer and starts a new sweep at position start of the given chromosome."""
+		self.chromosome 	= chromosome
+		self.left 		= start
+		self.alignments 	= []
+		self.iterator 		= self.bam_reader.fetch(chromosome, start)
+		self.next_alignment 	= self.nextAlignment()
+
+	def nextAlignment(self):
+		"""Returns the next alignment from the iterator. Returns None when the chromosome is exhausted."""
+		try:
+			alignment = next(self.iterator)
+		except StopIteration:
+			return None
+		self.n_decoded += 1
+		return alignment
+
+	def fetch(self, chromosome, start, end):
+		"""Returns the alignments that overlap the interval [start, end) on the given chromosome
+		   in the same order as pysam's fetch() would."""
+		if chromosome != self.chromosome or start < self.left:
+			self.reset(chromosome, start)
+		self.left = start
+
+		# drop the alignments that fell behind the left edge of the window
+		self.alignments = [alignment for alignment in self.alignments if returnAlignmentEnd(alignment) > start]
+
+		# add the alignments that came within reach of the right edge of the window
+		while self.next_alignment != None and self.next_alignment.pos < end:
+			self.alignments.append(self.next_alignment)
+			self.next_alignment = self.nextAlignment()
+
+		return [alignment for alignment in self.alignments if alignment.pos < end and returnAlignmentEnd(alignment) > start]
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) 2015 Louis Dijkstra
+
+This file is part of somatic-indel-calling
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function, division
+import numpy as np
+
+from Alignments import *
+
+__author__ = "Louis Dijkstra"
+
+"""
+	ReadSummary.py contains the ReadSummary class: a columnar (NumPy) summary of
+	the alignments in a window. It allows the BAMProcessor to determine the
+	relevance of the alignments, pair them and compute the alignment probabilities
+	for all alignments in the window at once.
+"""
+
+# alignment probability (1 - error probability) for every possible mapping quality
+MAPQ_PROBABILITY = np.array([1.0 - convertPhredScore(mapq) for mapq in range(256)])
+
+# one row per alignment
+READ_DTYPE = np.dtype([	('qname', np.int64), 	# hash of the read name
+			('pos', np.int64), 	# leftmost reference position (incl. deletions before the first aligned base)
+			('start', np.int64), 	# first aligned reference position (alignment.positions[0])
+			('end', np.int64), 	# last aligned reference position (alignment.positions[-1])
+			('mapq', np.uint8), 	# mapping quality
+			('isize', np.int64), 	# template length as reported by the aligner
+			('mate_rid', np.int32), # reference id of the mate
+			('mate_pos', np.int64), # leftmost reference position of the mate
+			('reverse', np.bool_), 	# alignment is on the reverse strand
+			('mate_reverse', np.bool_), # mate is on the reverse strand
+			('left_mate', np.bool_), # primary alignment of the left mate of a pair on one chromosome (see returnMateInternalSegment)
+			('mate_start', np.int64), # first aligned reference position of the mate (only set for left mates)
+			('mate_mapq', np.uint8)]) # mapping quality of the mate (only set for left mates)
+
+# one row per insertion/deletion in the CIGAR string of an alignment
+OP_DTYPE = np.dtype([	('read', np.int64), 	# row of the alignment in ReadSummary.reads
+			('type', np.int8), 	# 1 - insertion, 2 - deletion
+			('length', np.int64), 	# length of the insertion/deletion
+			('offset', np.int64)]) 	# pos plus the lengths of all preceding CIGAR operations
+
+class ReadSummary:
+	"""Columnar summary of a list of alignments. Unmapped alignments (isize equals 0) are left out."""
+
+	def __init__(self, alignments, mate_coordinates = False):
+		"""When mate_coordinates is True, the mate fields of the left mates are filled in 
+		   (see returnMateInternalSegment)."""
+		reads, ops = [], []
+		for alignment in alignments:
+			if alignment.isize == 0: # alignment is unmapped
+				continue
+			offset = alignment.pos # walks over all CIGAR operations (see DefaultBAMProcessor)
+			for (cigar_type, cigar_length) in alignment.cigar:
+				if cigar_type == 1 or cigar_type == 2: # insertion or deletion
+					ops.append((len(reads), cigar_type, cigar_length, offset))
+				offset += cigar_length
+			start, end = returnAlignedSpan(alignment.pos, alignment.cigar)
+			left_mate, mate_start, mate_mapq = False, 0, 0
+			if mate_coordinates:
+				segment = returnMateInternalSegment(alignment)
+				if segment != None:
+					left_mate, mate_start = True, segment[1] + 1
+					mate_mapq = returnMateMappingQuality(alignment, dict(alignment.tags))
+			reads.append((hash(alignment.qname), alignment.pos, start, end, alignment.mapq, alignment.isize, alignment.mrnm, alignment.mpos, alignment.is_reverse, alignment.mate_is_reverse, left_mate, mate_start, mate_mapq))
+		self.reads 	= np.array(reads, dtype = READ_DTYPE)
+		self.ops 	= np.array(ops, dtype = OP_DTYPE)
+
+	def returnAlignmentProbabilities(self):
+		"""Returns the alignment probability of every alignment."""
+		return MAPQ_PROBABILITY[self.reads['mapq']]
+
+	def returnReadsWithOperation(self, rows):
+		"""Returns for every alignment 1 when it is among the given rows, 0 otherwise."""
+		support = np.zeros(len(self.reads), dtype = np.int64)
+		support[rows] = 1
+		return support
+
+	def returnPairs(self, selection):
+		"""Returns the rows of the left and right alignment of all read pairs among the selected
+		   alignments (boolean array over self.reads). Only read names that occur exactly twice
+		   are considered. The pairs are ordered by the first occurrence of the read name."""
+		rows = np.nonzero(selection)[0]
+		qnames = self.reads['qname'][rows]
+		if len(rows) == 0:
+			return rows, rows
+		unique_qnames, first, counts = np.unique(qnames, return_index = True, return_counts = True)
+		last = len(rows) - 1 - np.unique(qnames[::-1], return_index = True)[1]
+		paired = counts == 2
+		order = np.argsort(first[paired], kind = 'mergesort')
+		left, right = rows[first[paired][order]], rows[last[paired][order]]
+		# the left alignment is the first one, unless the second lies entirely left of it
+		swap = self.reads['end'][right] < self.reads['start'][left]
+		return np.where(swap, right, left), np.where(swap, left, right)
+
+	def returnInternalSegments(self, selection):
+		"""Returns the start and end of the internal segments of all read pairs among the selected
+		   alignments together with the associated (paired-end) alignment probabilities."""
+		left, right 	= self.returnPairs(selection)
+		segment_start 	= self.reads['end'][left] + 1
+		segment_end 	= self.reads['start'][right] - 1
+		probability 	= MAPQ_PROBABILITY[self.reads['mapq'][left]] * MAPQ_PROBABILITY[self.reads['mapq'][right]]
+		return segment_start, segment_end, probability
+
+	def returnMateInternalSegments(self, selection):
+		"""Returns the start and end of the internal segments of all read pairs whose left mate is 
+		   among the selected alignments, derived from the mate fields only (see returnMateInternalSegment), 
+		   together with the associated (paired-end) alignment probabilities."""
+		left 		= np.nonzero(selection & self.reads['left_mate'])[0]
+		segment_start 	= self.reads['end'][left] + 1
+		segment_end 	= self.reads['mate_start'][left] - 1
+		probability 	= MAPQ_PROBABILITY[self.reads['mapq'][left]] * MAPQ_PROBABILITY[self.reads['mate_mapq'][left]]
+		return segment_start, segment_end, probability
@@ -0,0 +1,111 @@
+/*
+ * Copyright (C) 2015 Louis Dijkstra
+ *
+ * This file is part of somatic-indel-calling
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+#include <fcntl.h>
+
+#include "smc_bgzf.h"
+
+size_t isCompressedObservationsFile(const char *filename) {
+	/* Returns 1 when the file is gzip/BGZF-compressed, 0 otherwise */
+	unsigned char magic[2] ; 
+	FILE *fp = fopen(filename, "rb") ; 
+	if (fp == NULL) {
+		return 0 ; 
+	}
+	size_t n = fread(magic, sizeof(unsigned char), 2, fp) ; 
+	fclose(fp) ; 
+	return n == 2 && magic[0] == 0x1f && magic[1] == 0x8b ; 
+}
+
+uint64_t returnRegionOffset(const char *filename, parameters *p) {
+	/* Returns the virtual offset of the block that contains the first variant in the 
+	 * region. This is the last entry in the index on the region's chromosome with a 
+	 * position smaller than the start of the region (or the first entry on the 
+	 * chromosome). Returns 0 when there is no index, i.e., the file is read from the start.
+	 * The same holds when an entry of the index is malformed (e.g., truncated), since it 
+	 * might be the first entry of the region's chromosome. 
+	 */
+	char *index_filename = malloc((strlen(filename) + strlen(INDEX_SUFFIX) + 1) * sizeof(char)) ; 
+	if (index_filename == NULL) {
+		printf("Insufficient memory to allocate the buffer.\n") ;
+		exit(EXIT_FAILURE) ; 
+	}
+	sprintf(index_filename, "%s%s", filename, INDEX_SUFFIX) ; 
+	FILE *fp = fopen(index_filename, "r") ; 
+	free(index_filename) ; 
+	if (fp == NULL) {
+		return 0 ; 
+	}
+
+	char *line, *chromosome, *position_field, *offset_field, *position_end, *offset_end ; 
+	size_t position, found = 0 ; 
+	uint64_t offset, region_offset = 0 ; 
+	while (!feof(fp)) {
+		line = inputString(fp) ; 
+		chromosome = strtok(line, DELIM) ; 
+		if (chromosome == NULL) { // empty line at the end of the file
+			free(line) ; 
+			continue ; 
+		}
+		position_field 	= strtok(NULL, DELIM) ; 
+		offset_field 	= position_field == NULL ? NULL : strtok(NULL, DELIM) ; 
+		if (offset_field == NULL) { // malformed entry; the file is read from the start
+			free(line) ; 
+			fclose(fp) ; 
+			return 0 ; 
+		}
+		position 	= strtoul(position_field, &position_end, 10) ; 
+		offset 		= strtoull(offset_field, &offset_end, 10) ; 
+		if (*position_end != '\0' || *offset_end != '\0') { // idem
+			free(line) ; 
+			fclose(fp) ; 
+			return 0 ; 
+		}
+		if (strcmp(chromosome, p->region_chromosome) == 0) {
+			if (found == 0 || position < p->region_start) {
+				region_offset = offset ; 
+			}
+			found = 1 ; 
+		}
+		free(line) ; 
+	}
+	fclose(fp) ; 
+	return region_offset ; 
+}
+
+text_observations *openCompressedObservations(const char *filename, uint64_t virtual_offset) {
+	/* Opens a BGZF-compressed observations file and starts reading at the given 
+	 * virtual offset, i.e., the offset of the block in the compressed file times 
+	 * 2^16 plus the offset within the decompressed block. Returns NULL when the 
+	 * file cannot be opened.
+	 */
+	int fd = open(filename, O_RDONLY) ; 
+	if (fd == -1 || lseek(fd, virtual_offset >> 16, SEEK_SET) == -1) {
+		return NULL ; 
+	}
+	gzFile gz = gzdopen(fd, "rb") ; 
+	if (gz == NULL) {
+		return NULL ; 
+	}
+	gzseek(gz, virtual_offset & 0xffff, SEEK_CUR) ; // skip to the variant within the block
+
+	text_observations *T = streamTextObservations(NULL) ; 
+	T->gz = gz ; 
+	return T ; 
+}
@@ -0,0 +1,44 @@
+/*
+ * Copyright (C) 2015 Louis Dijkstra
+ *
+ * This file is part of somatic-indel-calling
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+#ifndef SMC_BGZF_H_
+#define SMC_BGZF_H_
+
+#include <stdint.h>
+
+#include "smc_input.h"
+
+/*
+ * Reading BGZF-compressed observations files and their index (see 
+ * python/Observations.py). The decompressed text is read through zlib and 
+ * parsed by the functions in smc_input.c (see text_observations). 
+ */
+
+#define INDEX_SUFFIX ".idx" 	/* the index of <file> is stored as <file>.idx */
+
+/* Returns 1 when the file is gzip/BGZF-compressed, 0 otherwise */
+size_t isCompressedObservationsFile(const char *filename) ; 
+
+/* Returns the virtual offset at which to start reading the variants in the region (0 when there is no index) */
+uint64_t returnRegionOffset(const char *filename, parameters *p) ; 
+
+/* Opens a BGZF-compressed observations file and starts reading at the given virtual offset */
+text_observations *openCompressedObservations(const char *filename, uint64_t virtual_offset) ; 
+
+#endif
@@ -0,0 +1,228 @@
+/*
+ * Copyright (C) 2015 Louis Dijkstra
+ *
+ * This file is part of somatic-indel-calling
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+#include <fcntl.h>
+#include <stddef.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+
+#include "smc_binary.h"
+
+size_t isBinaryObservationsFile(const char *filename) {
+	/* Returns 1 when the file is a binary observations file, 0 otherwise */
+	char magic[BINARY_MAGIC_LENGTH] ;
+	FILE *fp = fopen(filename, "rb") ;
+	if (fp == NULL) {
+		return 0 ;
+	}
+	size_t n = fread(magic, sizeof(char), BINARY_MAGIC_LENGTH, fp) ;
+	fclose(fp) ;
+	return n == BINARY_MAGIC_LENGTH && (memcmp(magic, BINARY_MAGIC, BINARY_MAGIC_LENGTH) == 0 || memcmp(magic, BINARY_MAGIC_COMPRESSED, BINARY_MAGIC_LENGTH) == 0) ;
+}
+
+static size_t fitsInMap(uint64_t offset, uint64_t n, size_t size, size_t map_length) {
+	/* Returns 1 when a section of n elements of the given size that starts at offset 
+	 * lies within the mapped file (and is aligned to 8 bytes), 0 otherwise 
+	 */
+	return offset % 8 == 0 && offset <= map_length && n <= (map_length - offset) / size ; 
+}
+
+static size_t fitsInArray(uint64_t start, uint64_t n, uint64_t length) {
+	/* Returns 1 when the elements start, ..., start + n - 1 lie within an array of the given length */
+	return n <= length && start <= length - n ; 
+}
+
+static size_t isValidBinaryObservations(binary_observations *B, size_t compressed) {
+	/* Returns 1 when all sections and the observations of every variant lie within the 
+	 * mapped file, so that the observations can be used in place, 0 otherwise 
+	 */
+	binary_header *H = B->header ; 
+	if (B->map_length < (compressed ? sizeof(binary_header) : offsetof(binary_header, isize_count_offset))) {
+		return 0 ; 
+	}
+	if (!fitsInMap(H->chromosomes_offset, H->n_chromosomes, BINARY_CHROM_WIDTH, B->map_length) || 
+			!fitsInMap(H->variants_offset, H->n_variants, sizeof(binary_variant), B->map_length) || 
+			!fitsInMap(H->isize_offset, H->n_isize, sizeof(size_t), B->map_length) || 
+			!fitsInMap(H->isize_prob_offset, H->n_isize, sizeof(double), B->map_length) || 
+			!fitsInMap(H->split_offset, H->n_split, sizeof(size_t), B->map_length) || 
+			!fitsInMap(H->split_prob_offset, H->n_split, sizeof(double), B->map_length)) {
+		return 0 ; 
+	}
+	if (compressed && (!fitsInMap(H->isize_count_offset, H->n_isize, sizeof(size_t), B->map_length) || 
+			!fitsInMap(H->split_count_offset, H->n_split, sizeof(size_t), B->map_length))) {
+		return 0 ; 
+	}
+
+	char *base = (char*) B->map ; 
+	size_t i, sample ; 
+	for (i = 0 ; i < H->n_chromosomes ; i ++) { // the names need to be NUL-terminated
+		if (memchr(base + H->chromosomes_offset + i * BINARY_CHROM_WIDTH, '\0', BINARY_CHROM_WIDTH) == NULL) {
+			return 0 ; 
+		}
+	}
+	binary_variant *bv = (binary_variant*) (base + H->variants_offset) ; 
+	for (i = 0 ; i < H->n_variants ; i ++, bv ++) {
+		if (bv->chromosome >= H->n_chromosomes) {
+			return 0 ; 
+		}
+		for (sample = 0 ; sample < 2 ; sample ++) {
+			if (!fitsInArray(bv->isize_start[sample], bv->isize_n[sample], H->n_isize) || !fitsInArray(bv->split_start[sample], bv->split_n[sample], H->n_split)) {
+				return 0 ; 
+			}
+		}
+	}
+	return 1 ; 
+}
+
+binary_observations *openBinaryObservations(const char *filename) {
+	/* Memory-maps a binary observations file */
+	binary_observations *B = malloc(sizeof(binary_observations)) ;
+	if (B == NULL) {
+		printf("Insufficient memory to allocate the buffer.\n") ;
+		exit(EXIT_FAILURE) ;
+	}
+
+	int fd = open(filename, O_RDONLY) ;
+	struct stat st ;
+	if (fd == -1 || fstat(fd, &st) == -1) {
+		printf("Could not open file %s\n", filename) ;
+		exit(EXIT_FAILURE) ;
+	}
+	if ((size_t) st.st_size < offsetof(binary_header, isize_count_offset)) {
+		printf("ERROR: %s is not a valid binary observations file.\n", filename) ;
+		exit(EXIT_FAILURE) ;
+	}
+
+	B->map_length 	= st.st_size ;
+	B->map 		= mmap(NULL, B->map_length, PROT_READ, MAP_PRIVATE, fd, 0) ;
+	close(fd) ; // the mapping remains valid
+	if (B->map == MAP_FAILED) {
+		printf("Could not memory-map file %s\n", filename) ;
+		exit(EXIT_FAILURE) ;
+	}
+	madvise(B->map, B->map_length, MADV_SEQUENTIAL) ; // variants are read one after another
+
+	char *base 	= (char*) B->map ;
+	B->header 	= (binary_header*) base ;
+	size_t compressed = memcmp(B->header->magic, BINARY_MAGIC_COMPRESSED, BINARY_MAGIC_LENGTH) == 0 ;
+	if (memcmp(B->header->magic, BINARY_MAGIC, BINARY_MAGIC_LENGTH) != 0 && !compressed) {
+		printf("ERROR: %s is not a valid binary observations file.\n", filename) ;
+		exit(EXIT_FAILURE) ;
+	}
+	if (!isValidBinaryObservations(B, compressed)) {
+		printf("ERROR: %s is not a valid binary observations file.\n", filename) ;
+		exit(EXIT_FAILURE) ;
+	}
+
+	B->chromosomes 	= base + B->header->chromosomes_offset ;
+	B->variants 	= (binary_variant*) (base + B->header->variants_offset) ;
+	B->isize 	= (size_t*) (base + B->header->isize_offset) ;
+	B->isize_prob 	= (double*) (base + B->header->isize_prob_offset) ;
+	B->split 	= (size_t*) (base + B->header->split_offset) ;
+	B->split_prob 	= (double*) (base + B->header->split_prob_offset) ;
+	B->isize_count 	= compressed ? (size_t*) (base + B->header->isize_count_offset) : NULL ;
+	B->split_count 	= compressed ? (size_t*) (base + B->header->split_count_offset) : NULL ;
+	B->next 	= 0 ;
+	return B ;
+}
+
+void closeBinaryObservations(binary_observations *B) {
+	/* Unmaps the binary observations file */
+	munmap(B->map, B->map_length) ;
+	free(B) ;
+}
+
+size_t obtainBinaryVariant(binary_observations *B, variant *v, parameters *p) {
+	/* Returns variant info and stores it in v. The return values are the same as
+	 * for obtainVariant (see smc_input.c).
+	 */
+	if (B->next == B->header->n_variants) {
+		return END_OF_FILE_REACHED ; // reported by the writer (see smc_threads.c)
+	}
+	binary_variant *bv = B->variants + (B->next++) ;
+
+	v->type 	= bv->type ;
+	v->position 	= bv->position ;
+	v->length 	= bv->length ;
+	snprintf(v->chromosome, LENGTH_CHROM_BUFFER, "%s", B->chromosomes + bv->chromosome * BINARY_CHROM_WIDTH) ;
+
+	if (p->deletions_only == 1) {
+		if (v->type == '+') {return WRONG_VARIANT_TYPE ;} // an insertion, while only deletions are considered
+	}
+	if (p->insertions_only == 1) {
+		if (v->type == '-') {return WRONG_VARIANT_TYPE ;} // a deletion, while only insertions are considered
+	}
+	if (p->min_length > v->length) {return VARIANT_TOO_SHORT ;} // too short
+	if (v->type == '*') {return WRONG_VARIANT_TYPE ;} // not an indel
+	return VALID_VARIANT ;
+}
+
+data obtainBinaryData(binary_observations *B, parameters *p, arena *A) {
+	/* Returns the data for the variant last returned by obtainBinaryVariant.
+	 * The observations point into the mapped file; only the probabilities that
+	 * replace the ones in the file (option -u) are allocated from the arena.
+	 */
+	data D ;
+	binary_variant *bv = B->variants + (B->next - 1) ;
+
+	// insert sizes from the healthy and cancer sample
+	if (p->split_only) {
+		D.h_isize_n = 0 ;
+		D.c_isize_n = 0 ;
+		D.h_isize_count = NULL ;
+		D.c_isize_count = NULL ;
+	} else {
+		D.h_isize_n 	= bv->isize_n[0] ;
+		D.h_isize 	= B->isize + bv->isize_start[0] ;
+		D.c_isize_n 	= bv->isize_n[1] ;
+		D.c_isize 	= B->isize + bv->isize_start[1] ;
+		D.h_isize_count = B->isize_count ? B->isize_count + bv->isize_start[0] : NULL ;
+		D.c_isize_count = B->isize_count ? B->isize_count + bv->isize_start[1] : NULL ;
+		if (p->align_uncertainty_off) {
+			D.h_isize_prob = returnListOfOnes(D.h_isize_n, A) ;
+			D.c_isize_prob = returnListOfOnes(D.c_isize_n, A) ;
+		} else {
+			D.h_isize_prob = B->isize_prob + bv->isize_start[0] ;
+			D.c_isize_prob = B->isize_prob + bv->isize_start[1] ;
+		}
+	}
+
+	// split read observations from the healthy and cancer sample
+	if (p->isize_only) {
+		D.h_split_n = 0 ;
+		D.c_split_n = 0 ;
+		D.h_split_count = NULL ;
+		D.c_split_count = NULL ;
+	} else {
+		D.h_split_n 	= bv->split_n[0] ;
+		D.h_split 	= B->split + bv->split_start[0] ;
+		D.c_split_n 	= bv->split_n[1] ;
+		D.c_split 	= B->split + bv->split_start[1] ;
+		D.h_split_count = B->split_count ? B->split_count + bv->split_start[0] : NULL ;
+		D.c_split_count = B->split_count ? B->split_count + bv->split_start[1] : NULL ;
+		if (p->align_uncertainty_off) {
+			D.h_split_prob = returnListOfOnes(D.h_split_n, A) ;
+			D.c_split_prob = returnListOfOnes(D.c_split_n, A) ;
+		} else {
+			D.h_split_prob = B->split_prob + bv->split_start[0] ;
+			D.c_split_prob = B->split_prob + bv->split_start[1] ;
+		}
+	}
+	return D ;
+}
@@ -0,0 +1,100 @@
+/*
+ * Copyright (C) 2015 Louis Dijkstra
+ *
+ * This file is part of somatic-indel-calling
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+#ifndef SMC_BINARY_H_
+#define SMC_BINARY_H_
+
+#include <stdint.h>
+
+#include "smc_input.h" // contains data structure
+
+/*
+ * Reader for the binary observations format (see python/Observations.py).
+ * The file is memory-mapped and the observations are used in place, i.e.,
+ * they are neither parsed nor copied. The structs below mirror the layout
+ * of the file (little-endian, 64-bit).
+ */
+
+#define BINARY_MAGIC 		"SMC-OBS1" 	/* first 8 bytes of a binary observations file */
+#define BINARY_MAGIC_COMPRESSED "SMC-OBS2" 	/* idem, with counts of identical observations (see compressData) */
+#define BINARY_MAGIC_LENGTH 	8
+#define BINARY_CHROM_WIDTH 	64 		/* # of bytes reserved for a chromosome name */
+
+typedef struct {
+	char magic[BINARY_MAGIC_LENGTH] ;
+	uint64_t n_variants ;
+	uint64_t n_chromosomes ;
+	uint64_t n_isize ; 		// total number of insert size observations
+	uint64_t n_split ; 		// total number of split read observations
+	uint64_t chromosomes_offset ; 	// offsets (in bytes) of the sections
+	uint64_t variants_offset ;
+	uint64_t isize_offset ;
+	uint64_t isize_prob_offset ;
+	uint64_t split_offset ;
+	uint64_t split_prob_offset ;
+	uint64_t isize_count_offset ; 	// only in files with counts (BINARY_MAGIC_COMPRESSED)
+	uint64_t split_count_offset ;
+} binary_header ;
+
+typedef struct {
+	uint64_t position ;
+	uint64_t length ;
+	uint32_t chromosome ; 		// index in the chromosome names
+	char type ; 			// '+' in case of an insertion, '-' in case of a deletion
+	char padding[3] ;
+	uint64_t isize_start[2] ; 	// per sample (0 - healthy, 1 - cancer)
+	uint64_t isize_n[2] ;
+	uint64_t split_start[2] ;
+	uint64_t split_n[2] ;
+} binary_variant ;
+
+/*
+ * Memory-mapped binary observations file
+ */
+typedef struct {
+	void *map ; 			// the mapped file
+	size_t map_length ;
+	binary_header *header ;
+	char *chromosomes ;
+	binary_variant *variants ;
+	size_t *isize ;
+	double *isize_prob ;
+	size_t *split ;
+	double *split_prob ;
+	size_t *isize_count ; 		// NULL when the file has no counts
+	size_t *split_count ;
+	size_t next ; 			// index of the next variant
+} binary_observations ;
+
+/* Returns 1 when the file is a binary observations file, 0 otherwise */
+size_t isBinaryObservationsFile(const char *filename) ;
+
+/* Memory-maps a binary observations file */
+binary_observations *openBinaryObservations(const char *filename) ;
+
+/* Unmaps the binary observations file */
+void closeBinaryObservations(binary_observations *B) ;
+
+/* Returns variant info (when available); see obtainVariant */
+size_t obtainBinaryVariant(binary_observations *B, variant *v, parameters *p) ;
+
+/* Returns the data for the variant last returned by obtainBinaryVariant (see obtainData) */
+data obtainBinaryData(binary_observations *B, parameters *p, arena *A) ;
+
+#endif
@@ -17,10 +17,21 @@
  * along with this program.  If not, see <http://www.gnu.org/licenses/>.
  */
 
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+
 #include "smc_input.h"
 
+#define ARENA_HEADER_SIZE 	(((sizeof(arena_block) + ARENA_ALIGNMENT - 1) / ARENA_ALIGNMENT) * ARENA_ALIGNMENT)
+#define LENGTH_NUMBER_BUFFER 	64 	/* # of characters of a number passed to strtod */
+#define IS_SEPARATOR(c) 	((c) == '\t' || (c) == ' ' || (c) == '\r') 	/* the values on a line are separated by whitespace */
+
 void usage(const char *pname) {
 	printf(	"Usage: %s [OPTION] <filename.observations>\n"
+		"\n"
+		"The observations file can be in the text or binary format (see convert-observations.py).\n"
+		"When the filename is -, the observations (text format) are read from standard input.\n"
 		"\n"
 		" -a\tNUM\tLevel of impurity in the cancer sample (alpha).\n"
 		" -e\tNUM\tProbability of a split presence when a deletion is there.\n"
@@ -39,7 +50,11 @@ void usage(const char *pname) {
 		" -l\tNUM\tLength of indel to be considered.\n"
 		" -P\tNUM\tPrecision used for maximization.\n"
 		" -M\tNUM\tMax. number of iterations used for maximization.\n"
-		" -N\tNUM\tNumber of panels used for integration (trapezoidal rule).\n"
+		" -N\tNUM\tInitial number of panels used for integration (adaptive Simpson; only when built with GMP).\n"
+		" -T\tNUM\tRelative tolerance used for integration (adaptive Simpson; only when built with GMP).\n"
+		" -S\tSTR\tSolver used for maximization: brent (default) or newton (safeguarded Newton, falls back to brent).\n"
+		" -t\tNUM\tNumber of threads used for calling the variants (the output remains in the input order).\n"
+		" -R\tSTR\tOnly variants in this region (chr or chr:start-end). Uses the index of BGZF-compressed files.\n"
 		" -B\t\tOnly split read evidence.\n"
 		" -d\t\tOnly deletions.\n"
 		" -i\t\tOnly insertions.\n"
@@ -51,6 +66,23 @@ void usage(const char *pname) {
 	exit(0) ; 
 }
 
+void parseRegion(parameters* p, char* region) {
+	/* Parses a region (chr or chr:start-end). Chromosome names that contain a colon are allowed. */
+	p->region 		= 1 ; 
+	p->region_chromosome 	= strdup(region) ; 
+	p->region_start 	= 0 ; 
+	p->region_end 		= SIZE_MAX ; 
+
+	char *colon = strrchr(p->region_chromosome, ':') ; 
+	size_t start, end ; 
+	char ch ; 
+	if (colon != NULL && sscanf(colon + 1, "%zu-%zu%c", &start, &end, &ch) == 2) {
+		*colon 		= '\0' ; 
+		p->region_start = start ; 
+		p->region_end 	= end ; 
+	}
+}
+
 void print_parameters(parameters* p) {
 	printf(	"===PARAMETER SETTINGS===\n\n"
 		"-------model parameters-------\n"
@@ -76,6 +108,9 @@ void print_parameters(parameters* p) {
 		"max_iter\t%zd\n"
 		"epsabs\t\t%f\n"
 		"n_panels\t%zd\n"
+		"epsrel\t\t%g\n"
+		"solver\t\t%s\n"
+		"n_threads\t%zd\n"
 		"----------------------\n\n", 
 		p->alpha, p->eps_a, 
 		p->eps_p_del, p->eps_p_ins, 
@@ -88,7 +123,10 @@ void print_parameters(parameters* p) {
 		p->split_only,
 		p->max_iter,
 		p->epsabs,
-		p->n_panels
+		p->n_panels,
+		p->epsrel,
+		p->solver == SOLVER_NEWTON ? "newton" : "brent",
+		p->n_threads
 		) ; 
 }
 
@@ -102,6 +140,7 @@ void parse_arguments(parameters* p, char* input_filename, int argc, char **argv)
 	p->split_only			= 0 ; 
 	p->verbose			= 0 ; 
 	p->min_length			= 0 ;
+	p->region			= 0 ; 
 	p->alpha 			= 0.0 ; 
 	p->eps_a 			= 0.0001 ;
 	p->eps_p_del			= 0.0961 ; 
@@ -114,10 +153,13 @@ void parse_arguments(parameters* p, char* input_filename, int argc, char **argv)
 	p->rate_c			= 0.0 ; 
 	p->max_iter 			= 100 ; 
 	p->epsabs			= 0.0001 ; 
-	p->n_panels			= 100 ; 
+	p->n_panels			= 4 ; 
+	p->epsrel			= 1e-6 ; 
+	p->solver			= SOLVER_BRENT ; 
+	p->n_threads			= 1 ; 
 
 	size_t ch ; 
-	while ((ch = getopt(argc, argv, "a:e:E:y:m:s:r:f:F:g:G:h:H:l:P:M:N:BdiIuvh")) != -1)
+	while ((ch = getopt(argc, argv, "a:e:E:y:m:s:r:f:F:g:G:h:H:l:P:M:N:T:S:t:R:BdiIuvh")) != -1)
     	{
        		switch(ch) {
 			case 'a': p->alpha = strtod(optarg, 0); break ; 
@@ -137,6 +179,19 @@ void parse_arguments(parameters* p, char* input_filename, int argc, char **argv)
 			case 'P': p->epsabs = strtod(optarg, 0); break ; 
 			case 'M': p->max_iter = strtol(optarg, 0, 10); break ; 
 			case 'N': p->n_panels = strtol(optarg, 0, 10); break ; 
+			case 'T': p->epsrel = strtod(optarg, 0); break ; 
+			case 'S': 
+				if (strcmp(optarg, "brent") == 0) {
+					p->solver = SOLVER_BRENT ; 
+				} else if (strcmp(optarg, "newton") == 0) {
+					p->solver = SOLVER_NEWTON ; 
+				} else {
+					printf("ERROR: Invalid argument. The solver (-S) must be brent or newton.\n") ;
+					exit(EXIT_FAILURE) ; 
+				}
+				break ; 
+			case 't': p->n_threads = strtol(optarg, 0, 10); break ; 
+			case 'R': parseRegion(p, optarg); break ; 
 			case 'B': p->split_only = 1; break ;  
 			case 'd': p->deletions_only = 1; break ; 
 			case 'i': p->insertions_only = 1; break ;
@@ -216,8 +271,18 @@ void parse_arguments(parameters* p, char* input_filename, int argc, char **argv)
 		error_occurred = 1 ;  	
 	}
 
-	if (p->n_panels < 1) {
-		printf("ERROR: Invalid argument. n_panels (-N) must be at least 1.\n") ;
+	if (p->n_panels < 1 || p->n_panels > MAX_SIMPSON_PANELS) {
+		printf("ERROR: Invalid argument. n_panels (-N) must lie between 1 and %d.\n", MAX_SIMPSON_PANELS) ;
+		error_occurred = 1 ;  	
+	}
+
+	if (p->epsrel <= 0.0) {
+		printf("ERROR: Invalid argument. Relative tolerance (-T) must be positive.\n") ;
+		error_occurred = 1 ;  
+	}
+
+	if (p->n_threads < 1) {
+		printf("ERROR: Invalid argument. n_threads (-t) must be at least 1.\n") ;
 		error_occurred = 1 ;  	
 	}
 
@@ -258,100 +323,352 @@ char *inputString(FILE* fp) {
 	return realloc(buffer, sizeof(char) * i); 
 }
 
-size_t *returnIntegerArray(char* buffer, size_t* n_elem) { 
-	/* Converts a string into an array of integers of unknown length */
-	(*n_elem) = 0 ; 
-	size_t len = INITIAL_N_OBSERVATIONS ; 
-	size_t *observations = malloc(len * sizeof(size_t)) ; 
- 	if (observations == NULL) {
-		printf("Insufficient memory to allocate the buffer.\n") ;
+void initArena(arena* A) {
+	/* Initializes an empty arena */
+	A->block 	= NULL ; 
+	A->allocated 	= 0 ; 
+}
+
+static arena_block* newArenaBlock(size_t size, arena_block* previous) {
+	/* Allocates a block from which size bytes can be allocated (the memory follows the header) */
+	arena_block* block = malloc(ARENA_HEADER_SIZE + size) ; 
+	if (block == NULL) {
+		printf("ERROR: insufficient memory for allocation.\n") ; 
 		exit(EXIT_FAILURE) ; 
 	}
-	
-	size_t i = 0 ; 
-	char *token = strtok(buffer, DELIM) ; 
-	while (token != NULL) {
-		observations[i++] = (size_t) atoi(token) ;
-		(*n_elem)++ ; 
-		if (i == len) {
-			observations = realloc(observations, sizeof(size_t) * (len += INITIAL_N_OBSERVATIONS)) ; 
-			if (observations == NULL) {
-				printf("Insufficient memory to reallocate the buffer.\n") ;
-				exit(EXIT_FAILURE) ; 
-			}
-		} 
-		token = strtok(NULL, DELIM) ; 
-		
+	block->previous = previous ; 
+	block->size 	= size ; 
+	block->used 	= 0 ; 
+	return block ; 
+}
+
+void* arenaAlloc(arena* A, size_t n) {
+	/* Returns n bytes from the arena (aligned to ARENA_ALIGNMENT). When the current 
+	 * block is full, a new block is allocated that is at least twice as large. 
+	 */
+	n = ((n + ARENA_ALIGNMENT - 1) / ARENA_ALIGNMENT) * ARENA_ALIGNMENT ; 
+	if (A->block == NULL || A->block->used + n > A->block->size) {
+		size_t size = (A->block == NULL) ? ARENA_BLOCK_SIZE : 2 * A->block->size ; 
+		while (size < n) {
+			size *= 2 ; 
+		}
+		A->block = newArenaBlock(size, A->block) ; 
 	}
-	observations[i++] = '\0' ; 
-	return realloc(observations, sizeof(size_t) * i) ; 	
+	void* memory = (char*) A->block + ARENA_HEADER_SIZE + A->block->used ; 
+	A->block->used 	+= n ; 
+	A->allocated 	+= n ; 
+	return memory ; 
 }
 
-double *returnDoubleArray(char* buffer, size_t* n_elem) { 
-	/* Converts a string into an array of doubles of unknown length */
-	(*n_elem) = 0 ; 
-	size_t len = INITIAL_N_OBSERVATIONS ; 
-	size_t *observations = malloc(len * sizeof(double)) ; 
- 	if (observations == NULL) {
-		printf("Insufficient memory to allocate the buffer.\n") ;
-		exit(EXIT_FAILURE) ; 
+void resetArena(arena* A) {
+	/* Releases everything allocated from the arena at once. When the allocations did not 
+	 * fit in one block, the blocks are replaced by one block that can hold all of them. 
+	 */
+	if (A->block == NULL) {
+		return ; 
 	}
-	
-	size_t i = 0 ; 
-	
-	char *token = strtok(buffer, DELIM) ; 
-	while (token != NULL) {
-		sscanf(token, "%lf", observations + (i++)) ; 
-		(*n_elem)++ ; 
-		if (i == len) {
-			observations = realloc(observations, sizeof(double) * (len += INITIAL_N_OBSERVATIONS)) ; 
-			if (observations == NULL) {
-				printf("Insufficient memory to reallocate the buffer.\n") ;
-				exit(EXIT_FAILURE) ; 
-			}
-		} 
+	if (A->block->previous != NULL) {
+		size_t size = A->block->size ; 
+		while (size < A->allocated) {
+			size *= 2 ; 
+		}
+		freeArena(A) ; 
+		A->block = newArenaBlock(size, NULL) ; 
+	}
+	A->block->used 	= 0 ; 
+	A->allocated 	= 0 ; 
+}
 
-		printf("%s\n", token) ; 
-		token = strtok(NULL, DELIM) ; 
-		
+void freeArena(arena* A) {
+	/* Frees the memory of the arena */
+	arena_block* previous ; 
+	while (A->block != NULL) {
+		previous = A->block->previous ; 
+		free(A->block) ; 
+		A->block = previous ; 
 	}
-	observations[i++] = '\0' ; 
-	return realloc(observations, sizeof(double) * i) ; 	
+	A->allocated = 0 ; 
 }
 
-double *returnProbabilities(char* buffer, int n) {
-	/* Converts a string into an array of doubles of known length n */
-	double *probabilities = malloc(n * sizeof(double)) ; 
-	if (probabilities == NULL) {
-		printf("Insufficient memory to allocate the buffer.\n") ;
-		exit(EXIT_FAILURE) ; 
+double *returnListOfOnes(size_t n, arena* A) {
+	/* Returns a list of n doubles initialized as ones (allocated from the arena) */
+	double *list = arenaAlloc(A, n * sizeof(double)) ; 
+	size_t i ; 
+	for (i = 0; i < n; i ++) {
+		list[i] = 1.0 ; 
 	}
-	
-	char *token = strtok(buffer, DELIM) ;
-	size_t i = 0 ; 
-	for (i; i < n; i ++) {
-		sscanf(token, "%lf", probabilities + i) ;
-		token = strtok(NULL, DELIM) ; 
+	return list ; 
+}
+
+text_observations* openTextObservations(const char* filename) {
+	/* Memory-maps an observations file in the text format. Files that cannot be mapped 
+	 * (e.g., named pipes) are read as a stream. Returns NULL when the file cannot be opened. 
+	 */
+	int fd = open(filename, O_RDONLY) ; 
+	struct stat st ; 
+	if (fd == -1 || fstat(fd, &st) == -1) {
+		return NULL ; 
+	}
+	if (!S_ISREG(st.st_mode)) {
+		FILE* fp = fdopen(fd, "r") ; 
+		return (fp == NULL) ? NULL : streamTextObservations(fp) ; 
+	}
+
+	text_observations* T = streamTextObservations(NULL) ; 
+	T->map_length = st.st_size ; 
+	if (T->map_length > 0) { // an empty file cannot be mapped
+		T->map = mmap(NULL, T->map_length, PROT_READ, MAP_PRIVATE, fd, 0) ; 
+		if (T->map == MAP_FAILED) {
+			close(fd) ; 
+			free(T) ; 
+			return NULL ; 
+		}
+		madvise(T->map, T->map_length, MADV_SEQUENTIAL) ; // variants are read one after another
 	}
-	return probabilities ; 
+	close(fd) ; // the mapping remains valid
+	return T ; 
 }
 
-double *returnListOfOnes(size_t n) {
-	/* Returns a list of n doubles initialized as ones */
-	double *list = malloc(n * sizeof(double)) ; 
-	if (list == NULL) {
-		printf("Insufficient memory to allocate the buffer.\n") ;
+text_observations* streamTextObservations(FILE* fp) {
+	/* Reads the observations (text format) from a stream, e.g., standard input */
+	text_observations* T = malloc(sizeof(text_observations)) ; 
+	if (T == NULL) {
+		printf("ERROR: insufficient memory for allocation.\n") ; 
 		exit(EXIT_FAILURE) ; 
 	}
-	
+	T->map 		= NULL ; 
+	T->map_length 	= 0 ; 
+	T->next 	= 0 ; 
+	T->released 	= 0 ; 
+	T->fp 		= fp ; 
+	T->gz 		= NULL ; 
+	T->line 	= NULL ; 
+	T->line_size 	= 0 ; 
+	return T ; 
+}
+
+void closeTextObservations(text_observations* T) {
+	/* Unmaps the file or closes the stream */
+	if (T->fp != NULL) {
+		fclose(T->fp) ; 
+	} else if (T->gz != NULL) {
+		gzclose(T->gz) ; 
+	} else if (T->map != NULL) {
+		munmap(T->map, T->map_length) ; 
+	}
+	free(T->line) ; 
+	free(T) ; 
+}
+
+static ssize_t readCompressedLine(text_observations* T) {
+	/* Reads the next line of the compressed stream into the buffer of T and returns its 
+	 * length (including the newline, as getline). Returns -1 at the end of the file. 
+	 */
+	size_t length = 0 ; 
+	if (T->line == NULL) {
+		T->line_size 	= BUFSIZ ; 
+		T->line 	= malloc(T->line_size * sizeof(char)) ; 
+		if (T->line == NULL) {
+			printf("Insufficient memory to allocate the buffer.\n") ;
+			exit(EXIT_FAILURE) ; 
+		}
+	}
+	while (gzgets(T->gz, T->line + length, T->line_size - length) != NULL) {
+		length += strlen(T->line + length) ; 
+		if (T->line[length - 1] == '\n' || length < T->line_size - 1) { // end of the line or of the file
+			return length ; 
+		}
+		T->line = realloc(T->line, sizeof(char) * (T->line_size += BUFSIZ)) ; // the line does not fit
+		if (T->line == NULL) {
+			printf("Insufficient memory to reallocate the buffer.\n") ;
+			exit(EXIT_FAILURE) ; 
+		}
+	}
+	return length > 0 ? (ssize_t) length : -1 ; 
+}
+
+static char* nextLine(text_observations* T, char** end) {
+	/* Returns the next line and sets end to the end of the line (the newline is not 
+	 * part of the line, which is not null-terminated). Returns NULL at the end of the file. 
+	 * A line of a mapped file points into the file; a line of a stream is valid until the 
+	 * next call. 
+	 */
+	if (T->fp != NULL || T->gz != NULL) {
+		ssize_t length = (T->gz != NULL) ? readCompressedLine(T) : getline(&T->line, &T->line_size, T->fp) ; 
+		if (length == -1) {
+			return NULL ; 
+		}
+		if (length > 0 && T->line[length - 1] == '\n') {
+			length -- ; 
+		}
+		(*end) = T->line + length ; 
+		return T->line ; 
+	}
+
+	if (T->next >= T->map_length) {
+		return NULL ; 
+	}
+	char* line 	= T->map + T->next ; 
+	char* newline 	= memchr(line, '\n', T->map_length - T->next) ; 
+	(*end) 		= (newline != NULL) ? newline : T->map + T->map_length ; 
+	T->next 	= (*end) - T->map + 1 ; 
+
+	// the observations are copied into the arena, so the pages that are parsed are not needed anymore
+	if (T->next - T->released >= RELEASE_INTERVAL) {
+		size_t page_size = sysconf(_SC_PAGESIZE) ; 
+		size_t release = ((line - T->map) / page_size) * page_size ; // the pages before the current line
+		madvise(T->map + T->released, release - T->released, MADV_DONTNEED) ; 
+		T->released = release ; 
+	}
+	return line ; 
+}
+
+static char* nextToken(char** s, char* end) {
+	/* Returns the next token on the line (NULL when there is none) and moves s to the end of the token */
+	while ((*s) < end && IS_SEPARATOR(**s)) {
+		(*s) ++ ; 
+	}
+	if ((*s) == end) {
+		return NULL ; 
+	}
+	char* token = (*s) ; 
+	while ((*s) < end && !IS_SEPARATOR(**s)) {
+		(*s) ++ ; 
+	}
+	return token ; 
+}
+
+static size_t countTokens(char* s, char* end) {
+	/* Returns the number of tokens on the line */
+	size_t n = 0 ; 
+	while (nextToken(&s, end) != NULL) {
+		n ++ ; 
+	}
+	return n ; 
+}
+
+static size_t parseInteger(char** s, char* end) {
+	/* Parses the digits at s and moves s past them */
+	size_t value = 0 ; 
+	while ((*s) < end && **s >= '0' && **s <= '9') {
+		value = 10 * value + (**s - '0') ; 
+		(*s) ++ ; 
+	}
+	return value ; 
+}
+
+/* Powers of ten that are exactly representable as a double */
+static const double powers_of_ten[] = {1e0, 1e1, 1e2, 1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9, 1e10, 1e11, 
+					1e12, 1e13, 1e14, 1e15, 1e16, 1e17, 1e18, 1e19, 1e20, 1e21, 1e22} ; 
+
+static double parseDouble(char* token, char* end) {
+	/* Parses a number in decimal notation. When the significant digits fit in 53 bits 
+	 * and the power of ten is exactly representable, the number is the result of one 
+	 * multiplication or division of two exact doubles, which is correctly rounded, i.e., 
+	 * the same as returned by strtod. The other numbers are parsed by strtod. 
+	 */
+	char* s = token ; 
+	uint64_t mantissa = 0 ; 
+	int n_digits = 0, exponent = 0, exponent_sign = 1 ; 
+	short negative = 0, exact = 1 ; 
+
+	if (s < end && (*s == '-' || *s == '+')) {
+		negative = (*s == '-') ; 
+		s ++ ; 
+	}
+	char* digits = s ; 
+	for (; s < end && *s >= '0' && *s <= '9'; s ++) {
+		if (mantissa > 0 || *s != '0') {
+			exact &= (++ n_digits <= 19) ; // larger mantissas do not fit in 64 bits
+			mantissa = 10 * mantissa + (*s - '0') ; 
+		}
+	}
+	if (s < end && *s == '.') {
+		for (s ++; s < end && *s >= '0' && *s <= '9'; s ++) {
+			if (mantissa > 0 || *s != '0') {
+				exact &= (++ n_digits <= 19) ; 
+				mantissa = 10 * mantissa + (*s - '0') ; 
+			}
+			exponent -- ; 
+		}
+	}
+	exact &= (s > digits) ; // e.g., nan or inf
+	if (s < end && (*s == 'e' || *s == 'E')) {
+		s ++ ; 
+		if (s < end && (*s == '-' || *s == '+')) {
+			exponent_sign = (*s == '-') ? -1 : 1 ; 
+			s ++ ; 
+		}
+		exact &= (s < end && *s >= '0' && *s <= '9') ; 
+		exponent += exponent_sign * (int) parseInteger(&s, end) ; // very large exponents are handled by strtod
+	}
+	exact &= (s == end) && mantissa <= (1ULL << 53) && exponent >= -22 && exponent <= 22 ; 
+
+	if (exact) {
+		double value = (exponent < 0) ? mantissa / powers_of_ten[-exponent] : mantissa * powers_of_ten[exponent] ; 
+		return negative ? -value : value ; 
+	}
+
+	char buffer[LENGTH_NUMBER_BUFFER] ; 
+	size_t length = end - token < LENGTH_NUMBER_BUFFER ? end - token : LENGTH_NUMBER_BUFFER - 1 ; 
+	memcpy(buffer, token, length) ; 
+	buffer[length] = '\0' ; 
+	return strtod(buffer, NULL) ; 
+}
+
+static size_t parseValues(char* line, char* end, size_t** values, size_t** counts, arena* A) {
+	/* Parses the values on a line into an array allocated from the arena and returns their 
+	 * number. A token value:count represents count identical observations (see compressData). 
+	 * The counts are stored in counts, which is set to NULL when there are no such tokens. 
+	 */
+	size_t n = countTokens(line, end), i ; 
+	(*values) = arenaAlloc(A, n * sizeof(size_t)) ; 
+	(*counts) = (memchr(line, ':', end - line) != NULL) ? arenaAlloc(A, n * sizeof(size_t)) : NULL ; 
+
+	char* s = line ; 
+	char* token ; 
+	for (i = 0; i < n; i ++) {
+		token = nextToken(&s, end) ; 
+		(*values)[i] = parseInteger(&token, s) ; 
+		if ((*counts) != NULL) {
+			(*counts)[i] = 1 ; 
+			if (token < s && *token == ':') {
+				token ++ ; 
+				(*counts)[i] = parseInteger(&token, s) ; 
+			}
+		}
+	}
+	return n ; 
+}
+
+static double* parseProbabilities(char* line, char* end, size_t n, arena* A) {
+	/* Parses the first n probabilities on a line into an array allocated from the arena */
+	double* probabilities = arenaAlloc(A, n * sizeof(double)) ; 
+	char* s = line ; 
+	char* token ; 
 	size_t i ; 
 	for (i = 0; i < n; i ++) {
-		list[i] = 1.0 ; 
+		token = nextToken(&s, end) ; 
+		if (token == NULL) {
+			printf("ERROR: the observations file contains fewer probabilities than observations.\n") ; 
+			exit(EXIT_FAILURE) ; 
+		}
+		probabilities[i] = parseDouble(token, s) ; 
 	}
-	return list ; 
+	return probabilities ; 
 }
 
-size_t obtainVariant(FILE *fp, variant *v, parameters *p) {
+static char* nextDataLine(text_observations* T, char** end) {
+	/* Returns the next line of the data entry of a variant (see nextLine) */
+	char* line = nextLine(T, end) ; 
+	if (line == NULL) {
+		printf("ERROR: unexpected end of the observations file.\n") ; 
+		exit(EXIT_FAILURE) ; 
+	}
+	return line ; 
+}
+
+size_t obtainVariant(text_observations* T, variant *v, parameters *p) {
 	/* Returns variant info and stores it in v 
 	 * In case there is no variant anymore, the function returns END_OF_FILE_REACHED.
 	 * When the variant is of the wrong type (e.g., only deletions are wanted while
@@ -359,11 +676,26 @@ size_t obtainVariant(FILE *fp, variant *v, parameters *p) {
 	 * When the variant is too short, it returns VARIANT_TOO_SHORT. 
 	 * When the variant is valid, it outputs VALID_VARIANT. 
 	 */
-	char ch ; 
-	if(fscanf(fp, "%c%s%zd%zd%c", &(v->type), v->chromosome, &(v->position), &(v->length), &ch) != 5){
-			printf("End of file reached\n") ; 
-			return END_OF_FILE_REACHED ; 
-	}
+	char *line, *end, *type, *chromosome, *position, *length ; 
+	do { // empty lines at the end of the file are skipped
+		line = nextLine(T, &end) ; 
+		if (line == NULL) {
+			return END_OF_FILE_REACHED ; // reported by the writer (see smc_threads.c)
+		}
+		type = nextToken(&line, end) ; 
+	} while (type == NULL) ; 
+	chromosome 	= nextToken(&line, end) ; 
+	position 	= nextToken(&line, end) ; 
+	length 		= nextToken(&line, end) ; 
+	if (length == NULL) {
+		return END_OF_FILE_REACHED ; 
+	}
+	v->type 	= *type ; 
+	v->position 	= parseInteger(&position, end) ; 
+	v->length 	= parseInteger(&length, end) ; 
+	snprintf(v->chromosome, LENGTH_CHROM_BUFFER, "%.*s", (int) (position - chromosome), chromosome) ; 
+	v->chromosome[strcspn(v->chromosome, " \t\r")] = '\0' ; 
+
 	if (p->deletions_only == 1) {
 		if (v->type == '+') {return WRONG_VARIANT_TYPE ;} // an insertion, while only deletions are considered
 	}
@@ -375,98 +707,118 @@ size_t obtainVariant(FILE *fp, variant *v, parameters *p) {
 	return VALID_VARIANT ;
 }
 
-void skipLine (FILE *fp) {
-	char c ; 
-	do { 
-		c = fgetc(fp);
-	} while (c != '\n') ; 
+void skipDataEntry (text_observations* T) {
+	/* Skips the data entries for one variant */
+	char *end ; 
+	size_t i ;
+	for (i = 0; i < 8; i ++) {
+		nextDataLine(T, &end) ; 
+	}
 }
 
-void skipDataEntry (FILE *fp) {
-	size_t i = 0 ;
-	while (i < 8) {
-		if (fgetc(fp) == '\n') {
-			i ++ ; 
-		}
+static size_t obtainObservations(text_observations* T, short skip, short align_uncertainty_off, arena* A, size_t** values, double** probabilities, size_t** counts) {
+	/* Reads the two lines with the values and probabilities of one type of observations 
+	 * (insert sizes or split reads) and returns the number of observations. When skip is 1, 
+	 * the lines are skipped and there are no observations. 
+	 */
+	char *line, *end ; 
+	size_t n = 0 ; 
+	(*values) 		= NULL ; 
+	(*probabilities) 	= NULL ; 
+	(*counts) 		= NULL ; 
+
+	line = nextDataLine(T, &end) ; 
+	if (skip == 0) {
+		n = parseValues(line, end, values, counts, A) ; 
 	}
+	line = nextDataLine(T, &end) ; // a line of a stream is overwritten, so the values are parsed first
+	if (skip == 0) {
+		(*probabilities) = align_uncertainty_off ? returnListOfOnes(n, A) : parseProbabilities(line, end, n, A) ; 
+	}
+	return n ; 
 }
 
-data obtainData(FILE *fp, parameters *p) {
-	/* Returns the data for one VCF record */
+data obtainData(text_observations* T, parameters *p, arena* A) {
+	/* Returns the data for one VCF record. The observations are parsed directly from 
+	 * the file (see nextLine) into arrays allocated from the arena, which are released 
+	 * by resetArena. 
+	 */
 	data D ; 
-	char *buffer ; 
-
-	// read in the insert sizes from the healthy sample 
-	if (p->split_only) {
-		D.h_isize_n = 0 ; 
-		skipLine(fp) ; 
-		skipLine(fp) ; 
-	} else {
-		buffer = inputString(fp); 
-		D.h_isize = returnIntegerArray(buffer, &D.h_isize_n) ; 
-		if (p->align_uncertainty_off) {
-			skipLine(fp) ; 
-			D.h_isize_prob = returnListOfOnes(D.h_isize_n) ; 
-		} else {
-			buffer = inputString(fp) ;
-			D.h_isize_prob = returnProbabilities(buffer, D.h_isize_n) ; 
-		}
-	}
+	// insert sizes and split read observations from the healthy sample 
+	D.h_isize_n = obtainObservations(T, p->split_only, p->align_uncertainty_off, A, &D.h_isize, &D.h_isize_prob, &D.h_isize_count) ; 
+	D.h_split_n = obtainObservations(T, p->isize_only, p->align_uncertainty_off, A, &D.h_split, &D.h_split_prob, &D.h_split_count) ; 
+	// insert sizes and split read observations from the cancer sample 
+	D.c_isize_n = obtainObservations(T, p->split_only, p->align_uncertainty_off, A, &D.c_isize, &D.c_isize_prob, &D.c_isize_count) ; 
+	D.c_split_n = obtainObservations(T, p->isize_only, p->align_uncertainty_off, A, &D.c_split, &D.c_split_prob, &D.c_split_count) ; 
+	return D ; 
+}
 
-	// read in the split read observations from the healthy sample 
-	if (p->isize_only) {
-		D.h_split_n = 0 ; 
-		skipLine(fp) ; 
-		skipLine(fp) ; 
-	} else {
-		buffer = inputString(fp); 
-		D.h_split = returnIntegerArray(buffer, &D.h_split_n) ; 
-		if (p->align_uncertainty_off) {
-			skipLine(fp) ; 
-			D.h_split_prob = returnListOfOnes(D.h_split_n) ; 
-		} else {
-			buffer = inputString(fp) ;
-			D.h_split_prob = returnProbabilities(buffer, D.h_split_n) ; 
-		}
-	}
 
+/*
+ * One observation together with its count (see compressData)
+ */
+typedef struct {
+	size_t value ; 
+	double prob ; 
+	size_t count ; 
+} observation ; 
+
+static int compareObservations(const void* a, const void* b) {
+	/* Orders observations by value and probability */
+	const observation* x = (const observation*) a ; 
+	const observation* y = (const observation*) b ; 
+	if (x->value != y->value) {
+		return (x->value < y->value) ? -1 : 1 ; 
+	}
+	if (x->prob != y->prob) {
+		return (x->prob < y->prob) ? -1 : 1 ; 
+	}
+	return 0 ; 
+}
 
-	// read in the insert sizes from the cancer sample 
-	if (p->split_only) {
-		D.c_isize_n = 0 ; 
-		skipLine(fp) ; 
-		skipLine(fp) ; 
-	} else {
-		buffer = inputString(fp); 
-		D.c_isize = returnIntegerArray(buffer, &D.c_isize_n) ; 
-		if (p->align_uncertainty_off) {
-			skipLine(fp) ; 
-			D.c_isize_prob = returnListOfOnes(D.c_isize_n) ; 
-		} else {
-			buffer = inputString(fp) ;
-			D.c_isize_prob = returnProbabilities(buffer, D.c_isize_n) ; 
-		}
+static size_t compressObservations(size_t* values, double* probs, size_t* counts, size_t n, size_t** new_values, double** new_probs, size_t** new_counts, arena* A) {
+	/* Stores identical observations (the same value and probability) once together with their 
+	 * count in arrays allocated from the arena. Returns the number of distinct observations. 
+	 */
+	observation* obs 	= arenaAlloc(A, n * sizeof(observation)) ; 
+	(*new_values) 		= arenaAlloc(A, n * sizeof(size_t)) ; 
+	(*new_probs) 		= arenaAlloc(A, n * sizeof(double)) ; 
+	(*new_counts) 		= arenaAlloc(A, n * sizeof(size_t)) ; 
+
+	size_t i, m = 0 ; 
+	for (i = 0; i < n; i ++) {
+		obs[i].value 	= values[i] ; 
+		obs[i].prob 	= probs[i] ; 
+		obs[i].count 	= (counts != NULL) ? counts[i] : 1 ; 
 	}
+	qsort(obs, n, sizeof(observation), compareObservations) ; 
 
-	// read in the split read observations from the cancer sample 
-	if (p->isize_only) {
-		D.c_split_n = 0 ; 
-		skipLine(fp) ; 
-		skipLine(fp) ; 
-	} else {
-		buffer = inputString(fp); 
-		D.c_split = returnIntegerArray(buffer, &D.c_split_n) ; 
-		if (p->align_uncertainty_off) {
-			skipLine(fp) ; 
-			D.c_split_prob = returnListOfOnes(D.c_split_n) ; 
+	for (i = 0; i < n; i ++) {
+		if (m > 0 && compareObservations(&obs[i], &obs[i - 1]) == 0) { // same as the previous one
+			(*new_counts)[m - 1] += obs[i].count ; 
 		} else {
-			buffer = inputString(fp) ;
-			D.c_split_prob = returnProbabilities(buffer, D.c_split_n) ; 
+			(*new_values)[m] 	= obs[i].value ; 
+			(*new_probs)[m] 	= obs[i].prob ; 
+			(*new_counts)[m] 	= obs[i].count ; 
+			m ++ ; 
 		}
 	}
-	return D;
-} 
+	return m ; 
+}
 
+data compressData(data D, arena* A) {
+	/* Returns the data with identical observations (the same value and probability) stored 
+	 * once together with their count, so that the likelihood contains one term per distinct 
+	 * observation. The observations are ordered by value and probability. The arrays are 
+	 * allocated from the arena, i.e., they are released together with the data of the variant. 
+	 */
+	data C = D ; 
+	C.h_isize_n = compressObservations(D.h_isize, D.h_isize_prob, D.h_isize_count, D.h_isize_n, &C.h_isize, &C.h_isize_prob, &C.h_isize_count, A) ; 
+	C.h_split_n = compressObservations(D.h_split, D.h_split_prob, D.h_split_count, D.h_split_n, &C.h_split, &C.h_split_prob, &C.h_split_count, A) ; 
+	C.c_isize_n = compressObservations(D.c_isize, D.c_isize_prob, D.c_isize_count, D.c_isize_n, &C.c_isize, &C.c_isize_prob, &C.c_isize_count, A) ; 
+	C.c_split_n = compressObservations(D.c_split, D.c_split_prob, D.c_split_count, D.c_split_n, &C.c_split, &C.c_split_prob, &C.c_split_count, A) ; 
+	return C ; 
+}
 
 void printData (data D) {
 	/* Prints the data to the command line */
@@ -26,10 +26,18 @@
 #include <stddef.h>
 #include <unistd.h>
 #include <float.h>
+#include <stdint.h>
+#include <zlib.h>
 
-#define INITIAL_N_OBSERVATIONS 1000
+#define ARENA_BLOCK_SIZE 	65536 		/* initial # of bytes of an arena (see arena below) */
+#define ARENA_ALIGNMENT 	16 		/* allocations from an arena are aligned to this # of bytes */
+#define RELEASE_INTERVAL 	(1 << 23) 	/* # of bytes of a mapped text file after which the parsed pages are released */
 #define LENGTH_CHROM_BUFFER 32 		/* # of characters allocated for chromosome buffer */
 #define DELIM	"\t"			/* input file is tab-delimited */
+#define MAX_SIMPSON_PANELS 	1000 		/* max. # of panels of the adaptive quadrature (see integrate_likelihood) */
+
+#define SOLVER_BRENT 		0 	/* solvers for the MLE of c_vaf (see computeMLE) */
+#define SOLVER_NEWTON 		1 
 
 #define VALID_VARIANT 		0 
 #define END_OF_FILE_REACHED 	1
@@ -47,6 +55,12 @@ typedef struct {
 
 	size_t min_length ; 
 
+	/* Region (only variants in the region are considered) */
+	short region ; 			// 1 when a region is set
+	char* region_chromosome ; 
+	size_t region_start ; 
+	size_t region_end ; 
+
 	/* Model parameters */
 	double alpha ; 		// level of impurity
 	double eps_a ; 		// epsilon_a (same for deletions and insertions)
@@ -62,7 +76,11 @@ typedef struct {
 	/* parameters for the numerical methods */
 	size_t max_iter ; 
 	double epsabs ; 
-	size_t n_panels ; 
+	size_t n_panels ; 	// initial number of panels of the adaptive quadrature
+	double epsrel ; 	// relative tolerance of the adaptive quadrature
+	short solver ; 		// SOLVER_BRENT or SOLVER_NEWTON
+
+	size_t n_threads ; 	// number of worker threads (see smc_threads.h)
 } parameters ; 
 
 /* 
@@ -76,60 +94,119 @@ typedef struct {
 } variant ; 
 
 /*
- * Represents the data for one VCF record 
+ * Represents the data for one VCF record. Identical observations (the same value 
+ * and probability) can be stored once together with their count (see compressData). 
+ * The counts are NULL when every observation is stored separately. 
  */
 typedef struct {
 	// insert size data from the healthy sample
 	size_t* h_isize  ; 
 	double* h_isize_prob ; 
+	size_t* h_isize_count ; 
 	size_t h_isize_n ; 
 	// split read data from the healthy sample
 	size_t* h_split ; 
 	double* h_split_prob ; 
+	size_t* h_split_count ; 
 	size_t h_split_n ; 
 	// insert size data from the cancer sample
 	size_t* c_isize ; 
 	double* c_isize_prob ; 	
+	size_t* c_isize_count ; 
 	size_t c_isize_n ; 
 	// split read data from the cancer sample
 	size_t* c_split ; 
 	double* c_split_prob ; 
+	size_t* c_split_count ; 
 	size_t c_split_n  ; 
-	size_t delta ; 
+	double delta ; 	// difference in insert size caused by the indel (negative for insertions)
 } data ;
 
+/*
+ * Arena from which the data of one variant is allocated. Allocating only moves 
+ * a pointer; all the memory is released at once by resetArena when the next 
+ * variant is read. A variant that does not fit in the block allocates another 
+ * one; the next reset replaces the blocks by one block that is large enough, 
+ * so that the memory in use does not grow with the number of variants. 
+ */
+typedef struct arena_block {
+	struct arena_block* previous ; 	// the blocks that filled up since the last reset
+	size_t size ; 			// # of bytes that can be allocated from the block
+	size_t used ; 
+} arena_block ; 
+
+typedef struct {
+	arena_block* block ; 	// current block (NULL before the first allocation)
+	size_t allocated ; 	// # of bytes allocated since the last reset
+} arena ; 
+
+/*
+ * Observations file in the text format. Regular files are memory-mapped and 
+ * parsed in place; streams (standard input, BGZF-compressed files read with 
+ * zlib) are read line by line into one buffer that is reused. The observations 
+ * are stored in an arena (see obtainData), so that nothing is allocated per line. 
+ */
+typedef struct {
+	char* map ; 		// the mapped file (NULL when reading a stream)
+	size_t map_length ; 
+	size_t next ; 		// offset of the next line in the mapped file
+	size_t released ; 	// # of bytes of the mapped file that are released (see RELEASE_INTERVAL)
+	FILE* fp ; 		// the stream (NULL when the file is mapped)
+	gzFile gz ; 		// the compressed stream (NULL otherwise)
+	char* line ; 		// last line read from the stream
+	size_t line_size ; 	// # of bytes allocated for line
+} text_observations ; 
+
 /* Prints usage */
 void usage(const char *pname) ; 
 
 /* Parses the options from command line and returns a struct containing all parameters */
 void parse_arguments(parameters* p, char* filename, int argc, char **argv) ;
 
+/* Parses a region (chr or chr:start-end) and stores it in the parameters */
+void parseRegion(parameters* p, char* region) ; 
+
 /* Prints the parameters to command line */
 void print_parameters(parameters* p) ; 
 
 /* Reads in one line of unknown length */
 char *inputString(FILE* fp) ; 
 
-/* Converts a string into an array of integers of unknown length */
-size_t *returnIntegerArray(char* buffer, size_t* n_elem) ; 
+/* Initializes an empty arena */
+void initArena(arena* A) ; 
+
+/* Returns n bytes from the arena (aligned to ARENA_ALIGNMENT) */
+void* arenaAlloc(arena* A, size_t n) ; 
 
-/* Converts a string into an array of doubles of unknown length */
-double *returnDoubleArray(char* buffer, size_t* n_elem) ; 
+/* Releases everything allocated from the arena at once; the memory is reused for the next variant */
+void resetArena(arena* A) ; 
 
-/* Converts a string into an array of doubles of known length n */
-double *returnProbabilities(char* buffer, int n) ; 
+/* Frees the memory of the arena */
+void freeArena(arena* A) ; 
 
-/* Returns a list of n doubles initialized as ones */
-double *returnListOfOnes(size_t n) ; 
+/* Returns a list of n doubles initialized as ones (allocated from the arena) */
+double *returnListOfOnes(size_t n, arena* A) ; 
+
+/* Memory-maps an observations file in the text format. Returns NULL when the file cannot be opened. */
+text_observations* openTextObservations(const char* filename) ; 
+
+/* Reads the observations (text format) from a stream, e.g., standard input */
+text_observations* streamTextObservations(FILE* fp) ; 
+
+/* Unmaps the file or closes the stream */
+void closeTextObservations(text_observations* T) ; 
 
 /* Skips the data entries for one variant */
-void skipDataEntry (FILE *fp) ; 
+void skipDataEntry (text_observations* T) ; 
 
 /* Returns variant info (when available) */
-size_t obtainVariant(FILE *fp, variant *v, parameters *p) ; 
+size_t obtainVariant(text_observations* T, variant *v, parameters *p) ; 
+
+/* Returns the data for one VCF record (allocated from the arena) */
+data obtainData(text_observations* T, parameters *p, arena* A) ;
 
-/* Returns the data for one VCF record */
-data obtainData(FILE *fp, parameters *p) ;
+/* Returns the data with identical observations stored once together with their count (allocated from the arena) */
+data compressData(data D, arena* A) ; 
 
 /* Prints the data to the command line */
 void printData (data D) ;  
@@ -19,22 +19,199 @@
 
 #include "smc_likelihood.h"
 
-double f(double x, double mu, double std, size_t delta, double rate) {
+model returnModel(parameters* p, char type) {
+	/* Returns the model parameters for a variant of the given type ('+' or '-') */
+	model M ; 
+	M.alpha 	= p->alpha ; 
+	M.mu_h 		= p->mu_h ; 
+	M.sigma_h 	= p->sigma_h ; 
+	M.rate_h 	= p->rate_h ; 
+	M.mu_c 		= p->mu_c ; 
+	M.sigma_c 	= p->sigma_c ; 
+	M.rate_c 	= p->rate_c ; 
+	M.eps_a 	= p->eps_a ; 
+	M.eps_p 	= (type == '+') ? p->eps_p_ins : p->eps_p_del ; 
+	M.max_iter 	= p->max_iter ; 
+	M.epsabs 	= p->epsabs ; 
+	M.n_panels 	= p->n_panels ; 
+	M.epsrel 	= p->epsrel ; 
+	M.n_evaluations = 0 ; 
+	M.solver 	= p->solver ; 
+	M.n_iterations 	= 0 ; 
+	M.n_fallbacks 	= 0 ; 
+	M.cache 	= NULL ; // see newPMFCache and returnPMFTable
+	M.table 	= NULL ; 
+	return M ; 
+}
+
+static double f_normalization(double mu, double std, double delta, double rate) {
+	/* The normalization factor of f; depends on delta, but not on the insert size */
+	double d = delta ; 
+	return 0.5 / ( rate*(1.0 - 0.5*erfc((mu + 0.5)/std*M_SQRT1_2)) + (1.0 - rate)*(1.0 - 0.5*erfc((mu + d + 0.5)/std* M_SQRT1_2)) ) ; 
+}
+
+static double f_unnormalized(double x, double mu, double std, double delta, double rate) {
+	double d = delta ; 
+	return rate*( erfc((-x - 0.5 + mu)/std*M_SQRT1_2) - erfc((-x + 0.5 + mu)/std*M_SQRT1_2) ) + (1.0 - rate)*( erfc((-x - 0.5 + mu + d)/std*M_SQRT1_2) - erfc((-x + 0.5 + mu + d)/std*M_SQRT1_2) ) ;   
+}
+
+static double f0_normalization(double mu, double std) {
+	/* The normalization factor of f0 */
+	return 0.5 / (1.0 - 0.5*erfc((mu + 0.5)/std* M_SQRT1_2)) ; 
+}
+
+static double f0_unnormalized(double x, double mu, double std) {
+	return erfc((-x - 0.5 + mu)/std*M_SQRT1_2) - erfc((-x + 0.5 + mu)/std*M_SQRT1_2) ;   
+}
+
+double f(double x, double mu, double std, double delta, double rate) {
 	/* The PMF of the insert size distribution */
-	double d = (double) delta ; 
-	double prob = 0.5 / ( rate*(1.0 - 0.5*erfc((mu + 0.5)/std*M_SQRT1_2)) + (1.0 - rate)*(1.0 - 0.5*erfc((mu + d + 0.5)/std* M_SQRT1_2)) ) ;  // normalization factor
-	prob *= rate*( erfc((-x - 0.5 + mu)/std*M_SQRT1_2) - erfc((-x + 0.5 + mu)/std*M_SQRT1_2) ) + (1.0 - rate)*( erfc((-x - 0.5 + mu + d)/std*M_SQRT1_2) - erfc((-x + 0.5 + mu + d)/std*M_SQRT1_2) ) ;   
-	return prob ; 
+	return f_normalization(mu, std, delta, rate) * f_unnormalized(x, mu, std, delta, rate) ; 
 }
 
 double f0(double x, double mu, double std) {
 	/* The PMF of the insert size distribution when there is no indel (null distribution) */
-	double prob = 0.5 / (1.0 - 0.5*erfc((mu + 0.5)/std* M_SQRT1_2)) ;  // normalization factor
-	prob *= (erfc((-x - 0.5 + mu)/std*M_SQRT1_2) - erfc((-x + 0.5 + mu)/std*M_SQRT1_2))  ;   
-	return prob ; 
+	return f0_normalization(mu, std) * f0_unnormalized(x, mu, std) ; 
+}
+
+static double* returnListOfNaNs(size_t n) {
+	/* Returns a list of n doubles initialized as NAN (i.e., not computed yet) */
+	double *list = malloc(n * sizeof(double)) ; 
+	if (list == NULL) {
+		printf("ERROR: insufficient memory for allocation.\n") ; 
+		exit(EXIT_FAILURE) ; 
+	}
+	size_t i ; 
+	for (i = 0; i < n; i ++) {
+		list[i] = NAN ; 
+	}
+	return list ; 
+}
+
+static size_t tableLength(pmf_cache* cache, double delta) {
+	/* Returns the number of insert sizes covered by a table, i.e., up to mu + max(delta, 0) + PMF_TABLE_SIGMAS*sigma */
+	double n_h = cache->mu[HEALTHY] + fmax(delta, 0.0) + PMF_TABLE_SIGMAS * cache->sigma[HEALTHY] ; 
+	double n_c = cache->mu[CANCER] + fmax(delta, 0.0) + PMF_TABLE_SIGMAS * cache->sigma[CANCER] ; 
+	double n = fmin(fmax(n_h, n_c) + 1.0, PMF_CACHE_ENTRIES / 2) ; 
+	return (size_t) n ; 
+}
+
+pmf_cache* newPMFCache(parameters* p) {
+	/* Returns an empty cache of the insert size PMFs for the parameters p */
+	pmf_cache* cache = malloc(sizeof(pmf_cache)) ; 
+	if (cache == NULL) {
+		printf("ERROR: insufficient memory for allocation.\n") ; 
+		exit(EXIT_FAILURE) ; 
+	}
+	cache->mu[HEALTHY] 	= p->mu_h ; 
+	cache->sigma[HEALTHY] 	= p->sigma_h ; 
+	cache->rate[HEALTHY] 	= p->rate_h ; 
+	cache->mu[CANCER] 	= p->mu_c ; 
+	cache->sigma[CANCER] 	= p->sigma_c ; 
+	cache->rate[CANCER] 	= p->rate_c ; 
+	cache->n_tables 	= 0 ; 
+	cache->n_entries 	= 0 ; 
+	cache->clock 		= 0 ; 
+
+	// f0 does not depend on delta; one table suffices
+	cache->n0 			= tableLength(cache, 0.0) ; 
+	cache->normalization0[HEALTHY] 	= f0_normalization(p->mu_h, p->sigma_h) ; 
+	cache->normalization0[CANCER] 	= f0_normalization(p->mu_c, p->sigma_c) ; 
+	cache->values0[HEALTHY] 	= returnListOfNaNs(cache->n0) ; 
+	cache->values0[CANCER] 		= returnListOfNaNs(cache->n0) ; 
+	return cache ; 
+}
+
+static void freePMFTable(pmf_table* T) {
+	free(T->values[HEALTHY]) ; 
+	free(T->values[CANCER]) ; 
 }
 
-void likelihood (mpf_t* l_final, double h_vaf, double c_vaf, data D) {
+void freePMFCache(pmf_cache* cache) {
+	/* Frees the cache and all its tables */
+	size_t i ; 
+	for (i = 0; i < cache->n_tables; i ++) {
+		freePMFTable(&cache->tables[i]) ; 
+	}
+	free(cache->values0[HEALTHY]) ; 
+	free(cache->values0[CANCER]) ; 
+	free(cache) ; 
+}
+
+pmf_table* returnPMFTable(pmf_cache* cache, double delta) {
+	/* Returns the table of f for delta. When it is not in the cache, the least recently used 
+	 * tables are evicted until there is room for a new table (at most PMF_CACHE_TABLES tables 
+	 * and PMF_CACHE_ENTRIES values in total). The table remains valid until the next call. 
+	 */
+	size_t i, lru ; 
+	cache->clock ++ ; 
+	for (i = 0; i < cache->n_tables; i ++) {
+		if (cache->tables[i].delta == delta) {
+			cache->tables[i].last_used = cache->clock ; 
+			return &cache->tables[i] ; 
+		}
+	}
+
+	size_t n = tableLength(cache, delta) ; 
+	while (cache->n_tables > 0 && (cache->n_tables == PMF_CACHE_TABLES || cache->n_entries + 2*n > PMF_CACHE_ENTRIES)) {
+		lru = 0 ; 
+		for (i = 1; i < cache->n_tables; i ++) {
+			if (cache->tables[i].last_used < cache->tables[lru].last_used) lru = i ; 
+		}
+		cache->n_entries -= 2*cache->tables[lru].n ; 
+		freePMFTable(&cache->tables[lru]) ; 
+		cache->tables[lru] = cache->tables[-- cache->n_tables] ; // the last table takes its place
+	}
+
+	pmf_table* T 			= &cache->tables[cache->n_tables ++] ; 
+	T->delta 			= delta ; 
+	T->n 				= n ; 
+	T->last_used 			= cache->clock ; 
+	T->normalization[HEALTHY] 	= f_normalization(cache->mu[HEALTHY], cache->sigma[HEALTHY], delta, cache->rate[HEALTHY]) ; 
+	T->normalization[CANCER] 	= f_normalization(cache->mu[CANCER], cache->sigma[CANCER], delta, cache->rate[CANCER]) ; 
+	T->values[HEALTHY] 		= returnListOfNaNs(n) ; 
+	T->values[CANCER] 		= returnListOfNaNs(n) ; 
+	cache->n_entries 		+= 2*n ; 
+	return T ; 
+}
+
+double pmf(size_t x, size_t sample, double delta, model* M) {
+	/* Returns f(x) for the parameters of the sample (HEALTHY or CANCER). The value is taken 
+	 * from the table of the model (see returnPMFTable) when possible and computed otherwise. 
+	 */
+	pmf_table* T = M->table ; 
+	if (T != NULL && T->delta == delta && x < T->n && !isnan(T->values[sample][x])) {
+		return T->values[sample][x] ; 
+	}
+
+	double mu 	= (sample == HEALTHY) ? M->mu_h : M->mu_c ; 
+	double sigma 	= (sample == HEALTHY) ? M->sigma_h : M->sigma_c ; 
+	double rate 	= (sample == HEALTHY) ? M->rate_h : M->rate_c ; 
+	if (T == NULL || T->delta != delta || x >= T->n) {
+		return f(x, mu, sigma, delta, rate) ; 
+	}
+	T->values[sample][x] = T->normalization[sample] * f_unnormalized(x, mu, sigma, delta, rate) ; 
+	return T->values[sample][x] ; 
+}
+
+double pmf0(size_t x, size_t sample, model* M) {
+	/* Returns f0(x) for the parameters of the sample (HEALTHY or CANCER); see pmf */
+	pmf_cache* cache = M->cache ; 
+	if (cache != NULL && x < cache->n0 && !isnan(cache->values0[sample][x])) {
+		return cache->values0[sample][x] ; 
+	}
+
+	double mu 	= (sample == HEALTHY) ? M->mu_h : M->mu_c ; 
+	double sigma 	= (sample == HEALTHY) ? M->sigma_h : M->sigma_c ; 
+	if (cache == NULL || x >= cache->n0) {
+		return f0(x, mu, sigma) ; 
+	}
+	cache->values0[sample][x] = cache->normalization0[sample] * f0_unnormalized(x, mu, sigma) ; 
+	return cache->values0[sample][x] ; 
+}
+
+#ifdef USE_GMP
+void likelihood (mpf_t* l_final, double h_vaf, double c_vaf, data D, model* M) {
 	/* Determines the likelihood of h_vaf and c_vaf given the data D*/
 	mpf_t l, obs_l ; // likelihood and likelihood for one observation 
 	size_t i ; 
@@ -45,22 +222,26 @@ void likelihood (mpf_t* l_final, double h_vaf, double c_vaf, data D) {
 	mpf_set_ui(l, 1) ;
 	
 	for (i = 0; i < D.h_isize_n; i ++) {
-		mpf_set_d(obs_l, D.h_isize_prob[i] * (h_vaf*f(D.h_isize[i], MU_H, SIGMA_H, D.delta, RATE_H) + (1.0 - h_vaf)*f0(D.h_isize[i], MU_H, SIGMA_H)) + (1.0 - D.h_isize_prob[i])) ; 
+		mpf_set_d(obs_l, D.h_isize_prob[i] * (h_vaf*pmf(D.h_isize[i], HEALTHY, D.delta, M) + (1.0 - h_vaf)*pmf0(D.h_isize[i], HEALTHY, M)) + (1.0 - D.h_isize_prob[i])) ; 
+		mpf_pow_ui(obs_l, obs_l, D.h_isize_count[i]) ; 
 		mpf_mul(l, l, obs_l) ; 
 	}
 
 	for (i = 0; i < D.h_split_n; i ++) {
-		mpf_set_d(obs_l, D.h_split_prob[i] * (h_vaf*(D.h_split[i] * (1.0 - EPS_P) + (1 - D.h_split[i]) * EPS_P) + (1.0 - h_vaf)*(D.h_split[i]*EPS_A + (1.0 - D.h_split[i])*(1.0 - EPS_A))) + (1.0 - D.h_split_prob[i])) ; 
+		mpf_set_d(obs_l, D.h_split_prob[i] * (h_vaf*(D.h_split[i] * (1.0 - M->eps_p) + (1 - D.h_split[i]) * M->eps_p) + (1.0 - h_vaf)*(D.h_split[i]*M->eps_a + (1.0 - D.h_split[i])*(1.0 - M->eps_a))) + (1.0 - D.h_split_prob[i])) ; 
+		mpf_pow_ui(obs_l, obs_l, D.h_split_count[i]) ; 
 		mpf_mul(l, l, obs_l) ; 
 	}
 
 	for (i = 0; i < D.c_isize_n; i ++) {
-		mpf_set_d(obs_l, D.c_isize_prob[i] * (ALPHA * (h_vaf*f(D.c_isize[i], MU_H, SIGMA_H, D.delta, RATE_H) + (1.0 - h_vaf)*f0(D.c_isize[i], MU_H, SIGMA_H)) + (1.0 - ALPHA) * (c_vaf*f(D.c_isize[i], MU_C, SIGMA_C, D.delta, RATE_C) + (1.0 - c_vaf)*f0(D.c_isize[i], MU_C, SIGMA_C))) + (1.0 - D.c_isize_prob[i])) ; 
+		mpf_set_d(obs_l, D.c_isize_prob[i] * (M->alpha * (h_vaf*pmf(D.c_isize[i], HEALTHY, D.delta, M) + (1.0 - h_vaf)*pmf0(D.c_isize[i], HEALTHY, M)) + (1.0 - M->alpha) * (c_vaf*pmf(D.c_isize[i], CANCER, D.delta, M) + (1.0 - c_vaf)*pmf0(D.c_isize[i], CANCER, M))) + (1.0 - D.c_isize_prob[i])) ; 
+		mpf_pow_ui(obs_l, obs_l, D.c_isize_count[i]) ; 
 		mpf_mul(l, l, obs_l) ; 
 	}
 
 	for (i = 0; i < D.c_split_n; i ++) {
-		mpf_set_d(obs_l, D.c_split_prob[i] * (ALPHA * (h_vaf*(D.c_split[i] * (1.0 - EPS_P) + (1 - D.c_split[i]) * EPS_P) + (1.0 - h_vaf)*(D.c_split[i]*EPS_A + (1.0 - D.c_split[i])*(1.0 - EPS_A))) + (1.0 - ALPHA) * (c_vaf*(D.c_split[i] * (1.0 - EPS_P) + (1 - D.c_split[i]) * EPS_P) + (1.0 - c_vaf)*(D.c_split[i]*EPS_A + (1.0 - D.c_split[i])*(1.0 - EPS_A)))) + (1.0 - D.c_split_prob[i])) ; 
+		mpf_set_d(obs_l, D.c_split_prob[i] * (M->alpha * (h_vaf*(D.c_split[i] * (1.0 - M->eps_p) + (1 - D.c_split[i]) * M->eps_p) + (1.0 - h_vaf)*(D.c_split[i]*M->eps_a + (1.0 - D.c_split[i])*(1.0 - M->eps_a))) + (1.0 - M->alpha) * (c_vaf*(D.c_split[i] * (1.0 - M->eps_p) + (1 - D.c_split[i]) * M->eps_p) + (1.0 - c_vaf)*(D.c_split[i]*M->eps_a + (1.0 - D.c_split[i])*(1.0 - M->eps_a)))) + (1.0 - D.c_split_prob[i])) ; 
+		mpf_pow_ui(obs_l, obs_l, D.c_split_count[i]) ; 
 		mpf_mul(l, l, obs_l) ; 
 	}
 
@@ -68,60 +249,178 @@ void likelihood (mpf_t* l_final, double h_vaf, double c_vaf, data D) {
 }
 
 
-void integrate_likelihood(mpf_t* I_final, double h_vaf, data D) {
-	/* Approximates the integral of the likelihood function for fixed h_vaf while c_vaf varies over the unit interval. 
-	 * We use the trapezoidal rule with N equally spaced panels. 
+/*
+ * A panel [a,b] of the adaptive quadrature (see integrate_likelihood) 
+ */
+typedef struct {
+	double a ; 
+	double b ; 
+	mpf_t f[5] ; 	// likelihood at a, (3a + b)/4, (a + b)/2, (a + 3b)/4 and b
+	mpf_t S ; 	// Simpson's rule for both halves (with Richardson extrapolation)
+	mpf_t error ; 	// estimated error of S
+} simpson_panel ; 
+
+static void simpson(mpf_t S, mpf_t fa, mpf_t fm, mpf_t fb, double width) {
+	/* Simpson's rule for a panel of the given width: S = (fa + 4*fm + fb) * width / 6 */
+	mpf_t w ; 
+	mpf_init(w) ; 
+	mpf_mul_ui(S, fm, 4) ; 
+	mpf_add(S, S, fa) ; 
+	mpf_add(S, S, fb) ; 
+	mpf_set_d(w, width / 6.0) ; 
+	mpf_mul(S, S, w) ; 
+	mpf_clear(w) ; 
+}
+
+static void evaluatePanel(simpson_panel* P, double h_vaf, data D, model* M) {
+	/* Evaluates the likelihood at the quarter points of the panel (the endpoints and midpoint are known) 
+	 * and determines the integral over the panel and its error by comparing Simpson's rule for the whole 
+	 * panel with the one for both halves. 
 	 */
-	mpf_t I, l, step_size, two; 
-	size_t i ; 
+	mpf_t whole, halves ; 
+	mpf_init(whole) ; 
+	mpf_init(halves) ; 
+
+	likelihood(&P->f[1], h_vaf, (3.0*P->a + P->b) / 4.0, D, M) ; 
+	likelihood(&P->f[3], h_vaf, (P->a + 3.0*P->b) / 4.0, D, M) ; 
+	M->n_evaluations += 2 ; 
+
+	simpson(whole, P->f[0], P->f[2], P->f[4], P->b - P->a) ; 
+	simpson(halves, P->f[0], P->f[1], P->f[2], (P->b - P->a) / 2.0) ; 
+	simpson(P->S, P->f[2], P->f[3], P->f[4], (P->b - P->a) / 2.0) ; 
+	mpf_add(halves, halves, P->S) ; 
+
+	mpf_sub(P->error, halves, whole) ; 
+	mpf_div_ui(P->error, P->error, 15) ; 
+	mpf_add(P->S, halves, P->error) ; 
+	mpf_abs(P->error, P->error) ; 
+
+	mpf_clear(whole) ; 
+	mpf_clear(halves) ; 
+}
 
-	// initialize and set area and likelihood
-	mpf_init(I) ; // approximate area 
-	mpf_init(l) ; // likelihood
-  	mpf_init(step_size) ; 
-	mpf_init(two) ; 
-	
-	mpf_set_d(I, 0) ;
-	mpf_set_d(step_size, 1.0 / (double)N_PANELS) ; 
-	mpf_set_ui(two, 2) ; 
-
-	likelihood(&l, h_vaf, 0.0, D) ; // compute likelihood at c_vaf = 0	
-	mpf_add(I, I, l) ; 
-	likelihood(&l, h_vaf, 1.0, D) ; // compute likelihood at c_vaf = 1	
-	mpf_add(I, I, l) ; 
-	
-	// all the points between 0 and 1 
-	for (i = 1; i < N_PANELS; i ++) {
-		likelihood(&l, h_vaf, i / (double)N_PANELS, D) ;
-		mpf_mul(l, l, two) ; // multiply the likelihood with 2
-		mpf_add(I, I, l) ; 
+static void initPanel(simpson_panel* P, double a, double b) {
+	/* Initializes a panel */
+	size_t j ; 
+	P->a = a ; 
+	P->b = b ; 
+	for (j = 0; j < 5; j ++) {
+		mpf_init(P->f[j]) ; 
 	}
+	mpf_init(P->S) ; 
+	mpf_init(P->error) ; 
+}
 
-	// determine normalization constant (stored in step_size)
-	mpf_div(step_size, step_size, two) ; 
-	mpf_mul(I, I, step_size) ; // normalize
+static void clearPanel(simpson_panel* P) {
+	/* Frees the panel */
+	size_t j ; 
+	for (j = 0; j < 5; j ++) {
+		mpf_clear(P->f[j]) ; 
+	}
+	mpf_clear(P->S) ; 
+	mpf_clear(P->error) ; 
+}
+
+void integrate_likelihood(mpf_t* I_final, mpf_t* l_zero, double h_vaf, data D, model* M) {
+	/* Approximates the integral of the likelihood function for fixed h_vaf while c_vaf varies over the unit interval. 
+	 * We use globally adaptive Simpson quadrature: the unit interval is divided in N equally spaced panels, after 
+	 * which the panel with the largest estimated error is halved until the total error is at most epsrel times the 
+	 * integral (or MAX_SIMPSON_PANELS is reached). The likelihood is unimodal in c_vaf (it is a product of factors 
+	 * that are linear in c_vaf), so that the evaluations concentrate around its peak. The likelihood at c_vaf = 0 
+	 * is stored in l_zero (unless NULL). 
+	 */
+	size_t n = M->n_panels ; 
+	simpson_panel *panels = malloc(MAX_SIMPSON_PANELS * sizeof(simpson_panel)) ; 
+	if (panels == NULL) {
+		printf("ERROR: insufficient memory for allocation.\n") ; 
+		exit(EXIT_FAILURE) ; 
+	}
+	mpf_t I, error, tol ; 
+	size_t i, worst ; 
+	double mid ; 
+
+	mpf_init(I) ; 
+	mpf_init(error) ; 
+	mpf_init(tol) ; 
+
+	// initial panels 
+	for (i = 0; i < n; i ++) {
+		initPanel(&panels[i], i / (double)n, (i + 1) / (double)n) ; 
+		if (i == 0) {
+			likelihood(&panels[i].f[0], h_vaf, 0.0, D, M) ; 
+			M->n_evaluations ++ ; 
+		} else {
+			mpf_set(panels[i].f[0], panels[i - 1].f[4]) ; 
+		}
+		likelihood(&panels[i].f[2], h_vaf, (i + 0.5) / (double)n, D, M) ; 
+		likelihood(&panels[i].f[4], h_vaf, (i + 1) / (double)n, D, M) ; 
+		M->n_evaluations += 2 ; 
+		evaluatePanel(&panels[i], h_vaf, D, M) ; 
+	}
+
+	while (1) {
+		mpf_set_ui(I, 0) ; 
+		mpf_set_ui(error, 0) ; 
+		worst = 0 ; 
+		for (i = 0; i < n; i ++) {
+			mpf_add(I, I, panels[i].S) ; 
+			mpf_add(error, error, panels[i].error) ; 
+			if (mpf_cmp(panels[i].error, panels[worst].error) > 0) {
+				worst = i ; 
+			}
+		}
+		mpf_set_d(tol, M->epsrel) ; 
+		mpf_mul(tol, tol, I) ; 
+		if (mpf_cmp(error, tol) <= 0 || n == MAX_SIMPSON_PANELS) {
+			break ; 
+		}
+
+		// halve the panel with the largest error; the new panel is the right half
+		mid = (panels[worst].a + panels[worst].b) / 2.0 ; 
+		initPanel(&panels[n], mid, panels[worst].b) ; 
+		mpf_set(panels[n].f[0], panels[worst].f[2]) ; 
+		mpf_set(panels[n].f[2], panels[worst].f[3]) ; 
+		mpf_set(panels[n].f[4], panels[worst].f[4]) ; 
+		panels[worst].b = mid ; 
+		mpf_set(panels[worst].f[4], panels[worst].f[2]) ; 
+		mpf_set(panels[worst].f[2], panels[worst].f[1]) ; 
+		evaluatePanel(&panels[worst], h_vaf, D, M) ; 
+		evaluatePanel(&panels[n], h_vaf, D, M) ; 
+		n ++ ; 
+	}
 
 	mpf_set((*I_final), I) ; 
+	if (l_zero != NULL) {
+		mpf_set((*l_zero), panels[0].f[0]) ; // the panel at c_vaf = 0 is never halved into a new panel
+	}
+
+	for (i = 0; i < n; i ++) {
+		clearPanel(&panels[i]) ; 
+	}
+	free(panels) ; 
+	mpf_clear(I) ; 
+	mpf_clear(error) ; 
+	mpf_clear(tol) ; 
 }
 
 /* Approximates the posterior probabilities of the hypotheses 'somatic', 'germline' and 'not present' */
-void determinePosteriorProbabilities(double* p_somatic, double* p_germline, double* p_not_present, data D) {
+void determinePosteriorProbabilities(double* p_somatic, double* p_germline, double* p_not_present, data D, coefficients* C, model* M) {
+	/* The integrals are approximated with adaptive Simpson quadrature (the coefficients C are not used) */
 	mpf_t ps, pg, pnp ; // posterior probabilities (s - somatic, g - germline, np - not present)
 	mpf_t I ; // integral
+	(void) C ; // only used in the default build
 
 	mpf_init(ps) ; 
 	mpf_init(pg) ; 
 	mpf_init(pnp) ;
 	mpf_init(I) ;
 
-	likelihood (&pnp, 0.0, 0.0, D) ; 
-	mpf_div_ui(pnp, pnp, 3) ; 
-
-	integrate_likelihood(&ps, 0.0, D) ; 
+	integrate_likelihood(&ps, &pnp, 0.0, D, M) ; // the likelihood at h_vaf = c_vaf = 0 is evaluated for the integral
 	mpf_div_ui(ps, ps, 9) ; 
+	mpf_div_ui(pnp, pnp, 3) ; 
 
-	integrate_likelihood(&pg, 0.5, D) ;
-	integrate_likelihood(&I, 1.0, D) ;
+	integrate_likelihood(&pg, NULL, 0.5, D, M) ;
+	integrate_likelihood(&I, NULL, 1.0, D, M) ;
 	mpf_add(pg, pg, I) ; 
 	mpf_div_ui(pg, pg, 9) ; 
 
@@ -139,150 +438,267 @@ void determinePosteriorProbabilities(double* p_somatic, double* p_germline, doub
 	(*p_not_present) = mpf_get_d(pnp) ;
 }
 
+#else
 
-double loglikelihood(double h_vaf, double c_vaf, data D) {
-	double logl = 0.0 ;
+/* Determines the posterior probabilities of the hypotheses 'somatic', 'germline' and 'not present' */
+void determinePosteriorProbabilities(double* p_somatic, double* p_germline, double* p_not_present, data D, coefficients* C, model* M) {
+	/* The (unnormalized) posterior probabilities are computed in log space from the coefficients C 
+	 * (for h_vaf = 0, 0.5 and 1; see computeCoefficients) and normalized with the log-sum-exp trick, 
+	 * so that plain doubles suffice (see also USE_GMP in CMakeLists.txt). 
+	 */
+	double log_ps, log_pg, log_pnp ; // log posterior probabilities (s - somatic, g - germline, np - not present)
+	double log_I ; // log of the normalization constant
+	(void) D ; // only used in the USE_GMP build
+	(void) M ;
+
+	log_pnp = logl_coefficients(0.0, &C[0]) - log(3.0) ; 
+	log_ps 	= log_integrate_likelihood(&C[0]) - log(9.0) ; 
+	log_pg 	= logAddExp(log_integrate_likelihood(&C[1]), log_integrate_likelihood(&C[2])) - log(9.0) ; 
+
+	// compute normalization constant
+	log_I = logAddExp(logAddExp(log_ps, log_pg), log_pnp) ; 
+
+	// normalize probabilities
+	(*p_somatic) = exp(log_ps - log_I) ;   
+	(*p_germline) = exp(log_pg - log_I) ;
+	(*p_not_present) = exp(log_pnp - log_I) ;
+}
+
+#endif
+
+double logAddExp(double x, double y) {
+	/* Returns log(exp(x) + exp(y)) without leaving log space */
+	if (x == -INFINITY) 
+		return y ; 
+	if (y == -INFINITY) 
+		return x ; 
+	if (x > y) 
+		return x + log1p(exp(y - x)) ; 
+	return y + log1p(exp(x - y)) ; 
+}
+
+static void addCoefficient(coefficients* C, double A, double B, size_t count) {
+	/* Adds the factor (A + B*c_vaf)^count to the likelihood */
+	if (B == 0.0) { // does not depend on c_vaf
+		C->log_constant += count * log(A) ; 
+	} else {
+		C->A[C->n] 	= A ; 
+		C->B[C->n] 	= B ; 
+		C->count[C->n] 	= count ; 
+		C->n ++ ; 
+		C->degree += count ; 
+	}
+}
+
+void computeCoefficients(coefficients* C, double h_vaf, data D, model* M) {
+	/* Reduces the likelihood for the given h_vaf to a constant and the coefficients A_i and B_i, such that 
+	 *
+	 * 	loglikelihood(h_vaf, c_vaf, D) = log_constant + sum_i count_i * log(A_i + B_i*c_vaf)
+	 * 
+	 * The observations of the healthy sample only contribute to the constant. 
+	 */
+	double obs_h, obs_c0, obs_c1 ; // likelihood of an observation of the cancer sample given the healthy cells, c_vaf = 0 and c_vaf = 1
 	size_t i ; 
+
+	C->h_vaf 	= h_vaf ; 
+	C->log_constant = 0.0 ; 
+	C->n 		= 0 ; 
+	C->degree 	= 0 ; 
+	C->n_cached 	= 0 ; 
+	C->A 		= malloc((D.c_isize_n + D.c_split_n + 1) * sizeof(double)) ; 
+	C->B 		= malloc((D.c_isize_n + D.c_split_n + 1) * sizeof(double)) ; 
+	C->count 	= malloc((D.c_isize_n + D.c_split_n + 1) * sizeof(size_t)) ; 
+	if (C->A == NULL || C->B == NULL || C->count == NULL) {
+		printf("ERROR: insufficient memory for allocation.\n") ; 
+		exit(EXIT_FAILURE) ; 
+	}
+
 	// walk through all insert size observations from the healthy sample 
 	for (i = 0; i < D.h_isize_n; i ++) {
-		logl += log(D.h_isize_prob[i] * (h_vaf*f(D.h_isize[i], MU_H, SIGMA_H, D.delta, RATE_H) + (1.0 - h_vaf)*f0(D.h_isize[i], MU_H, SIGMA_H)) + (1.0 - D.h_isize_prob[i])) ; 
+		C->log_constant += D.h_isize_count[i] * log(D.h_isize_prob[i] * (h_vaf*pmf(D.h_isize[i], HEALTHY, D.delta, M) + (1.0 - h_vaf)*pmf0(D.h_isize[i], HEALTHY, M)) + (1.0 - D.h_isize_prob[i])) ; 
 	}
 	
 	// walk through all split observations from the healthy sample 
 	for (i = 0; i < D.h_split_n; i ++) {
-		logl += log(D.h_split_prob[i] * (h_vaf*(D.h_split[i] * (1.0 - EPS_P) + (1 - D.h_split[i]) * EPS_P) + (1.0 - h_vaf)*(D.h_split[i]*EPS_A + (1.0 - D.h_split[i])*(1.0 - EPS_A))) + (1.0 - D.h_split_prob[i])) ; 
+		C->log_constant += D.h_split_count[i] * log(D.h_split_prob[i] * (h_vaf*(D.h_split[i] * (1.0 - M->eps_p) + (1 - D.h_split[i]) * M->eps_p) + (1.0 - h_vaf)*(D.h_split[i]*M->eps_a + (1.0 - D.h_split[i])*(1.0 - M->eps_a))) + (1.0 - D.h_split_prob[i])) ; 
 	}
 
 	// walk through all insert size observations from the cancer sample 
 	for (i = 0; i < D.c_isize_n; i ++) {
-		logl += log(D.c_isize_prob[i] * (ALPHA * (h_vaf*f(D.c_isize[i], MU_H, SIGMA_H, D.delta, RATE_H) + (1.0 - h_vaf)*f0(D.c_isize[i], MU_H, SIGMA_H)) + (1.0 - ALPHA) * (c_vaf*f(D.c_isize[i], MU_C, SIGMA_C, D.delta, RATE_C) + (1.0 - c_vaf)*f0(D.c_isize[i], MU_C, SIGMA_C))) + (1.0 - D.c_isize_prob[i])) ; 
+		obs_h 	= h_vaf*pmf(D.c_isize[i], HEALTHY, D.delta, M) + (1.0 - h_vaf)*pmf0(D.c_isize[i], HEALTHY, M) ; 
+		obs_c1 	= pmf(D.c_isize[i], CANCER, D.delta, M) ; 
+		obs_c0 	= pmf0(D.c_isize[i], CANCER, M) ; 
+		addCoefficient(C, D.c_isize_prob[i] * (M->alpha * obs_h + (1.0 - M->alpha) * obs_c0) + (1.0 - D.c_isize_prob[i]), D.c_isize_prob[i] * (1.0 - M->alpha) * (obs_c1 - obs_c0), D.c_isize_count[i]) ; 
 	}
 
 	// walk through all split observations from the cancer sample
 	for (i = 0; i < D.c_split_n; i ++) {
-		logl += log(D.c_split_prob[i] * (ALPHA * (h_vaf*(D.c_split[i] * (1.0 - EPS_P) + (1 - D.c_split[i]) * EPS_P) + (1.0 - h_vaf)*(D.c_split[i]*EPS_A + (1.0 - D.c_split[i])*(1.0 - EPS_A))) + (1.0 - ALPHA) * (c_vaf*(D.c_split[i] * (1.0 - EPS_P) + (1 - D.c_split[i]) * EPS_P) + (1.0 - c_vaf)*(D.c_split[i]*EPS_A + (1.0 - D.c_split[i])*(1.0 - EPS_A)))) + (1.0 - D.c_split_prob[i])) ; 
+		obs_c1 	= D.c_split[i] * (1.0 - M->eps_p) + (1 - D.c_split[i]) * M->eps_p ; 
+		obs_c0 	= D.c_split[i]*M->eps_a + (1.0 - D.c_split[i])*(1.0 - M->eps_a) ; 
+		obs_h 	= h_vaf*obs_c1 + (1.0 - h_vaf)*obs_c0 ; 
+		addCoefficient(C, D.c_split_prob[i] * (M->alpha * obs_h + (1.0 - M->alpha) * obs_c0) + (1.0 - D.c_split_prob[i]), D.c_split_prob[i] * (1.0 - M->alpha) * (obs_c1 - obs_c0), D.c_split_count[i]) ; 
 	}
-
-	return logl ; 
 }
 
-double logl_h_vaf1(double c_vaf, data D) {
-	double logl = 0.0 ;
+void freeCoefficients(coefficients* C) {
+	/* Frees the coefficients */
+	free(C->A) ; 
+	free(C->B) ; 
+	free(C->count) ; 
+}
 
+double logl_coefficients(double c_vaf, coefficients* C) {
+	/* Returns the loglikelihood of c_vaf (and C->h_vaf). The first LOGL_CACHE_SIZE values 
+	 * are kept in C, so that they are computed only once (see prepareMinimization). 
+	 */
 	size_t i ; 
-	// walk through all insert size observations from the healthy sample 
-	for (i = 0; i < D.h_isize_n; i ++) {
-		logl += log(D.h_isize_prob[i] * (.5*f(D.h_isize[i], MU_H, SIGMA_H, D.delta, RATE_H) + .5*f0(D.h_isize[i], MU_H, SIGMA_H)) + (1.0 - D.h_isize_prob[i])) ; 
-	}
-	
-	// walk through all split observations from the healthy sample 
-	for (i = 0; i < D.h_split_n; i ++) {
-		logl += log(D.h_split_prob[i] * (.5*(D.h_split[i] * (1.0 - EPS_P) + (1 - D.h_split[i]) * EPS_P) + .5*(D.h_split[i]*EPS_A + (1.0 - D.h_split[i])*(1.0 - EPS_A))) + (1.0 - D.h_split_prob[i])) ; 
+	for (i = 0; i < C->n_cached; i ++) {
+		if (C->cached_c_vaf[i] == c_vaf) {
+			return C->cached_logl[i] ; 
+		}
 	}
 
-	// walk through all insert size observations from the cancer sample 
-	for (i = 0; i < D.c_isize_n; i ++) {
-		logl += log(D.c_isize_prob[i] * (ALPHA * (.5*f(D.c_isize[i], MU_H, SIGMA_H, D.delta, RATE_H) + .5*f0(D.c_isize[i], MU_H, SIGMA_H)) + (1.0 - ALPHA) * (c_vaf*f(D.c_isize[i], MU_C, SIGMA_C, D.delta, RATE_C) + (1.0 - c_vaf)*f0(D.c_isize[i], MU_C, SIGMA_C))) + (1.0 - D.c_isize_prob[i])) ; 
+	double logl = C->log_constant ; 
+	for (i = 0; i < C->n; i ++) {
+		logl += C->count[i] * log(C->A[i] + C->B[i] * c_vaf) ; 
 	}
 
-	// walk through all split observations from the cancer sample
-	for (i = 0; i < D.c_split_n; i ++) {
-		logl += log(D.c_split_prob[i] * (ALPHA * (.5*(D.c_split[i] * (1.0 - EPS_P) + (1 - D.c_split[i]) * EPS_P) + .5*(D.c_split[i]*EPS_A + (1.0 - D.c_split[i])*(1.0 - EPS_A))) + (1.0 - ALPHA) * (c_vaf*(D.c_split[i] * (1.0 - EPS_P) + (1 - D.c_split[i]) * EPS_P) + (1.0 - c_vaf)*(D.c_split[i]*EPS_A + (1.0 - D.c_split[i])*(1.0 - EPS_A)))) + (1.0 - D.c_split_prob[i])) ; 
+	if (C->n_cached < LOGL_CACHE_SIZE) {
+		C->cached_c_vaf[C->n_cached] 	= c_vaf ; 
+		C->cached_logl[C->n_cached] 	= logl ; 
+		C->n_cached ++ ; 
 	}
-
 	return logl ; 
 }
 
+void derivatives_coefficients(double c_vaf, coefficients* C, double* d1, double* d2) {
+	/* Determines the first and second derivative of the loglikelihood of c_vaf (and C->h_vaf), i.e., 
+	 * 
+	 * 	d1 = sum_i count_i * B_i / (A_i + B_i*c_vaf) 	and 	d2 = -sum_i count_i * (B_i / (A_i + B_i*c_vaf))^2
+	 * 
+	 * The second derivative is never positive: the loglikelihood is concave in c_vaf. 
+	 */
+	double r ; 
+	size_t i ; 
+	(*d1) = 0.0 ; 
+	(*d2) = 0.0 ; 
+	for (i = 0; i < C->n; i ++) {
+		r = C->B[i] / (C->A[i] + C->B[i] * c_vaf) ; 
+		(*d1) += C->count[i] * r ; 
+		(*d2) -= C->count[i] * r * r ; 
+	}
+}
 
-double logl_h_vaf0 (double c_vaf, data D) {
-	double logl = 0.0 ; 
-	size_t i; 
-	// walk through all insert size observations from the healthy sample 
-	for (i = 0; i < D.h_isize_n; i ++) {
-		logl += log(D.h_isize_prob[i] * f0(D.h_isize[i], MU_H, SIGMA_H) + (1.0 - D.h_isize_prob[i])) ; 
+double log_integrate_likelihood(coefficients* C) {
+	/* Returns the log of the integral of the likelihood function for fixed h_vaf while c_vaf varies over 
+	 * the unit interval. The integral is exact: the likelihood is a polynomial in c_vaf, namely the product 
+	 * of the factors A_i + B_i*c = A_i*(1 - c) + (A_i + B_i)*c. The product of the first m factors is 
+	 * built up in the Bernstein basis of degree m, 
+	 * 
+	 * 	sum_k beta_k * binom(m, k) * c^k * (1 - c)^(m - k), 
+	 * 
+	 * of which the integral over [0,1] is the mean of the coefficients beta_k. A factor that occurs 
+	 * count_i times (see compressData) is multiplied count_i times. Since every factor is 
+	 * nonnegative on [0,1], all coefficients are nonnegative and there is no cancellation. The coefficients 
+	 * are divided by the largest one while multiplying with the next factor (the scale is kept in log 
+	 * space) and negligible coefficients at both ends are dropped. 
+	 */
+	if (C->log_constant == -INFINITY || C->degree == 0) {
+		return C->log_constant ; 
 	}
-	
-	// walk through all split observations from the healthy sample 
-	for (i = 0; i < D.h_split_n; i ++) {
-		logl += log(D.h_split_prob[i] * (D.h_split[i]*EPS_A + (1.0 - D.h_split[i])*(1.0 - EPS_A)) + (1.0 - D.h_split_prob[i])) ; 
+
+	double *beta = malloc((C->degree + 1) * sizeof(double)) ; 
+	if (beta == NULL) {
+		printf("ERROR: insufficient memory for allocation.\n") ; 
+		exit(EXIT_FAILURE) ; 
 	}
 
-	// walk through all insert size observations from the cancer sample 
-	for (i = 0; i < D.c_isize_n; i ++) {
-		logl += log(D.c_isize_prob[i] * (ALPHA*f0(D.c_isize[i], MU_H, SIGMA_H) + (1.0 - ALPHA) * (c_vaf*f(D.c_isize[i], MU_C, SIGMA_C, D.delta, RATE_C) + (1.0 - c_vaf)*f0(D.c_isize[i], MU_C, SIGMA_C))) + (1.0 - D.c_isize_prob[i])) ; 
+	double log_scale = C->log_constant ; 
+	double scale = 1.0 ; // 1 / largest coefficient
+	double a, b, max, sum = 0.0 ; 
+	size_t lo = 0, hi = 0 ; // beta[lo..hi] are the coefficients that are not negligible
+	size_t i, j, m = 0, k ; // m is the degree of the product so far
+
+	beta[0] = 1.0 ; 
+	for (i = 0; i < C->n; i ++) for (j = 0; j < C->count[i]; j ++, m ++) { // multiply with the (m+1)-th factor a*(1 - c) + b*c
+		a = scale * C->A[i] / (m + 1) ; 
+		b = scale * (C->A[i] + C->B[i]) / (m + 1) ;
+		beta[hi + 1] = 0.0 ; 
+		max = 0.0 ; 
+		for (k = hi + 1; k > lo; k --) { // from right to left, such that beta[k - 1] is still the old value 
+			beta[k] = k * b * beta[k - 1] + (m + 1 - k) * a * beta[k] ; 
+			if (beta[k] > max) max = beta[k] ; 
+		}
+		beta[lo] = (m + 1 - lo) * a * beta[lo] ; 
+		if (beta[lo] > max) max = beta[lo] ; 
+		hi ++ ; 
+
+		if (max == 0.0) { // underflow; the likelihood is 0 
+			free(beta) ; 
+			return -INFINITY ; 
+		}
+		log_scale += log(max) ; 
+		scale = 1.0 / max ; 
+		while (beta[lo] < NEGLIGIBLE_COEFFICIENT * max) lo ++ ; 
+		while (beta[hi] < NEGLIGIBLE_COEFFICIENT * max) hi -- ; 
 	}
 
-	// walk through all split observations from the cancer sample 
-	for (i = 0; i < D.c_split_n; i ++) {
-		logl += log(D.c_split_prob[i] * (ALPHA *(D.c_split[i]*EPS_A + (1.0 - D.c_split[i])*(1.0 - EPS_A)) + (1.0 - ALPHA) * (c_vaf*(D.c_split[i] * (1.0 - EPS_P) + (1 - D.c_split[i]) * EPS_P) + (1.0 - c_vaf)*(D.c_split[i]*EPS_A + (1.0 - D.c_split[i])*(1.0 - EPS_A)))) + (1.0 - D.c_split_prob[i])) ; 
+	for (k = lo; k <= hi; k ++) {
+		sum += beta[k] ; 
 	}
-	return logl ; 
+	free(beta) ; 
+	return log_scale + log(sum * scale / (C->degree + 1)) ; 
 }
 
-double logl_h_vaf2(double c_vaf, data D) {
+double loglikelihood(double h_vaf, double c_vaf, data D, model* M) {
 	double logl = 0.0 ;
 	size_t i ; 
 	// walk through all insert size observations from the healthy sample 
 	for (i = 0; i < D.h_isize_n; i ++) {
-		logl += log(D.h_isize_prob[i] * f(D.h_isize[i], MU_H, SIGMA_H, D.delta, RATE_H) + (1.0 - D.h_isize_prob[i])) ; 
+		logl += D.h_isize_count[i] * log(D.h_isize_prob[i] * (h_vaf*pmf(D.h_isize[i], HEALTHY, D.delta, M) + (1.0 - h_vaf)*pmf0(D.h_isize[i], HEALTHY, M)) + (1.0 - D.h_isize_prob[i])) ; 
 	}
 	
 	// walk through all split observations from the healthy sample 
 	for (i = 0; i < D.h_split_n; i ++) {
-		logl += log(D.h_split_prob[i] * (D.h_split[i] * (1.0 - EPS_P) + (1 - D.h_split[i]) * EPS_P) + (1.0 - D.h_split_prob[i])) ; 
+		logl += D.h_split_count[i] * log(D.h_split_prob[i] * (h_vaf*(D.h_split[i] * (1.0 - M->eps_p) + (1 - D.h_split[i]) * M->eps_p) + (1.0 - h_vaf)*(D.h_split[i]*M->eps_a + (1.0 - D.h_split[i])*(1.0 - M->eps_a))) + (1.0 - D.h_split_prob[i])) ; 
 	}
 
 	// walk through all insert size observations from the cancer sample 
 	for (i = 0; i < D.c_isize_n; i ++) {
-		logl += log(D.c_isize_prob[i] * (ALPHA * f(D.c_isize[i], MU_H, SIGMA_H, D.delta, RATE_H) + (1.0 - ALPHA) * (c_vaf*f(D.c_isize[i], MU_C, SIGMA_C, D.delta, RATE_C) + (1.0 - c_vaf)*f0(D.c_isize[i], MU_C, SIGMA_C))) + (1.0 - D.c_isize_prob[i])) ; 
+		logl += D.c_isize_count[i] * log(D.c_isize_prob[i] * (M->alpha * (h_vaf*pmf(D.c_isize[i], HEALTHY, D.delta, M) + (1.0 - h_vaf)*pmf0(D.c_isize[i], HEALTHY, M)) + (1.0 - M->alpha) * (c_vaf*pmf(D.c_isize[i], CANCER, D.delta, M) + (1.0 - c_vaf)*pmf0(D.c_isize[i], CANCER, M))) + (1.0 - D.c_isize_prob[i])) ; 
 	}
 
 	// walk through all split observations from the cancer sample
 	for (i = 0; i < D.c_split_n; i ++) {
-		logl += log(D.c_split_prob[i] * (ALPHA * (D.c_split[i] * (1.0 - EPS_P) + (1 - D.c_split[i]) * EPS_P) + (1.0 - ALPHA) * (c_vaf*(D.c_split[i] * (1.0 - EPS_P) + (1 - D.c_split[i]) * EPS_P) + (1.0 - c_vaf)*(D.c_split[i]*EPS_A + (1.0 - D.c_split[i])*(1.0 - EPS_A)))) + (1.0 - D.c_split_prob[i])) ; 
+		logl += D.c_split_count[i] * log(D.c_split_prob[i] * (M->alpha * (h_vaf*(D.c_split[i] * (1.0 - M->eps_p) + (1 - D.c_split[i]) * M->eps_p) + (1.0 - h_vaf)*(D.c_split[i]*M->eps_a + (1.0 - D.c_split[i])*(1.0 - M->eps_a))) + (1.0 - M->alpha) * (c_vaf*(D.c_split[i] * (1.0 - M->eps_p) + (1 - D.c_split[i]) * M->eps_p) + (1.0 - c_vaf)*(D.c_split[i]*M->eps_a + (1.0 - D.c_split[i])*(1.0 - M->eps_a)))) + (1.0 - D.c_split_prob[i])) ; 
 	}
 
 	return logl ; 
 }
 
-data removeUnlikelyInsertSizes (data D) {
-	/* Remove unlikely insert size observations */
-	data newD ; 
-
-	newD.h_split 		= D.h_split ; 
-	newD.h_split_prob 	= D.h_split_prob ; 
-	newD.h_split_n 		= D.h_split_n ; 
-	newD.c_split 		= D.c_split ; 
-	newD.c_split_prob 	= D.c_split_prob ; 
-	newD.c_split_n 		= D.c_split_n ; 
-	newD.delta 		= D.delta ; 
-
+data removeUnlikelyInsertSizes (data D, model* M) {
+	/* Remove unlikely insert size observations. The observations are moved within the 
+	 * arrays of D (see compressData), so that no memory is allocated. 
+	 */
+	data newD = D ; 
 	newD.h_isize_n = 0 ; 
 	newD.c_isize_n = 0 ; 
 
-	newD.h_isize 		= malloc(D.h_isize_n * sizeof(size_t)) ; 	
-	newD.c_isize 		= malloc(D.c_isize_n * sizeof(size_t)) ; 	
-	newD.h_isize_prob 	= malloc(D.h_isize_n * sizeof(double)) ; 	
-	newD.c_isize_prob 	= malloc(D.c_isize_n * sizeof(double)) ; 	
-
-	if (newD.h_isize == NULL || newD.c_isize == NULL || newD.h_isize_prob == NULL || newD.c_isize_prob == NULL) {
-		printf("ERROR: insufficient memory for allocation.\n") ; 
-		exit(EXIT_FAILURE) ; 
-	}
-
 	size_t i ; 
 	for (i = 0 ; i < D.h_isize_n ; i ++) {
-		if (f(D.h_isize[i], MU_H, SIGMA_H, D.delta, RATE_H) != 0.0 || f0(D.h_isize[i], MU_H, SIGMA_H) != 0.0) {
+		if (pmf(D.h_isize[i], HEALTHY, D.delta, M) != 0.0 || pmf0(D.h_isize[i], HEALTHY, M) != 0.0) {
 			newD.h_isize[newD.h_isize_n] = D.h_isize[i] ; 
 			newD.h_isize_prob[newD.h_isize_n] = D.h_isize_prob[i] ; 
+			newD.h_isize_count[newD.h_isize_n] = D.h_isize_count[i] ; 
 			newD.h_isize_n ++ ; 
 		}
 	}
 
 	for (i = 0 ; i < D.c_isize_n ; i ++) {
-		if (f(D.c_isize[i], MU_C, SIGMA_C, D.delta, RATE_C) != 0.0 || f0(D.c_isize[i], MU_C, SIGMA_C) != 0.0) {
+		if (pmf(D.c_isize[i], CANCER, D.delta, M) != 0.0 || pmf0(D.c_isize[i], CANCER, M) != 0.0) {
 			newD.c_isize[newD.c_isize_n] = D.c_isize[i] ; 
 			newD.c_isize_prob[newD.c_isize_n] = D.c_isize_prob[i] ; 
+			newD.c_isize_count[newD.c_isize_n] = D.c_isize_count[i] ; 
 			newD.c_isize_n ++ ; 
 		}
 	}
@@ -291,34 +707,34 @@ data removeUnlikelyInsertSizes (data D) {
 }
 
 
-size_t unlikelyInsertSize (data D) {
+size_t unlikelyInsertSize (data D, model* M) {
 	/* Returns 1 when there are very unlikely insert size observations. 
 	 * Unlikely refers here to an insert size for which f returns 0 for both models. 
          */
 	size_t i ; 
 	for (i = 0; i < D.h_isize_n; i ++) {
-		if (f(D.h_isize[i], MU_H, SIGMA_H, D.delta, RATE_H) == 0.0 && f0(D.h_isize[i], MU_H, SIGMA_H) == 0.0) {
+		if (pmf(D.h_isize[i], HEALTHY, D.delta, M) == 0.0 && pmf0(D.h_isize[i], HEALTHY, M) == 0.0) {
 			return 1 ; 
 		}
 	}
 
 	for (i = 0; i < D.c_isize_n; i ++) {
-		if (f(D.c_isize[i], MU_C, SIGMA_C, D.delta, RATE_C) == 0.0 && f0(D.c_isize[i], MU_C, SIGMA_C) == 0.0) {
+		if (pmf(D.c_isize[i], CANCER, D.delta, M) == 0.0 && pmf0(D.c_isize[i], CANCER, M) == 0.0) {
 			return 1 ; 
 		} 
 	}
 	return 0 ; 
 }
 	
-size_t uniqueGlobalMaximumExists (data D) {
+size_t uniqueGlobalMaximumExists (data D, model* M) {
 	/* Returns 1 when unique global maximum exists, otherwise 0 */
-	if (ALPHA == 1.0) { // no cancer cells present in the sample
+	if (M->alpha == 1.0) { // no cancer cells present in the sample
 		return 0 ; 
 	}
 
 	size_t i ; 
 	size_t c_vaf_max_exists = 0 ; // unique global maximum for c_vaf exists (0 = no, 1 = yes)
-	if (EPS_A != (1.0 - EPS_P)) {		
+	if (M->eps_a != (1.0 - M->eps_p)) {		
 		for (i = 0; i < D.c_split_n; i ++) {
 			if (D.c_split_prob[i] != 0.0) { 				
 				c_vaf_max_exists = 1 ; 
@@ -328,18 +744,18 @@ size_t uniqueGlobalMaximumExists (data D) {
 	}		
 	for (i = 0; i < D.c_isize_n; i ++) {
 		if (D.c_isize_prob[i] != 0.0) {
-			if (f0(D.c_isize[i], MU_C, SIGMA_C) != f(D.c_isize[i], MU_C, SIGMA_C, D.delta, RATE_C)) {
+			if (pmf0(D.c_isize[i], CANCER, M) != pmf(D.c_isize[i], CANCER, D.delta, M)) {
 				c_vaf_max_exists = 1 ; 
 				break ; 
 			}
 		}
 	}
 
-	if (ALPHA != 0.0 || c_vaf_max_exists == 0) {
+	if (M->alpha != 0.0 || c_vaf_max_exists == 0) {
 		return c_vaf_max_exists ; 
 	}
 
-	if (EPS_A != (1.0 - EPS_P)) {		
+	if (M->eps_a != (1.0 - M->eps_p)) {		
 		for (i = 0; i < D.h_split_n; i ++) {
 			if (D.h_split_prob[i] != 0.0) { 				
 				return 1 ;
@@ -348,7 +764,7 @@ size_t uniqueGlobalMaximumExists (data D) {
 	}		
 	for (i = 0; i < D.h_isize_n; i ++) {
 		if (D.h_isize_prob[i] != 0.0) {
-			if (f0(D.h_isize[i], MU_H, SIGMA_H) != f(D.h_isize[i], MU_H, SIGMA_H, D.delta, RATE_H)) {
+			if (pmf0(D.h_isize[i], HEALTHY, M) != pmf(D.h_isize[i], HEALTHY, D.delta, M)) {
 				return 1 ; 
 			}
 		}
@@ -356,185 +772,161 @@ size_t uniqueGlobalMaximumExists (data D) {
 	return 0 ; 
 }
 
-double aux_logl_h_vaf0 (double x, void * params) {
-	return -1.0 * logl_h_vaf0(x, (*(data*)params)) ; 
+double aux_logl_coefficients (double x, void * params) {
+	return -1.0 * logl_coefficients(x, (coefficients*)params) ; 
 }
 
-double aux_logl_h_vaf1 (double x, void * params) {
-	return -1.0 * logl_h_vaf1(x, (*(data*)params)) ; 
-}
-
-double aux_logl_h_vaf2 (double x, void * params) {
-	return -1.0 * logl_h_vaf2(x, (*(data*)params)) ; 
-}
-
-size_t prepareMinimization (double h_vaf, double *x, double *a, double *b, data D) {
+size_t prepareMinimization (double *x, double *a, double *b, coefficients* C, model* M) {
 	/* Determines whether the h_vaf value is likely at all. In addition, it locates 
-	   the unimodal part of the loglikelihood function. */
-	mpf_t l0, l1, l2 ; 
-	mpf_init(l0) ; 
-	mpf_init(l1) ; 
-	mpf_init(l2) ; 
-
-	likelihood (&l0, h_vaf, 0.0, D) ; 
-	likelihood (&l1, h_vaf, 0.5, D) ; 
-	likelihood (&l2, h_vaf, 1.0, D) ; 
-
-	if (mpf_cmp_d(l0, 0.0) == 0 && mpf_cmp_d(l1, 0.0) == 0 && mpf_cmp_d(l2, 0.0) == 0) 
+	   the unimodal part of the loglikelihood function. Since the loglikelihood is concave 
+	   in c_vaf, its maximum lies between the neighbours of the best point of an equally 
+	   spaced grid, which gives the initial guess x and the interval [a, b]. */
+	double logl[MLE_GRID_PANELS + 1] ; 
+	size_t i, best = 0 ; 
+	for (i = 0; i <= MLE_GRID_PANELS; i ++) {
+		logl[i] = logl_coefficients(i / (double)MLE_GRID_PANELS, C) ; 
+		if (logl[i] > logl[best]) 
+			best = i ; 
+	}
+
+	if (logl[best] == -INFINITY) 
 		return IMPOSSIBLE_HEALTHY_VAF ; 
 
-	if (mpf_cmp_d(l0, 0.0) == 0) 
-		(*a) = EPSABS / 2 ; 
+	if (best <= 1 && logl[0] == -INFINITY) 
+		(*a) = M->epsabs / 2 ; 
 	else 
-		(*a) = 0.0 ; 
+		(*a) = (best == 0) ? 0.0 : (best - 1) / (double)MLE_GRID_PANELS ; 
 
-	if (mpf_cmp_d(l2, 0.0) == 0) 
-		(*b) = 1.0 - EPSABS / 2 ; 
+	if (best >= MLE_GRID_PANELS - 1 && logl[MLE_GRID_PANELS] == -INFINITY) 
+		(*b) = 1.0 - M->epsabs / 2 ; 
 	else 
-		(*b) = 1.0 ; 
+		(*b) = (best == MLE_GRID_PANELS) ? 1.0 : (best + 1) / (double)MLE_GRID_PANELS ; 
+
+	if (best == 0 || best == MLE_GRID_PANELS) // the initial guess lies strictly between a and b
+		(*x) = ((*a) + (*b)) / 2 ; 
+	else 
+		(*x) = best / (double)MLE_GRID_PANELS ; 
 
 	/* Find appropriate initial guess x */
 	size_t iter = 0 ; 
-	double logl_a = loglikelihood(h_vaf, (*a), D); 
-	double logl_x = loglikelihood(h_vaf, (*x), D);
-	double logl_b = loglikelihood(h_vaf, (*b), D);
-	while (iter < MAX_ITER && (logl_x <= logl_a || logl_x <= logl_b)) {
+	double logl_a = logl_coefficients((*a), C); 
+	double logl_x = logl_coefficients((*x), C);
+	double logl_b = logl_coefficients((*b), C);
+	while (logl_x <= logl_a || logl_x <= logl_b) {
+		if (iter == M->max_iter || (*x) - (*a) < M->epsabs || (*b) - (*x) < M->epsabs) { // the maximum lies at (or within epsabs of) a or b
+			if (logl_a > logl_b) 
+				(*x) = (*a) ;
+			else 
+				(*x) = (*b) ;  
+			return DONE_MINIMIZATION ; 
+		}
 		iter ++ ; 
 		if (logl_x <= logl_a) 
 			(*x) = ((*x) + (*a)) / 2 ; 
 		else 
 			(*x) = ((*x) + (*b)) / 2 ; 
-		logl_x = loglikelihood(h_vaf, (*x), D) ; 				
-	}
-	
-	if (iter == MAX_ITER) {
-		if (logl_a > logl_b) 
-			(*x) = (*a) ;
-		else 
-			(*x) = (*b) ;  
-		return DONE_MINIMIZATION ; 
+		logl_x = logl_coefficients((*x), C) ; 				
 	}
 	return CONTINUE_MINIMIZATION ; 
 }
 
 
-double computeMLE (double* MLE_h_vaf, double* MLE_c_vaf, data D) {
-	/* Returns the maximum likelihood estimates of h_vaf and c_vaf given data D */
-	double mle_c_vaf0 = 0.5, mle_c_vaf1 = 0.5, mle_c_vaf2 = 0.5 ;
-	double a, b, max_logl0, max_logl1, max_logl2 ; 
-	size_t status, iter = 0 ;
+size_t maximizeNewton (double* x, double a, double b, coefficients* C, model* M) {
+	/* Maximizes the loglikelihood on [a, b] with Newton's method for the root of its derivative, starting 
+	 * at x. Since the loglikelihood is concave, the derivative is decreasing, so that [a, b] can be narrowed 
+	 * down to the part where the derivative changes sign. A Newton step that leaves this part is replaced 
+	 * by bisection (safeguard). The iterations stop when the step or the interval is smaller than epsabs. 
+	 * Returns the number of iterations, or 0 when there was no convergence within max_iter iterations. 
+	 */
+	double d1, d2, next ; 
+	size_t iter ; 
+	for (iter = 1; iter <= M->max_iter; iter ++) {
+		derivatives_coefficients((*x), C, &d1, &d2) ; 
+		if (d1 > 0.0) { // the maximum lies to the right of x
+			a = (*x) ; 
+		} else if (d1 < 0.0) { 
+			b = (*x) ; 
+		} else { 
+			return iter ; 
+		}
+		next = (*x) - d1 / d2 ; 
+		if (d2 >= 0.0 || !(next > a && next < b)) { // also when the step is not a number
+			next = (a + b) / 2 ; 
+		}
+		if (fabs(next - (*x)) < M->epsabs || b - a < M->epsabs) { 
+			(*x) = next ; 
+			return iter ; 
+		}
+		(*x) = next ; 
+	}
+	return 0 ; 
+}
+
+double computeMLE (double* MLE_h_vaf, double* MLE_c_vaf, coefficients* C, model* M) {
+	/* Returns the maximum likelihood estimates of h_vaf and c_vaf given the coefficients 
+	 * for h_vaf = 0, 0.5 and 1 (see computeCoefficients) */
+	double mle_c_vaf[3] = {0.5, 0.5, 0.5} ;
+	double max_logl[3] ; 
+	double a, b, x ; 
+	size_t j, status, iter = 0 ;
 	
 	const gsl_min_fminimizer_type *T;
 	gsl_min_fminimizer *s;
 	T = gsl_min_fminimizer_brent;
   	s = gsl_min_fminimizer_alloc(T);
 	gsl_function F;
-	F.params = &D ; 
-
-	gsl_set_error_handler_off();		
+	F.function = &aux_logl_coefficients; 
 	
-	status = prepareMinimization(0.0, &mle_c_vaf0, &a, &b, D) ; 
-	switch(status) {
-		case DONE_MINIMIZATION:
-			max_logl0 = logl_h_vaf0(mle_c_vaf0, D) ;  break ; 
-		case IMPOSSIBLE_HEALTHY_VAF:
-			max_logl0 = -INFINITY ; break ; 
-		case CONTINUE_MINIMIZATION: 
-			iter = 0 ; 
-			F.function = &aux_logl_h_vaf0; 
-			status = gsl_min_fminimizer_set (s, &F, mle_c_vaf0, a, b);
-			do { 
-				iter ++ ;
-				gsl_min_fminimizer_iterate(s) ;
-				status = gsl_min_test_interval(gsl_min_fminimizer_x_lower(s), gsl_min_fminimizer_x_upper(s), EPSABS, 0.0) ; 
-			} while (status == GSL_CONTINUE && iter < MAX_ITER);
-			mle_c_vaf0 = gsl_min_fminimizer_x_minimum(s) ;
-			max_logl0 = -1.0 * gsl_min_fminimizer_f_minimum(s) ; 
-			break ; 
-	}
-
-	status = prepareMinimization(0.5, &mle_c_vaf1, &a, &b, D) ; 
-	switch(status) {
-		case DONE_MINIMIZATION:
-			max_logl1 = logl_h_vaf1(mle_c_vaf1, D) ; break ; 
-		case IMPOSSIBLE_HEALTHY_VAF:
-			max_logl1 = -INFINITY ; break ; 
-		case CONTINUE_MINIMIZATION: 
-			iter = 0 ; 
-			F.function = &aux_logl_h_vaf1; 
-			status = gsl_min_fminimizer_set (s, &F, mle_c_vaf1, a, b);
-			do { 
-				iter ++ ;
-				gsl_min_fminimizer_iterate(s) ;
-				status = gsl_min_test_interval(gsl_min_fminimizer_x_lower(s), gsl_min_fminimizer_x_upper(s), EPSABS, 0.0) ; 
-			} while (status == GSL_CONTINUE && iter < MAX_ITER);
-			mle_c_vaf1 = gsl_min_fminimizer_x_minimum(s) ;
-			max_logl1 = -1.0 * gsl_min_fminimizer_f_minimum(s) ; 
-			break ; 
-	}
-
-	status = prepareMinimization(1.0, &mle_c_vaf2, &a, &b, D) ; 
-	switch(status) {
-		case DONE_MINIMIZATION:
-			max_logl2 = logl_h_vaf2(mle_c_vaf1, D) ; break ; 
-		case IMPOSSIBLE_HEALTHY_VAF:
-			max_logl2 = -INFINITY ; break ; 
-		case CONTINUE_MINIMIZATION: 
-			iter = 0 ; 
-			F.function = &aux_logl_h_vaf2; 
-			status = gsl_min_fminimizer_set (s, &F, mle_c_vaf2, a, b); 
-			do { 
-				iter ++ ;
-				gsl_min_fminimizer_iterate(s) ;
-				status = gsl_min_test_interval(gsl_min_fminimizer_x_lower(s), gsl_min_fminimizer_x_upper(s), EPSABS, 0.0) ; 
-			} while (status == GSL_CONTINUE && iter < MAX_ITER);
-			mle_c_vaf2 = gsl_min_fminimizer_x_minimum(s) ;
-			max_logl2 = -1.0 * gsl_min_fminimizer_f_minimum(s) ; 
-			break ; 
+	for (j = 0; j < 3; j ++) {
+		status = prepareMinimization(&mle_c_vaf[j], &a, &b, &C[j], M) ; 
+		switch(status) {
+			case DONE_MINIMIZATION:
+				max_logl[j] = logl_coefficients(mle_c_vaf[j], &C[j]) ;  break ; 
+			case IMPOSSIBLE_HEALTHY_VAF:
+				max_logl[j] = -INFINITY ; break ; 
+			case CONTINUE_MINIMIZATION: 
+				if (M->solver == SOLVER_NEWTON) {
+					x = mle_c_vaf[j] ; 
+					iter = maximizeNewton(&x, a, b, &C[j], M) ; 
+					M->n_iterations += iter ; 
+					if (iter > 0) { // converged
+						mle_c_vaf[j] = x ; 
+						max_logl[j] = logl_coefficients(x, &C[j]) ; 
+						break ; 
+					}
+					M->n_fallbacks ++ ; // Brent starts again from the initial guess
+				}
+				iter = 0 ; 
+				F.params = &C[j] ; // the values at x, a and b are in the cache of C[j] already
+				status = gsl_min_fminimizer_set_with_values (s, &F, mle_c_vaf[j], aux_logl_coefficients(mle_c_vaf[j], &C[j]), a, aux_logl_coefficients(a, &C[j]), b, aux_logl_coefficients(b, &C[j]));
+				do { 
+					iter ++ ;
+					gsl_min_fminimizer_iterate(s) ;
+					status = gsl_min_test_interval(gsl_min_fminimizer_x_lower(s), gsl_min_fminimizer_x_upper(s), M->epsabs, 0.0) ; 
+				} while (status == GSL_CONTINUE && iter < M->max_iter);
+				M->n_iterations += iter ; 
+				mle_c_vaf[j] = gsl_min_fminimizer_x_minimum(s) ;
+				max_logl[j] = -1.0 * gsl_min_fminimizer_f_minimum(s) ; 
+				break ; 
+		}
 	}
 
 	gsl_min_fminimizer_free (s);
 
 	// Determine MLE estimate 
-	if (max_logl0 >= max_logl1 && max_logl0 >= max_logl2) {
+	if (max_logl[0] >= max_logl[1] && max_logl[0] >= max_logl[2]) {
 		(*MLE_h_vaf) = 0.0 ;
-		(*MLE_c_vaf) = mle_c_vaf0 ; 
-		return max_logl0 ; 
+		(*MLE_c_vaf) = mle_c_vaf[0] ; 
+		return max_logl[0] ; 
 	} 
 
-	if (max_logl1 > max_logl0 && max_logl1 > max_logl2) {
+	if (max_logl[1] > max_logl[0] && max_logl[1] > max_logl[2]) {
 		(*MLE_h_vaf) = 0.5 ;
-		(*MLE_c_vaf) = mle_c_vaf1 ; 
-		return max_logl1 ; 
+		(*MLE_c_vaf) = mle_c_vaf[1] ; 
+		return max_logl[1] ; 
 	} 
 
 	(*MLE_h_vaf) = 1.0 ;
-	(*MLE_c_vaf) = mle_c_vaf2 ; 
-	return max_logl2 ; 	 
+	(*MLE_c_vaf) = mle_c_vaf[2] ; 
+	return max_logl[2] ; 	 
 }
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
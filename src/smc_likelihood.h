@@ -28,7 +28,11 @@
 #include <gsl/gsl_min.h>
 #include <gsl/gsl_errno.h>
 
+#include "config.h" // USE_GMP
+
+#ifdef USE_GMP
 #include <gmp.h>
+#endif
 
 #include "smc_input.h" // contains data structure 
 
@@ -36,57 +40,165 @@
 #define DONE_MINIMIZATION	1
 #define IMPOSSIBLE_HEALTHY_VAF	2 
 
-/* parameters - stay constant throughout all computations */
-double ALPHA ; 
-double MU_H ; 
-double SIGMA_H ; 
-double RATE_H ; 
-double MU_C ; 
-double SIGMA_C ; 
-double RATE_C ; 
-double EPS_A ; 
-double EPS_P ; 
-size_t MAX_ITER ; 
-double EPSABS ; 
-size_t N_PANELS ; 
+#define NEGLIGIBLE_COEFFICIENT 	1e-300 	/* relative to the largest coefficient (see log_integrate_likelihood) */
+#define MLE_GRID_PANELS 	8 	/* the loglikelihood is evaluated on a grid of MLE_GRID_PANELS + 1 points (see prepareMinimization) */
+#define LOGL_CACHE_SIZE 	32 	/* # of loglikelihood values kept per h_vaf (see logl_coefficients) */
+
+/*
+ * For a fixed h_vaf, every observation contributes a factor to the likelihood that is 
+ * affine in c_vaf. The likelihood is therefore determined by a constant and the 
+ * coefficients A_i and B_i of the factors A_i + B_i*c_vaf (see computeCoefficients). 
+ * Identical observations (see compressData) give one factor that occurs count_i times. 
+ * The loglikelihood values computed for the variant are kept, so that the MLE and the 
+ * posterior probabilities never evaluate the same c_vaf twice. 
+ */
+typedef struct {
+	double h_vaf ; 
+	double log_constant ; 	// log of the product of all factors that do not depend on c_vaf
+	double* A ; 
+	double* B ; 
+	size_t* count ; 	// number of times the factor occurs
+	size_t n ; 		// number of factors that depend on c_vaf
+	size_t degree ; 	// sum of the counts (degree of the likelihood in c_vaf)
+	double cached_c_vaf[LOGL_CACHE_SIZE] ; 	// the first LOGL_CACHE_SIZE evaluations of logl_coefficients
+	double cached_logl[LOGL_CACHE_SIZE] ; 
+	size_t n_cached ; 
+} coefficients ; 
+
+#define HEALTHY 		0 	/* index of the parameters of the healthy sample (see pmf) */
+#define CANCER 			1 	/* index of the parameters of the cancer sample */
+
+#define PMF_TABLE_SIGMAS 	10 	/* the tables cover the insert sizes up to mu + max(delta, 0) + PMF_TABLE_SIGMAS*sigma */
+#define PMF_CACHE_TABLES 	64 	/* max. # of tables (values of delta) in a cache */
+#define PMF_CACHE_ENTRIES 	262144 	/* max. # of values in the tables of a cache (2 MB) */
+
+/*
+ * Table of the insert size PMF f (see below) for one delta and the parameters of 
+ * both samples. The values are computed when they are needed for the first time; 
+ * the normalization factors only depend on delta and are computed once. 
+ */
+typedef struct {
+	double delta ; 
+	double normalization[2] ; 	// normalization factor of f per sample (HEALTHY or CANCER)
+	double* values[2] ; 		// f per sample for the insert sizes 0, 1, ..., n - 1 (NAN when not computed yet)
+	size_t n ; 
+	size_t last_used ; 		// for evicting the least recently used table
+} pmf_table ; 
+
+/*
+ * Cache of the tables of f for the last values of delta, together with the table of 
+ * f0 (which does not depend on delta). The memory is bounded by PMF_CACHE_TABLES and 
+ * PMF_CACHE_ENTRIES. The cache is not shared: every thread has its own. 
+ */
+typedef struct {
+	pmf_table tables[PMF_CACHE_TABLES] ; 
+	size_t n_tables ; 
+	size_t n_entries ; 		// total # of values in the tables
+	size_t clock ; 			// # of requests for a table
+	double mu[2] ; 			// parameters of the insert size model per sample
+	double sigma[2] ; 
+	double rate[2] ; 
+	double normalization0[2] ; 	// normalization factor of f0 per sample
+	double* values0[2] ; 		// f0 per sample for the insert sizes 0, 1, ..., n0 - 1 (NAN when not computed yet)
+	size_t n0 ; 
+} pmf_cache ; 
+
+/*
+ * Parameters of the likelihood model for one call. Every call gets its own copy, 
+ * since epsilon_p depends on the type of the variant, so that variants can be 
+ * called concurrently (see smc_threads.h). 
+ */
+typedef struct {
+	double alpha ; 		// level of impurity
+	double mu_h ; 
+	double sigma_h ; 
+	double rate_h ; 
+	double mu_c ; 
+	double sigma_c ; 
+	double rate_c ; 
+	double eps_a ; 
+	double eps_p ; 		// epsilon_p for the type of the variant (deletion or insertion)
+	size_t max_iter ; 
+	double epsabs ; 
+	size_t n_panels ; 	// initial number of panels of the adaptive quadrature
+	double epsrel ; 	// relative tolerance of the adaptive quadrature
+	size_t n_evaluations ; 	// # of likelihood evaluations for the posterior probabilities (see integrate_likelihood)
+	short solver ; 		// SOLVER_BRENT or SOLVER_NEWTON
+	size_t n_iterations ; 	// # of iterations of the solver for the MLE of c_vaf (see computeMLE)
+	size_t n_fallbacks ; 	// # of times the Newton solver did not converge and Brent was used
+	pmf_cache* cache ; 	// cache of the insert size PMFs of the thread (NULL when not used)
+	pmf_table* table ; 	// table of f for the delta of the variant (NULL when not used)
+} model ; 
+
+/* Returns the model parameters for a variant of the given type ('+' or '-') */
+model returnModel(parameters* p, char type) ; 
 
 /* Probability distribution for insert size observations */
-double f(double x, double mu, double std, size_t delta, double rate) ; 
+double f(double x, double mu, double std, double delta, double rate) ; 
 
 /* The PMF of the insert size distribution when there is no indel (null distribution) */
 double f0(double x, double mu, double std) ; 
 
+/* Returns an empty cache of the insert size PMFs for the parameters p */
+pmf_cache* newPMFCache(parameters* p) ; 
+
+/* Frees the cache and all its tables */
+void freePMFCache(pmf_cache* cache) ; 
+
+/* Returns the table of f for delta (evicts the least recently used tables when needed) */
+pmf_table* returnPMFTable(pmf_cache* cache, double delta) ; 
+
+/* Returns f(x) for the parameters of the sample (HEALTHY or CANCER), from the table of the model when possible */
+double pmf(size_t x, size_t sample, double delta, model* M) ; 
+
+/* Returns f0(x) for the parameters of the sample (HEALTHY or CANCER), from the cache of the model when possible */
+double pmf0(size_t x, size_t sample, model* M) ; 
+
+#ifdef USE_GMP
 /* Determines the likelihood of h_vaf and c_vaf given the data D */ 
-void likelihood (mpf_t* l_final, double h_vaf, double c_vaf, data D) ;
+void likelihood (mpf_t* l_final, double h_vaf, double c_vaf, data D, model* M) ;
+
+/* Approximates the integral of the likelihood function using adaptive Simpson quadrature (l_zero: likelihood at c_vaf = 0; may be NULL) */
+void integrate_likelihood(mpf_t* I_final, mpf_t* l_zero, double h_vaf, data D, model* M) ; 
+#endif
+
+/* Returns log(exp(x) + exp(y)) */
+double logAddExp(double x, double y) ; 
+
+/* Returns the log of the integral of the likelihood function over c_vaf (exact) */
+double log_integrate_likelihood(coefficients* C) ; 
+
+/* Determines the posterior probabilities of the hypotheses 'somatic', 'germline' and 'not present' */
+void determinePosteriorProbabilities(double* p_somatic, double* p_germline, double* p_not_present, data D, coefficients* C, model* M) ; 
 
-/* Approximates the integral of the likelihood function using the trapezoidal rule */
-void integrate_likelihood(mpf_t* I_final, double h_vaf, data D) ; 
+/* Loglikelihood function (the data needs to be compressed, see compressData) */
+double loglikelihood(double h_vaf, double c_vaf, data D, model* M) ; 
 
-/* Approximates the posterior probabilities of the hypotheses 'somatic', 'germline' and 'not present' */
-void determinePosteriorProbabilities(double* p_somatic, double* p_germline, double* p_not_present, data D) ; 
+/* Reduces the likelihood for the given h_vaf to a constant and the coefficients A_i and B_i (the data needs to be compressed) */
+void computeCoefficients(coefficients* C, double h_vaf, data D, model* M) ; 
 
-/* Loglikelihood function */
-double loglikelihood(double h_vaf, double c_vaf, data D) ; 
+/* Frees the coefficients */
+void freeCoefficients(coefficients* C) ; 
 
-/* Loglikelihood function where the healthy VAF (h_vaf) is set to 0.0 */
-double logl_h_vaf0(double c_vaf, data D) ;
+/* Loglikelihood function for the h_vaf of the coefficients (values are looked up in the cache of C first) */
+double logl_coefficients(double c_vaf, coefficients* C) ; 
 
-/* Loglikelihood function where the healthy VAF (h_vaf) is set to 0.5 */
-double logl_h_vaf1(double c_vaf, data D) ; 
+/* First and second derivative of the loglikelihood function with respect to c_vaf */
+void derivatives_coefficients(double c_vaf, coefficients* C, double* d1, double* d2) ; 
 
-/* Loglikelihood function where the healthy VAF (h_vaf) is set to 1.0 */
-double logl_h_vaf2(double c_vaf, data D) ; 
+/* Maximizes the loglikelihood on [a, b] with a safeguarded Newton method. Returns the # of iterations (0 when it did not converge) */
+size_t maximizeNewton (double* x, double a, double b, coefficients* C, model* M) ; 
 
 /* Returns 1 when there are very unlikely insert size observations, 0 otherwise. */
-size_t unlikelyInsertSize (data D) ;
+size_t unlikelyInsertSize (data D, model* M) ;
 
-/* Removes any unlikely insert size observations from the data. */
-data removeUnlikelyInsertSizes (data D) ; 
+/* Removes any unlikely insert size observations from the (compressed) data. The arrays of D are changed in place. */
+data removeUnlikelyInsertSizes (data D, model* M) ; 
 
 /* Returns 1 when unique global maximum exists, otherwise 0 */
-size_t uniqueGlobalMaximumExists (data D) ;
+size_t uniqueGlobalMaximumExists (data D, model* M) ;
 
-/* Returns the maximum likelihood estimates of h_vaf and c_vaf given data D */
-double computeMLE (double* MLE_h_vaf, double* MLE_c_vaf, data D)  ; 
+/* Returns the maximum likelihood estimates of h_vaf and c_vaf given the coefficients for h_vaf = 0, 0.5 and 1 */
+double computeMLE (double* MLE_h_vaf, double* MLE_c_vaf, coefficients* C, model* M)  ; 
 
 #endif
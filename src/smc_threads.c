@@ -0,0 +1,288 @@
+/*
+ * Copyright (C) 2015 Louis Dijkstra
+ *
+ * This file is part of somatic-indel-calling
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+#include "smc_threads.h"
+
+void callVariant(job* J, parameters* p, pmf_cache* cache) {
+	/* Calls one variant and stores the line of output in the job */
+	variant* v = &J->v ;
+	data D ;
+	model M = returnModel(p, v->type) ; // epsilon_p depends on the type of the variant
+
+	coefficients C[3] ; // coefficients of the likelihood for h_vaf = 0, 0.5 and 1
+	double mle_h_vaf, mle_c_vaf, max_logl ;
+	double p_somatic, p_germline, p_not_present ;
+
+	// info on the VCF record
+	size_t n = snprintf(J->call, LENGTH_CALL_BUFFER, "%c\t%s\t%zd\t%zd", v->type, v->chromosome, v->position, v->length) ;
+	J->called = 0 ;
+	J->n_evaluations = 0 ;
+	J->n_iterations = 0 ;
+	J->n_fallbacks = 0 ;
+
+	if (J->status != VALID_VARIANT) { // variant is not of the right type
+		snprintf(J->call + n, LENGTH_CALL_BUFFER - n, "\t.\t.\t.\t.\t.\t.\n") ;
+		return ;
+	}
+
+	D = compressData(J->D, &J->A) ; // identical observations are counted only once (see compressData)
+
+	if (v->type == '+') {
+		D.delta = -1.0*v->length ;
+	} else {
+		D.delta = v->length ;
+	}
+
+	M.cache = cache ;
+	M.table = returnPMFTable(cache, D.delta) ; // the insert size PMFs are shared by variants with the same delta
+
+	if (unlikelyInsertSize(D, &M)) {
+		D = removeUnlikelyInsertSizes(D, &M) ;
+	}
+
+	if (uniqueGlobalMaximumExists(D, &M) == 1) {
+		computeCoefficients(&C[0], 0.0, D, &M) ;
+		computeCoefficients(&C[1], 0.5, D, &M) ;
+		computeCoefficients(&C[2], 1.0, D, &M) ;
+		max_logl = computeMLE(&mle_h_vaf, &mle_c_vaf, C, &M) ;
+		determinePosteriorProbabilities(&p_somatic, &p_germline, &p_not_present, D, C, &M) ;
+		J->called = 1 ;
+		J->n_evaluations = M.n_evaluations ;
+		J->n_iterations = M.n_iterations ;
+		J->n_fallbacks = M.n_fallbacks ;
+		freeCoefficients(&C[0]) ;
+		freeCoefficients(&C[1]) ;
+		freeCoefficients(&C[2]) ;
+		snprintf(J->call + n, LENGTH_CALL_BUFFER - n, "\t%f\t%f\t%f\t%f\t%f\t%f\n", mle_h_vaf, mle_c_vaf, max_logl, p_somatic, p_germline, p_not_present) ;
+	} else {
+		snprintf(J->call + n, LENGTH_CALL_BUFFER - n, "\t.\t.\t.\t.\t.\t.\n") ;
+	}
+}
+
+static void* readVariants(void* arg) {
+	/* Reads the variants one after another and puts them in the ring buffer (reader thread) */
+	pipeline* P = (pipeline*) arg ;
+	parameters* p = P->p ;
+	job* J ;
+	size_t status ;
+	size_t region_reached = 0 ;
+
+	while (1) {
+		// wait until the writer has printed the job in the next slot
+		pthread_mutex_lock(&P->lock) ;
+		while (P->n_read - P->n_written == P->n_jobs) {
+			pthread_cond_wait(&P->slot_free, &P->lock) ;
+		}
+		pthread_mutex_unlock(&P->lock) ;
+		J = P->jobs + P->n_read % P->n_jobs ; // only the reader changes n_read
+
+		if (P->B != NULL) {
+			status = obtainBinaryVariant(P->B, &J->v, p) ;
+		} else {
+			status = obtainVariant(P->T, &J->v, p) ;
+		}
+		if (status == END_OF_FILE_REACHED) {
+			P->eof_reached = 1 ;
+			break ;
+		}
+
+		// only variants in the region are considered; the variants are sorted per chromosome
+		if (p->region == 1) {
+			if (strcmp(J->v.chromosome, p->region_chromosome) != 0 || J->v.position < p->region_start) {
+				if (region_reached == 1 && strcmp(J->v.chromosome, p->region_chromosome) != 0) {
+					break ; // passed the region
+				}
+				if (P->B == NULL) {
+					skipDataEntry(P->T) ;
+				}
+				continue ; // the slot is used for the next variant
+			}
+			region_reached = 1 ;
+			if (J->v.position > p->region_end) {
+				break ; // passed the region
+			}
+		}
+
+		J->status = status ;
+		if (status == VALID_VARIANT) {
+			resetArena(&J->A) ; // the data of the previous variant in the slot is not needed anymore
+			if (P->B != NULL) {
+				J->D = obtainBinaryData(P->B, p, &J->A) ;
+			} else {
+				J->D = obtainData(P->T, p, &J->A) ;
+			}
+		} else if (P->B == NULL) { // the binary reader moves on to the next variant by itself
+			skipDataEntry(P->T) ;
+		}
+		J->done = 0 ;
+
+		pthread_mutex_lock(&P->lock) ;
+		P->n_read ++ ;
+		pthread_cond_signal(&P->job_read) ;
+		pthread_mutex_unlock(&P->lock) ;
+	}
+
+	pthread_mutex_lock(&P->lock) ;
+	P->end_reached = 1 ;
+	pthread_cond_broadcast(&P->job_read) ; // idle workers stop
+	pthread_cond_signal(&P->job_done) ;
+	pthread_mutex_unlock(&P->lock) ;
+	return NULL ;
+}
+
+static void* callJobs(void* arg) {
+	/* Takes the next job from the ring buffer and calls the variant until all variants are read (worker thread) */
+	pipeline* P = (pipeline*) arg ;
+	pmf_cache* cache = newPMFCache(P->p) ; // every thread has its own cache
+	job* J ;
+
+	while (1) {
+		pthread_mutex_lock(&P->lock) ;
+		while (P->n_claimed == P->n_read && P->end_reached == 0) {
+			pthread_cond_wait(&P->job_read, &P->lock) ;
+		}
+		if (P->n_claimed == P->n_read) { // all variants are called
+			pthread_mutex_unlock(&P->lock) ;
+			freePMFCache(cache) ;
+			return NULL ;
+		}
+		J = P->jobs + (P->n_claimed ++) % P->n_jobs ;
+		pthread_mutex_unlock(&P->lock) ;
+
+		callVariant(J, P->p, cache) ;
+
+		pthread_mutex_lock(&P->lock) ;
+		J->done = 1 ;
+		pthread_cond_signal(&P->job_done) ;
+		pthread_mutex_unlock(&P->lock) ;
+	}
+}
+
+static void writeCalls(pipeline* P) {
+	/* Prints the calls in the order of the input as soon as they are done (writer) */
+	job* J ;
+
+	pthread_mutex_lock(&P->lock) ;
+	while (1) {
+		J = P->jobs + P->n_written % P->n_jobs ;
+		if (P->n_written < P->n_read && J->done == 1) {
+			pthread_mutex_unlock(&P->lock) ;
+			fputs(J->call, stdout) ;
+			P->n_called += J->called ; // only the writer changes these
+			P->n_evaluations += J->n_evaluations ;
+			P->n_iterations += J->n_iterations ;
+			P->n_fallbacks += J->n_fallbacks ;
+			if (J->n_iterations > P->max_iterations) {
+				P->max_iterations = J->n_iterations ;
+			}
+			pthread_mutex_lock(&P->lock) ;
+			J->done = 0 ;
+			P->n_written ++ ;
+			pthread_cond_signal(&P->slot_free) ;
+		} else if (P->end_reached == 1 && P->n_written == P->n_read) {
+			break ;
+		} else {
+			pthread_cond_wait(&P->job_done, &P->lock) ;
+		}
+	}
+	pthread_mutex_unlock(&P->lock) ;
+
+	if (P->eof_reached == 1) {
+		printf("End of file reached\n") ;
+	}
+	if (P->p->verbose == 1) {
+#ifdef USE_GMP
+		printf("Posterior probabilities of %zd variants computed with %zd likelihood evaluations (%.1f per variant)\n", P->n_called, P->n_evaluations, P->n_called ? P->n_evaluations / (double)P->n_called : 0.0) ;
+#else
+		printf("Posterior probabilities of %zd variants computed exactly (no likelihood evaluations needed)\n", P->n_called) ;
+#endif
+		printf("MLE of c_vaf computed with %s: %zd iterations (%.1f per variant, max. %zd), %zd fallbacks to brent\n", P->p->solver == SOLVER_NEWTON ? "newton" : "brent", P->n_iterations, P->n_called ? P->n_iterations / (double)P->n_called : 0.0, P->max_iterations, P->n_fallbacks) ;
+	}
+}
+
+void callVariants(text_observations* T, binary_observations* B, parameters* p) {
+	/* Reads the variants and calls them with p->n_threads worker threads. The calls are printed in the order of the input. */
+	pipeline P ;
+	pthread_t reader ;
+	pthread_t* workers = malloc(p->n_threads * sizeof(pthread_t)) ;
+	size_t i ;
+
+	P.n_jobs 	= JOBS_PER_THREAD * p->n_threads ;
+	P.jobs 		= malloc(P.n_jobs * sizeof(job)) ;
+	if (workers == NULL || P.jobs == NULL) {
+		printf("ERROR: insufficient memory for allocation.\n") ;
+		exit(EXIT_FAILURE) ;
+	}
+	for (i = 0; i < P.n_jobs; i ++) {
+		P.jobs[i].v.chromosome = malloc(LENGTH_CHROM_BUFFER * sizeof(char)) ;
+		if (P.jobs[i].v.chromosome == NULL) {
+			printf("ERROR: insufficient memory for allocation.\n") ;
+			exit(EXIT_FAILURE) ;
+		}
+		P.jobs[i].done = 0 ;
+		initArena(&P.jobs[i].A) ;
+	}
+
+	P.n_read 	= 0 ;
+	P.n_claimed 	= 0 ;
+	P.n_written 	= 0 ;
+	P.end_reached 	= 0 ;
+	P.eof_reached 	= 0 ;
+	P.n_called 	= 0 ;
+	P.n_evaluations = 0 ;
+	P.n_iterations 	= 0 ;
+	P.max_iterations = 0 ;
+	P.n_fallbacks 	= 0 ;
+	P.T 		= T ;
+	P.B 		= B ;
+	P.p 		= p ;
+	pthread_mutex_init(&P.lock, NULL) ;
+	pthread_cond_init(&P.slot_free, NULL) ;
+	pthread_cond_init(&P.job_read, NULL) ;
+	pthread_cond_init(&P.job_done, NULL) ;
+
+	if (pthread_create(&reader, NULL, readVariants, &P) != 0) {
+		printf("ERROR: could not create the reader thread.\n") ;
+		exit(EXIT_FAILURE) ;
+	}
+	for (i = 0; i < p->n_threads; i ++) {
+		if (pthread_create(&workers[i], NULL, callJobs, &P) != 0) {
+			printf("ERROR: could not create worker thread %zd.\n", i + 1) ;
+			exit(EXIT_FAILURE) ;
+		}
+	}
+
+	writeCalls(&P) ;
+
+	pthread_join(reader, NULL) ;
+	for (i = 0; i < p->n_threads; i ++) {
+		pthread_join(workers[i], NULL) ;
+	}
+
+	pthread_mutex_destroy(&P.lock) ;
+	pthread_cond_destroy(&P.slot_free) ;
+	pthread_cond_destroy(&P.job_read) ;
+	pthread_cond_destroy(&P.job_done) ;
+	for (i = 0; i < P.n_jobs; i ++) {
+		free(P.jobs[i].v.chromosome) ;
+		freeArena(&P.jobs[i].A) ;
+	}
+	free(P.jobs) ;
+	free(workers) ;
+}
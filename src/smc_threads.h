@@ -0,0 +1,91 @@
+/*
+ * Copyright (C) 2015 Louis Dijkstra
+ *
+ * This file is part of somatic-indel-calling
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+#ifndef SMC_THREADS_H_
+#define SMC_THREADS_H_
+
+#include <pthread.h>
+
+#include "smc_likelihood.h"
+#include "smc_binary.h"
+
+/*
+ * Calling the variants with several threads. A reader thread reads the
+ * variants one after another and puts them in a ring buffer of jobs. The
+ * worker threads take the next job from the buffer and call the variant.
+ * The writer (the main thread) prints the calls in the order of the input
+ * as soon as they are done, after which the slot is used again by the
+ * reader. The model parameters are passed to every call (see model in
+ * smc_likelihood.h), so there is no shared state other than the buffer.
+ */
+
+#define JOBS_PER_THREAD 	64 	/* # of slots in the ring buffer per worker thread */
+#define LENGTH_CALL_BUFFER 	512 	/* # of characters allocated for one line of output */
+
+/*
+ * One variant in the ring buffer
+ */
+typedef struct {
+	variant v ;
+	data D ; 			// allocated from the arena below
+	arena A ; 			// reset when the reader puts the next variant in the slot
+	size_t status ; 		// as returned by obtainVariant
+	short done ; 			// 1 when the call is in the buffer below
+	short called ; 			// 1 when the posterior probabilities are computed
+	size_t n_evaluations ; 		// # of likelihood evaluations for the posterior probabilities
+	size_t n_iterations ; 		// # of iterations of the solver for the MLE (for all h_vaf)
+	size_t n_fallbacks ; 		// # of times Newton's method fell back to Brent
+	char call[LENGTH_CALL_BUFFER] ; // line of output
+} job ;
+
+/*
+ * Ring buffer of jobs shared by the reader, workers and writer. Job i (counted
+ * from the start of the input) is stored in slot i % n_jobs.
+ */
+typedef struct {
+	job* jobs ;
+	size_t n_jobs ;
+	size_t n_read ; 		// # of jobs put in the buffer by the reader
+	size_t n_claimed ; 		// # of jobs taken by the workers
+	size_t n_written ; 		// # of jobs printed by the writer
+	short end_reached ; 		// 1 when the reader is done
+	short eof_reached ; 		// 1 when the reader reached the end of the file (not of the region)
+	size_t n_called ; 		// # of variants for which the posterior probabilities are computed
+	size_t n_evaluations ; 		// total # of likelihood evaluations for the posterior probabilities
+	size_t n_iterations ; 		// total # of iterations of the solver for the MLE
+	size_t max_iterations ; 	// max. # of iterations of the solver for one variant
+	size_t n_fallbacks ; 		// total # of times Newton's method fell back to Brent
+
+	pthread_mutex_t lock ;
+	pthread_cond_t slot_free ; 	// signals the reader
+	pthread_cond_t job_read ; 	// signals the workers
+	pthread_cond_t job_done ; 	// signals the writer
+
+	text_observations* T ; 		// input (text format) or
+	binary_observations* B ; 	// input (binary format)
+	parameters* p ;
+} pipeline ;
+
+/* Calls one variant and stores the line of output in the job (cache: insert size PMFs of the thread) */
+void callVariant(job* J, parameters* p, pmf_cache* cache) ;
+
+/* Reads the variants and calls them with p->n_threads worker threads. The calls are printed in the order of the input. */
+void callVariants(text_observations* T, binary_observations* B, parameters* p) ;
+
+#endif
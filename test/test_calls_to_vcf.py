@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) 2015 Louis Dijkstra
+
+This file is part of somatic-indel-calling
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function, division
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+__author__ = "Louis Dijkstra"
+
+DATA_DIRECTORY 	= os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+SCRIPT 		= os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin', 'calls-to-vcf.py')
+
+class TestCallsToVCF(unittest.TestCase):
+
+	def setUp(self):
+		# the table of indels is stored next to the VCF file 
+		self.directory = tempfile.mkdtemp()
+		shutil.copy(os.path.join(DATA_DIRECTORY, 'same-position.vcf'), self.directory)
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def returnSomaticRecords(self, *options):
+		"""Runs calls-to-vcf.py and returns the records in the new VCF file."""
+		new_vcf_filename = os.path.join(self.directory, 'somatic.vcf')
+		status = subprocess.call([sys.executable, SCRIPT] + list(options) + [os.path.join(self.directory, 'same-position.vcf'), 
+				os.path.join(DATA_DIRECTORY, 'same-position.calls'), new_vcf_filename], stdout = open(os.devnull, 'w'))
+		self.assertEqual(status, 0)
+		return [line.rstrip('\n') for line in open(new_vcf_filename) if not line.startswith('#')]
+
+	def testIndelsAtTheSamePosition(self):
+		"""A SNP, two deletions and two insertions of the same length share a position. 
+		   Every call is matched to its own record."""
+		expected = ['1\t100\t.\tACGT\tA\t.\tPASS\tSOMATIC;END=104;SVLEN=-4', 
+				'1\t100\t.\tAC\tA\t.\tPASS\tSOMATIC;END=102;SVLEN=-2', 
+				'1\t100\t.\tA\tAGG\t.\tPASS\tSOMATIC;END=100;SVLEN=1', 
+				'1\t100\t.\tA\tATT\t.\tPASS\tSOMATIC;END=100;SVLEN=1']
+		self.assertEqual(self.returnSomaticRecords(), expected)
+		self.assertEqual(self.returnSomaticRecords(), expected) # the stored table is used
+		self.assertEqual(self.returnSomaticRecords('-H', '100'), expected)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) 2015 Louis Dijkstra
+
+This file is part of somatic-indel-calling
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function, division
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python'))
+from Indel import *
+
+__author__ = "Louis Dijkstra"
+
+DATA_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+class TestReadIndels(unittest.TestCase):
+
+	def testWithoutStructuralVariantHeader(self):
+		"""SVTYPE and SVLEN are not defined in the header; the indels follow from REF and ALT 
+		   as for PyVCF records (see isDeletion, isInsertion and returnIndelLength)."""
+		vcf_filename 	= os.path.join(DATA_DIRECTORY, 'no-sv-header.vcf')
+		expected 	= [('-' if isDeletion(record) else '+', str(record.CHROM), record.POS, returnIndelLength(record)) for record in vcf.Reader(filename = vcf_filename)]
+		indels 		= list(readIndels(vcf_filename))
+		self.assertEqual([(indel.variant_type, indel.chromosome, indel.position, indel.length) for indel in indels], expected)
+		self.assertEqual(expected, [('-', '1', 100, 4), ('+', '1', 200, 1), ('-', '1', 300, 50)])
+
+	def testIndelTableWithoutStructuralVariantHeader(self):
+		table = IndelTable.fromVCF(os.path.join(DATA_DIRECTORY, 'no-sv-header.vcf'))
+		self.assertEqual(table.length.tolist(), [4, 1, 50])
+		self.assertEqual(table.variant_type.tolist(), [b'-', b'+', b'-'])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) 2015 Louis Dijkstra
+
+This file is part of somatic-indel-calling
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function, division
+import os
+import subprocess
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python'))
+from Observations import *
+from Likelihood import *
+
+__author__ = "Louis Dijkstra"
+
+DATA_DIRECTORY 	= os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+BIN_DIRECTORY 	= os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin')
+SM_CALLER 	= os.path.join(BIN_DIRECTORY, 'sm_caller') # see CMakeLists.txt
+OBSERVATIONS 	= os.path.join(DATA_DIRECTORY, 'likelihood.raw-observations') # with <value>:<count> observations
+CALLS 		= os.path.join(DATA_DIRECTORY, 'likelihood.calls') # output of sm_caller (default parameters)
+
+TOLERANCE 	= 1e-5 		# as in compare-calls.py (-t)
+EPSABS 		= 0.0001 	# tolerance of the minimizer (-P)
+
+def readCalls (calls_file):
+	"""Returns the fields of every call in an output file of sm_caller."""
+	return [line.split() for line in calls_file if len(line.split()) == 10]
+
+class TestLikelihood(unittest.TestCase):
+
+	def assertEqualCall(self, values, call):
+		"""Asserts that the call of sm_caller (values) and the Python call are equal within the
+		   tolerances of compare-calls.py (see equalCalls)."""
+		self.assertNotEqual(values[4], '.')
+		self.assertNotEqual(call, None)
+		h_vaf, c_vaf, logl, p_somatic, p_germline, p_not_present = map(float, values[4:])
+		self.assertAlmostEqual(c_vaf, call[1], delta = EPSABS + 1e-6) # the output of sm_caller is rounded to 6 decimals
+		self.assertAlmostEqual(logl, call[2], delta = TOLERANCE * max(1.0, abs(logl)))
+		for (value, computed) in zip((h_vaf, p_somatic, p_germline, p_not_present), (call[0],) + call[3:]):
+			self.assertAlmostEqual(value, computed, delta = TOLERANCE)
+
+	def testCallsOfSmCaller(self):
+		"""The NumPy implementation reproduces the calls of sm_caller for insertions and deletions,
+		   among which an insertion whose call depends on the sign of delta."""
+		with open(OBSERVATIONS, 'r') as obs_file:
+			calls = list(callVariants(readRawObservations(obs_file), ModelParameters()))
+		with open(CALLS, 'r') as calls_file:
+			expected = readCalls(calls_file)
+		self.assertEqual(len(calls), len(expected))
+		self.assertEqual(set([call[0] for call in calls]), set(['+', '-']))
+		for (values, (variant_type, chromosome, position, length, call)) in zip(expected, calls):
+			self.assertEqual(values[:4], [variant_type, chromosome, str(position), str(length)])
+			self.assertEqualCall(values, call)
+
+	@unittest.skipUnless(os.path.exists(SM_CALLER), 'sm_caller is not built')
+	def testSmCaller(self):
+		"""sm_caller itself still returns the stored calls."""
+		output = subprocess.check_output([SM_CALLER, OBSERVATIONS]).decode()
+		with open(CALLS, 'r') as calls_file:
+			expected = readCalls(calls_file)
+		calls = readCalls(output.splitlines())
+		self.assertEqual([values[:4] for values in calls], [values[:4] for values in expected])
+		for (values, expected_values) in zip(calls, expected):
+			self.assertEqualCall(values, tuple(map(float, expected_values[4:])))
+
+if __name__ == '__main__':
+	unittest.main()
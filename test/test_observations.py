@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) 2015 Louis Dijkstra
+
+This file is part of somatic-indel-calling
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import print_function, division
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python'))
+from Observations import *
+
+__author__ = "Louis Dijkstra"
+
+DATA_DIRECTORY 	= os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+BIN_DIRECTORY 	= os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin')
+SCRIPT 		= os.path.join(BIN_DIRECTORY, 'convert-observations.py')
+SM_CALLER 	= os.path.join(BIN_DIRECTORY, 'sm_caller') # see CMakeLists.txt
+OBSERVATIONS 	= os.path.join(DATA_DIRECTORY, 'observations.raw-observations')
+
+def returnSortedObservations (observations_filename):
+	"""Returns for every variant in a text observations file its type, chromosome, position and
+	   length and the observations (value and probability) of both samples in sorted order, since
+	   compressed files store identical observations once in sorted order."""
+	variants = []
+	with open(observations_filename, 'r') as obs_file:
+		for (variant_type, chromosome, position, length, healthy, cancer) in readRawObservations(obs_file):
+			sample_observations = []
+			for (isize, isize_prob, splits, splits_prob) in (healthy, cancer):
+				sample_observations.append(sorted(zip(isize.tolist(), isize_prob.tolist())))
+				sample_observations.append(sorted(zip(splits.tolist(), splits_prob.tolist())))
+			variants.append((variant_type, chromosome, position, length, sample_observations))
+	return variants
+
+def replaceValue (data, offset, value, dtype):
+	"""Returns the data with the value (of the given type) written at the offset."""
+	return data[:offset] + np.array([value], dtype = dtype).tobytes() + data[offset + np.dtype(dtype).itemsize:]
+
+class TestBinaryObservations(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def convert(self, input_filename, output_filename, *options):
+		"""Runs convert-observations.py (text -> binary or binary -> text)."""
+		with open(output_filename, 'wb') as output_file:
+			status = subprocess.call([sys.executable, SCRIPT] + list(options) + [input_filename], stdout = output_file)
+		self.assertEqual(status, 0)
+
+	def returnRoundTrip(self, *options):
+		"""Converts the observations to the binary format and back; returns the names of both files."""
+		binary_filename = os.path.join(self.directory, 'observations.bin')
+		text_filename 	= os.path.join(self.directory, 'observations.txt')
+		self.convert(OBSERVATIONS, binary_filename, *options)
+		self.convert(binary_filename, text_filename, *options)
+		return binary_filename, text_filename
+
+	def testRoundTrip(self):
+		binary_filename, text_filename = self.returnRoundTrip()
+		self.assertTrue(isBinaryObservationsFile(binary_filename))
+		self.assertEqual(open(text_filename).read(), open(OBSERVATIONS).read())
+
+	def testRoundTripCompressed(self):
+		"""Identical observations are stored once with their count, i.e., as <value>:<count> in the text format."""
+		binary_filename, text_filename = self.returnRoundTrip('--compress')
+		with open(binary_filename, 'rb') as binary_file:
+			self.assertEqual(binary_file.read(len(MAGIC2)), MAGIC2)
+		self.assertTrue(':' in open(text_filename).read())
+		self.assertEqual(returnSortedObservations(text_filename), returnSortedObservations(OBSERVATIONS))
+
+		expanded_filename = os.path.join(self.directory, 'expanded.txt')
+		self.convert(binary_filename, expanded_filename)
+		self.assertFalse(':' in open(expanded_filename).read())
+		self.assertEqual(returnSortedObservations(expanded_filename), returnSortedObservations(OBSERVATIONS))
+
+	@unittest.skipUnless(os.path.exists(SM_CALLER), 'sm_caller is not built')
+	def testCallerReadsAllFormats(self):
+		"""sm_caller returns the same calls for the text file and the (compressed) binary files."""
+		calls = [subprocess.check_output([SM_CALLER, OBSERVATIONS])]
+		for options in ([], ['--compress']):
+			calls.append(subprocess.check_output([SM_CALLER, self.returnRoundTrip(*options)[0]]))
+		self.assertTrue(len(calls[0].splitlines()) > 0)
+		self.assertEqual(calls[1], calls[0])
+		self.assertEqual(calls[2], calls[0])
+
+	@unittest.skipUnless(os.path.exists(SM_CALLER), 'sm_caller is not built')
+	def testInvalidFile(self):
+		"""sm_caller refuses binary files that are truncated or whose variants refer to 
+		   observations or chromosomes that are not in the file."""
+		binary_filename = self.returnRoundTrip()[0]
+		data 	= open(binary_filename, 'rb').read()
+		header 	= np.frombuffer(data[:HEADER_DTYPE.itemsize], dtype = HEADER_DTYPE)[0]
+		variant = int(header['variants_offset']) # first row of the variant table (see VARIANT_DTYPE)
+		invalid_data = [data[:len(data) // 2], 
+				data[:len(data) - 8], 
+				replaceValue(data, 8, 10**9, '<u8'), 					# more variants than the file holds
+				replaceValue(data, variant + 16, header['n_chromosomes'], '<u4'), 	# unknown chromosome
+				replaceValue(data, variant + 32, header['n_isize'], '<u8')] 		# insert sizes of the cancer sample beyond n_isize
+		for invalid in invalid_data:
+			invalid_filename = os.path.join(self.directory, 'invalid.bin')
+			with open(invalid_filename, 'wb') as invalid_file:
+				invalid_file.write(invalid)
+			process = subprocess.Popen([SM_CALLER, invalid_filename], stdout = subprocess.PIPE)
+			output = process.communicate()[0]
+			self.assertNotEqual(process.returncode, 0)
+			self.assertTrue(b'not a valid binary observations file' in output)
+
+if __name__ == '__main__':
+	unittest.main()